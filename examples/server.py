@@ -5,6 +5,7 @@ import io
 
 from gtftp.server import Server
 from gtftp.handler import BaseReadHandler, BaseWriteHandler, Target
+from gtftp.target import preallocate
 from gtftp.packet import *
 
 
@@ -16,9 +17,23 @@ class LocalFileTarget(Target):
     def read(self, n):
         return self._target.read(n)
 
+    def readinto(self, buffer):
+        return self._target.readinto(buffer)
+
     def write(self, data):
         self._target.write(data)
 
+    def sync(self):
+        self._target.flush()
+        os.fsync(self._target.fileno())
+
+    def allocate(self, size):
+        preallocate(self._target.fileno(), size)
+
+    def truncate(self, size):
+        self._target.flush()
+        self._target.truncate(size)
+
     def size(self):
         return self._size
 
@@ -66,9 +81,9 @@ class StaticWriteHandler(BaseWriteHandler):
 
 
 class StaticServer(Server):
-    def __init__(self, ip='0.0.0.0', port=69, retries=3, timeout=5, concurrency=None, root='.'):
+    def __init__(self, ip='0.0.0.0', port=69, retries=3, timeout=5, concurrency=None, root='.', workers=None):
         self._root = os.path.abspath(root)
-        super(StaticServer, self).__init__(ip, port, retries, timeout, concurrency)
+        super(StaticServer, self).__init__(ip, port, retries, timeout, concurrency, workers)
 
 
     def get_hanlder(self, req, server_addr, peer, retries, timeout):
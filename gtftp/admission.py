@@ -0,0 +1,182 @@
+# -*- coding:utf-8 -*-
+
+"""
+    Admission of requests, instead of a blocking pool of sessions.
+
+    With concurrency=N, a full pool stops the server from reading its
+    socket, and requests overflow the kernel receive buffer, lost at
+    random. An Admission runs at most max_active sessions, and keeps
+    the requests arriving meanwhile in a bounded queue (no greenlet
+    yet), started as sessions end:
+
+        - a request waiting more than max_wait seconds is discarded
+          (its client has given up, or retransmitted it), as requests
+          arrive and sessions end;
+        - when the queue is full, a request of lower priority than
+          the queued ones is shed, the newest of the lowest priority
+          queued is shed otherwise;
+        - requests of higher priority (lower number) are started
+          first, see Priority;
+        - a shed request is answered with ERROR (server busy), or
+          dropped, after policy.
+
+    Usage:
+        Server.ADMISSION = Admission(
+            max_active=200, max_queued=1000, max_wait=2.0,
+            priority=Priority(paths=[(u'pxelinux', 0)], default=1)
+        )
+"""
+
+import ipaddress
+import time
+from collections import deque
+
+
+class Priority(object):
+    """
+        Priority of a request by path prefix or source subnet, lower
+        is started first. The first matching rule gives it: paths,
+        then subnets, default if none matches.
+
+        paths -> [(path prefix, priority)]
+        subnets -> [(network, e.g. u'10.1.0.0/16', priority)]
+    """
+
+    def __init__(self, paths=None, subnets=None, default=0):
+        self._paths = [(p if isinstance(p, unicode) else str(p).decode(u'utf-8'), v) for p, v in paths or ()]
+        self._subnets = [(ipaddress.ip_network(unicode(n)), v) for n, v in subnets or ()]
+        self._default = default
+
+    def __call__(self, path, peer):
+        for prefix, priority in self._paths:
+            if path.startswith(prefix):
+                return priority
+
+        if self._subnets:
+            ip = peer[0]
+            if not isinstance(ip, unicode):
+                ip = str(ip).decode(u'utf-8')
+            ip = ipaddress.ip_address(ip.replace(u'::ffff:', u''))
+            for network, priority in self._subnets:
+                if ip.version == network.version and ip in network:
+                    return priority
+
+        return self._default
+
+
+class Admission(object):
+    """
+        Bounded queue of requests waiting for a session slot.
+
+        max_active -> sessions running at once.
+        max_queued -> requests waiting.
+        max_wait -> seconds a request can wait.
+        priority -> priority(path, peer), e.g. a Priority,
+                    None: all requests alike.
+        policy -> Admission.ERROR or Admission.DROP, for shed requests.
+    """
+
+    ERROR = u'error'    # answer ERROR (server busy)
+    DROP = u'drop'      # no answer, client retransmits or gives up
+
+    def __init__(self, max_active=100, max_queued=1000, max_wait=2.0, priority=None, policy=ERROR):
+        assert policy in (self.ERROR, self.DROP)
+        self._max_active = int(max_active)
+        self._max_queued = int(max_queued)
+        self._max_wait = float(max_wait)
+        self._priority = priority
+        self._policy = policy
+
+        self._active = 0
+        self._queues = {}       # priority -> deque([(expires, data, peer)]), oldest first
+        self._queued = set()    # (data, peer) waiting, to drop retransmissions
+
+        self._admitted = 0
+        self._shed = 0
+        self._expired = 0       # of shed
+
+    @property
+    def policy(self):
+        return self._policy
+
+    def stats(self):
+        return {
+            u'active': self._active,
+            u'queued': len(self._queued),
+            u'admitted': self._admitted,
+            u'shed': self._shed,
+            u'expired': self._expired,
+        }
+
+    def admit(self, data, peer):
+        """
+            a request (RRQ/WRQ datagram) arrives.
+            return (start, shed):
+                start -> True if it can start now, as a session.
+                shed -> [(data, peer)] of requests shed.
+        """
+        if self._active < self._max_active and not self._queued:
+            self._active += 1
+            self._admitted += 1
+            return True, []
+
+        key = (data, peer)
+        if key in self._queued:
+            # retransmitted, it keeps its place.
+            return False, []
+
+        now = time.time()
+        shed = self._expire(now)
+
+        priority = self._priority_of(data, peer)
+        if len(self._queued) >= self._max_queued:
+            # no queue (max_queued=0): nothing to shed instead.
+            lowest = max([p for p, queue in self._queues.iteritems() if queue] or [None])
+            if lowest is None or priority >= lowest:
+                self._shed += 1
+                shed.append(key)
+                return False, shed
+            _, old_data, old_peer = self._queues[lowest].pop()
+            self._queued.discard((old_data, old_peer))
+            self._shed += 1
+            shed.append((old_data, old_peer))
+
+        self._queues.setdefault(priority, deque()).append((now + self._max_wait, data, peer))
+        self._queued.add(key)
+        return False, shed
+
+    def release(self):
+        """
+            a session ends.
+            return (next, shed):
+                next -> (data, peer) of the request to start, or None.
+                shed -> [(data, peer)] of requests which waited too long.
+        """
+        self._active -= 1
+        shed = self._expire(time.time())
+
+        for priority in sorted(p for p, queue in self._queues.iteritems() if queue):
+            _, data, peer = self._queues[priority].popleft()
+            self._queued.discard((data, peer))
+            self._active += 1
+            self._admitted += 1
+            return (data, peer), shed
+        return None, shed
+
+    def _expire(self, now):
+        shed = []
+        for queue in self._queues.itervalues():
+            while queue and queue[0][0] <= now:
+                _, data, peer = queue.popleft()
+                self._queued.discard((data, peer))
+                self._shed += 1
+                self._expired += 1
+                shed.append((data, peer))
+        return shed
+
+    def _priority_of(self, data, peer):
+        if self._priority is None:
+            return 0
+        # path of RRQ/WRQ, checked by Server.accept_request()
+        path = data[2:data.find('\x00', 2)].decode(u'utf-8', u'replace')
+        return self._priority(path, peer)
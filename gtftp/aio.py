@@ -0,0 +1,418 @@
+# -*- coding:utf-8 -*-
+
+"""
+    asyncio engine: TFTP sessions as state machines driven by
+    DatagramProtocol callbacks, instead of greenlets.
+
+    Sessions reuse the packet handling and option negotiation of
+    BaseReadHandler/BaseWriteHandler, only I/O and timers differ: no
+    greenlet, no blocking call, a session runs when a datagram for it
+    arrives or its retransmission timer expires.
+
+    On Python 2, trollius provides asyncio. uvloop is used when
+    installed (see new_event_loop()).
+
+    Usage, like gtftp.server.Server:
+        class AsyncStaticReadHandler(AsyncReadHandler, StaticReadHandler):
+            pass
+
+        class MyServer(AsyncServer):
+            def get_hanlder(self, req, server_addr, peer, retries, timeout):
+                return AsyncStaticReadHandler(req, server_addr, peer, retries, timeout, root)
+
+        MyServer(u'0.0.0.0', 69, loop=new_event_loop()).serve()
+
+    Or, embedded in an application running its own loop:
+        yield From(server.start())      # await server.start()
+
+    Not supported by async sessions: congestion control pacing,
+    multicast, shared transfer sockets, read-ahead, threadpool offload
+    and write-behind (CONGESTION_CONTROL, MULTICAST, MUX, PREFETCH,
+    OFFLOAD, WRITE_BEHIND).
+"""
+
+import socket
+import time
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+from .packet import *
+from .handler import BaseReadHandler, BaseWriteHandler
+from .logger import logger
+
+
+def new_event_loop():
+    """
+        a uvloop loop if uvloop is installed, else a default asyncio loop.
+    """
+    if uvloop is not None:
+        return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+class _TransportSocket(object):
+    """
+        The socket methods handlers call, on a datagram transport.
+        It has no fileno(), batched sends fall back to sendto().
+    """
+
+    def __init__(self, transport):
+        self._transport = transport
+        self.family = transport.get_extra_info(u'socket').family
+
+    def sendto(self, data, address):
+        if isinstance(data, buffer):
+            # frames of pre-framed images
+            data = bytes(data)
+        self._transport.sendto(data, address)
+
+    def getsockname(self):
+        return self._transport.get_extra_info(u'sockname')
+
+    def close(self):
+        self._transport.close()
+
+
+class _SessionProtocol(asyncio.DatagramProtocol):
+    def __init__(self, session):
+        self._session = session
+
+    def connection_made(self, transport):
+        self._session._connection_made(transport)
+
+    def datagram_received(self, data, addr):
+        self._session._datagram_received(data, addr)
+
+    def error_received(self, exc):
+        logger.warning(u'Transfer socket error: %s' % exc)
+
+
+class AsyncSession(object):
+    """
+        Event driven run loop of a handler, mixed in before
+        BaseReadHandler/BaseWriteHandler.
+    """
+
+    CONGESTION_CONTROL = False
+    MULTICAST = None
+    MUX = None
+    PREFETCH = None
+    OFFLOAD = None
+    WRITE_BEHIND = None
+
+    def start(self, loop, done=None):
+        """
+            open the transfer socket on loop and start the session,
+            done() is called when it ends.
+        """
+        self._loop = loop
+        self._done = done
+        self._timer = None          # loop timer handle
+        self._timer_at = None       # when it fires
+        self._expires_at = None     # retransmission deadline, None if not armed
+        self._ended = False
+
+        task = loop.create_task(loop.create_datagram_endpoint(
+            lambda: _SessionProtocol(self),
+            local_addr=(self._ip, 0), family=self._family
+        ))
+        task.add_done_callback(self._endpoint_created)
+
+    def _endpoint_created(self, task):
+        if task.cancelled() or task.exception() is not None:
+            logger.error(u'Cannot open transfer socket: %s' % task.exception())
+            self._end()
+
+    def _connection_made(self, transport):
+        self._listener = _TransportSocket(transport)
+        # not before the transport is set up (its reader registered
+        # by a callback queued meanwhile): a session rejected at once
+        # closes it.
+        self._loop.call_soon(self._call, self._begin)
+
+    def _datagram_received(self, data, addr):
+        if not self._ended:
+            self._call(self._on_packet, data, addr)
+
+    def _before_run(self):
+        """
+            the transfer socket is opened by start().
+        """
+        self._target = self.get_target(self._req.path)
+        if self._req.mode == Request.MODE_NETASCII:
+            self._target = self._netascii_target(self._target)
+
+    def _call(self, func, *args):
+        """
+            run a step of the session, end it as run() does.
+        """
+        try:
+            func(*args)
+            if self._should_stop:
+                logger.info(u'Session ends, peer: (%s, %d)' % (self._peer[0], self._peer[1]))
+                self._end()
+
+        except Error as e:
+            logger.error(
+                u"End session is ended by server, code: %d, message: %s" % \
+                (e.code, e.message)
+            )
+            if self._listener is not None:
+                self._transmit(e)
+            self._end()
+
+        except PeerError as e:
+            logger.error(
+                u'Session is ended by peer, code: %d, message: %s' % \
+                (e.code, e.message)
+            )
+            self._end()
+
+        except TransmitTimeout as e:
+            logger.error(u'Timeout after %d times of retransmission' % self._retries)
+            self._end()
+
+        except Exception:
+            logger.exception(u'Session failed, peer: (%s, %d)' % (self._peer[0], self._peer[1]))
+            self._end()
+
+    def _end(self):
+        if self._ended:
+            return
+        self._ended = True
+        self._expires_at = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        self._close()
+        if self._done is not None:
+            self._done()
+
+    def _arm(self):
+        """
+            (re)start retransmission timer.
+            A timer pushed back is not rescheduled, it checks the
+            deadline when it fires.
+        """
+        self._expires_at = self._loop.time() + self._rtt.timeout
+        if self._timer is None or self._expires_at < self._timer_at:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer_at = self._expires_at
+            self._timer = self._loop.call_at(self._timer_at, self._on_timer)
+
+    def _disarm(self):
+        self._expires_at = None
+
+    def _on_timer(self):
+        self._timer = None
+        if self._expires_at is None or self._ended:
+            return
+
+        if self._expires_at > self._loop.time():
+            self._timer_at = self._expires_at
+            self._timer = self._loop.call_at(self._timer_at, self._on_timer)
+            return
+
+        self._expires_at = None
+        self._call(self._on_timeout)
+
+    def _on_timeout(self):
+        self._handle_timeout()
+        self._arm()
+
+
+class AsyncReadHandler(AsyncSession, BaseReadHandler):
+    """
+        RRQ session, subclass or mix it with a BaseReadHandler
+        subclass providing get_target().
+    """
+
+    def _join_multicast(self):
+        return False
+
+    def _begin(self):
+        self._before_run()
+        self._handle_rrq()
+        if not self._should_stop:
+            self._arm()
+
+    def _on_packet(self, data, peer):
+        block_num = self._parse_ack(data, peer)
+        if self._slide_window(block_num):
+            self._disarm()
+            self._handle_ack()
+            if not self._should_stop:
+                self._arm()
+        elif block_num == self._last_acked:
+            self._handle_dup_ack()
+
+
+class AsyncWriteHandler(AsyncSession, BaseWriteHandler):
+    """
+        WRQ session, subclass or mix it with a BaseWriteHandler
+        subclass providing get_target().
+    """
+
+    def _begin(self):
+        self._before_run()
+        self._handle_wrq()
+        self._arm()
+
+    def _on_packet(self, block, peer):
+        data = self._parse_data(block, peer)
+        if self._accept_block(data):
+            self._disarm()
+            self._handle_data(data)
+            if not self._should_stop:
+                self._arm()
+
+
+class _ServerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self._server = server
+
+    def datagram_received(self, data, addr):
+        self._server.handle_request(data, addr)
+
+    def error_received(self, exc):
+        logger.warning(u'Server socket error: %s' % exc)
+
+
+class AsyncServer(object):
+    """
+        TFTP server on an asyncio event loop,
+        override get_hanlder() as with gtftp.server.Server.
+    """
+
+    def __init__(self, ip='0.0.0.0', port=69, retries=3, timeout=5, loop=None):
+        """
+            loop -> event loop to run on, default: the current one.
+        """
+        self._ip = ip
+        self._port = port
+        self._retries = retries
+        self._timeout = timeout
+        self._loop = loop if loop is not None else asyncio.get_event_loop()
+        self._transport = None
+
+        self._stats = {
+            u'requests': 0,         # datagrams received on server port
+            u'invalid': 0,          # not a request
+            u'sessions': 0,         # sessions started
+            u'active': 0,           # sessions running
+            u'duplicates': 0,       # requests of a running session
+        }
+        self._sessions = {}         # (peer, opcode, path) -> session info
+
+    @property
+    def loop(self):
+        return self._loop
+
+    @property
+    def host(self):
+        if self._transport is None:
+            return self._ip
+        return self._transport.get_extra_info(u'sockname')[0]
+
+    @property
+    def port(self):
+        if self._transport is None:
+            return self._port
+        return self._transport.get_extra_info(u'sockname')[1]
+
+    def stats(self):
+        return dict(self._stats)
+
+    def sessions(self):
+        """
+            running sessions, as gtftp.server.Server.sessions().
+        """
+        return [dict(session) for session in self._sessions.itervalues()]
+
+    def start(self):
+        """
+            bind server port, return a future done when listening.
+        """
+        family = socket.AF_INET6 if u':' in unicode(self._ip) else socket.AF_INET
+        task = self._loop.create_task(self._loop.create_datagram_endpoint(
+            lambda: _ServerProtocol(self),
+            local_addr=(self._ip, self._port), family=family
+        ))
+        task.add_done_callback(self._listening)
+        return task
+
+    def _listening(self, task):
+        if not task.cancelled() and task.exception() is None:
+            self._transport = task.result()[0]
+
+    def serve(self):
+        self._loop.run_until_complete(self.start())
+        try:
+            self._loop.run_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+    def handle_request(self, data, peer):
+        """
+            called by the event loop for each datagram on server port.
+        """
+        self._stats[u'requests'] += 1
+
+        req = Request.parse(data)
+        if not req:
+            self._stats[u'invalid'] += 1
+            return
+
+        key = (peer, req.opcode, req.path)
+        if key in self._sessions:
+            # retransmitted by peer, the running session answers it.
+            self._stats[u'duplicates'] += 1
+            return
+
+        try:
+            session = self.get_hanlder(
+                req, (self.host, self.port), peer,
+                self._retries, self._timeout
+            )
+        except Exception:
+            logger.exception(u'No handler for request')
+            return
+
+        self._sessions[key] = {
+            u'peer': peer,
+            u'opcode': req.opcode,
+            u'path': req.path,
+            u'mode': req.mode,
+            u'options': dict(req.options),
+            u'started': time.time(),
+        }
+        self._stats[u'sessions'] += 1
+        self._stats[u'active'] += 1
+        session.start(self._loop, lambda: self._session_done(key))
+
+    def _session_done(self, key):
+        self._stats[u'active'] -= 1
+        del self._sessions[key]
+
+    def get_hanlder(self, req, server_addr, peer, retries, timeout):
+        """
+            override this method to offer a session, an instance of
+            AsyncReadHandler or AsyncWriteHandler (subclass).
+            parameters are the same as gtftp.server.Server.get_hanlder.
+        """
+        raise NotImplemented()
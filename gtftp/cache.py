@@ -0,0 +1,182 @@
+# -*- coding:utf-8 -*-
+
+import os
+from collections import OrderedDict
+
+from gevent.monkey import get_original
+
+from .handler import Target
+from .target import MmapFileTarget
+
+
+class CachedTarget(Target):
+    """
+        Read-only target on content held by a FileCache.
+        Content is shared by all sessions reading the same file.
+    """
+
+    def __init__(self, content):
+        self._content = memoryview(content)
+        self._pos = 0
+
+    def seek(self, offset):
+        self._pos = min(max(int(offset), 0), len(self._content))
+
+    def tell(self):
+        return self._pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self._content) - self._pos
+        data = self._content[self._pos:self._pos + size].tobytes()
+        self._pos += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self._content[self._pos:self._pos + len(buffer)]
+        n = len(data)
+        buffer[:n] = data
+        self._pos += n
+        return n
+
+    def size(self):
+        return len(self._content)
+
+    def close(self):
+        self._content = memoryview('')
+
+
+class FileCache(object):
+    """
+        Server wide cache of files served to read requests.
+
+        Content of a file is loaded once and shared by all sessions,
+        entries are keyed by path and validated by (mtime, size) on
+        every access, so a changed file is reloaded.
+        Least recently used entries are evicted to keep total size
+        under max_bytes, files larger than max_file_size are not cached.
+
+        Content is cached as is, sessions with different blksize
+        (or netascii mode, converted on top of target) share it.
+
+        get_target() is thread-safe, it can run in the threadpool of
+        gtftp.offload; files are read outside of the lock.
+
+        Usage, in a read handler:
+            cache = FileCache(256 * 1024 * 1024)
+
+            def get_target(self, path):
+                return cache.get_target(os.path.join(self._root, path))
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_file_size=None):
+        self._max_bytes = int(max_bytes)
+        if max_file_size is None:
+            max_file_size = self._max_bytes
+        self._max_file_size = min(int(max_file_size), self._max_bytes)
+
+        self._entries = OrderedDict()   # path -> ((mtime, size), content), LRU first
+        self._bytes = 0
+        # a lock of real threads, even if threading is monkey patched.
+        self._lock = get_original('thread', 'allocate_lock')()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    @property
+    def evictions(self):
+        return self._evictions
+
+    @property
+    def invalidations(self):
+        return self._invalidations
+
+    @property
+    def size(self):
+        """
+            total bytes of cached content.
+        """
+        return self._bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            u'hits': self._hits,
+            u'misses': self._misses,
+            u'evictions': self._evictions,
+            u'invalidations': self._invalidations,
+            u'entries': len(self._entries),
+            u'bytes': self._bytes,
+        }
+
+    def get_target(self, path):
+        """
+            Return a target on the content of file at path.
+            Raise IOError/OSError as open() does.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        key = (st.st_mtime, st.st_size)
+
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                if entry[0] == key:
+                    self._hits += 1
+                    self._entries[path] = entry     # most recently used
+                    return CachedTarget(entry[1])
+
+                # file changed
+                self._invalidations += 1
+                self._bytes -= len(entry[1])
+
+            self._misses += 1
+
+        if st.st_size > self._max_file_size:
+            return MmapFileTarget(path)
+
+        with open(path, 'rb') as f:
+            content = f.read()
+
+        with self._lock:
+            # also loaded by another session meanwhile.
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self._bytes -= len(entry[1])
+            self._entries[path] = (key, content)
+            self._bytes += len(content)
+            self._evict()
+
+        return CachedTarget(content)
+
+    def invalidate(self, path=None):
+        """
+            drop cached file at path, or all files.
+        """
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+
+            entry = self._entries.pop(os.path.abspath(path), None)
+            if entry is not None:
+                self._bytes -= len(entry[1])
+
+    def _evict(self):
+        while self._bytes > self._max_bytes and self._entries:
+            _, (_, content) = self._entries.popitem(last=False)
+            self._bytes -= len(content)
+            self._evictions += 1
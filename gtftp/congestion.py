@@ -0,0 +1,55 @@
+# -*- coding:utf-8 -*-
+
+
+class AimdController(object):
+    """
+        AIMD (additive increase, multiplicative decrease) control of
+        the number of blocks a session sends per round trip.
+
+        Slow start doubles the window on each clean round until ssthresh,
+        then it grows by one block per round.
+        Lost blocks (duplicate or partial ACKs) halve the window,
+        timeout shrinks it to one block.
+        Window is always in range [1, max_window].
+    """
+
+    INITIAL_WINDOW = 4
+
+    def __init__(self, max_window, initial_window=None):
+        self._max = max(int(max_window), 1)
+
+        if initial_window is None:
+            initial_window = self.INITIAL_WINDOW
+        self._cwnd = self._bound(initial_window)
+        self._ssthresh = self._max
+
+    def _bound(self, value):
+        return min(max(int(value), 1), self._max)
+
+    @property
+    def window(self):
+        return self._cwnd
+
+    @property
+    def max_window(self):
+        return self._max
+
+    def on_round(self):
+        """
+            a round of blocks is acked without loss.
+        """
+        if self._cwnd < self._ssthresh:
+            self._cwnd = self._bound(min(self._cwnd * 2, self._ssthresh))
+        else:
+            self._cwnd = self._bound(self._cwnd + 1)
+
+    def on_loss(self):
+        """
+            a lost block is reported by peer.
+        """
+        self._ssthresh = self._bound(self._cwnd // 2)
+        self._cwnd = self._ssthresh
+
+    def on_timeout(self):
+        self._ssthresh = self._bound(self._cwnd // 2)
+        self._cwnd = 1
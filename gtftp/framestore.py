@@ -0,0 +1,345 @@
+# -*- coding:utf-8 -*-
+
+"""
+    Pre-framed packet store for static images.
+
+    For a given blksize, a file is stored as contiguous, ready to send
+    DATA packets (header and payload, block numbers with rollover), so
+    read handlers send slices of a memory mapping and never build
+    packets for it.
+
+    Store file layout:
+        header (32 bytes): magic, version, blksize, source size, source mtime
+        frame 0: DATA block 1
+        frame 1: DATA block 2
+        ...
+        last frame: DATA block with less than blksize bytes (maybe 0)
+
+    Images are built on demand, in a thread (the hub goes on serving
+    other sessions), and sessions read the source file until the image
+    of their blksize is ready.
+
+    Usage, in a read handler:
+        store = FrameStore('/var/cache/gtftp', blksizes=(512, 1468))
+
+        def get_target(self, path):
+            return store.get_target(os.path.join(self._root, path))
+
+    Images can also be built ahead of time:
+        python -m gtftp.framestore --store /var/cache/gtftp --blksize 1468 FILE...
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+
+from gevent import get_hub
+
+from .packet import Data
+from .handler import Target
+from .target import MmapFileTarget
+from .logger import logger
+
+
+class FramedImage(object):
+    """
+        A store file, memory mapped.
+    """
+
+    MAGIC = 'GTFTPFRM'
+    VERSION = 1
+    HEADER = struct.Struct(u'!8sIIQd')  # magic, version, blksize, size, mtime
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            header = f.read(self.HEADER.size)
+            if len(header) != self.HEADER.size:
+                raise ValueError(u'not a frame store file: %s' % path)
+
+            magic, version, blksize, size, mtime = self.HEADER.unpack(header)
+            if magic != self.MAGIC or version != self.VERSION:
+                raise ValueError(u'not a frame store file: %s' % path)
+
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._blksize = blksize
+        self._size = size
+        self._mtime = mtime
+        self._count = size // blksize + 1
+
+        expected = self.HEADER.size + self._count * Data.HEADER_SIZE + size
+        if len(self._mmap) != expected:
+            self._mmap.close()
+            raise ValueError(u'truncated frame store file: %s' % path)
+
+    @property
+    def blksize(self):
+        return self._blksize
+
+    @property
+    def source_size(self):
+        return self._size
+
+    @property
+    def source_mtime(self):
+        return self._mtime
+
+    def __len__(self):
+        """
+            number of frames (DATA blocks).
+        """
+        return self._count
+
+    def frame(self, index):
+        """
+            zero-copy buffer of the DATA packet of block (index + 1),
+            index starts from 0, block numbers roll over.
+        """
+        assert 0 <= index < self._count
+        frame_size = Data.HEADER_SIZE + self._blksize
+        payload = min(self._blksize, self._size - index * self._blksize)
+        return buffer(
+            self._mmap,
+            self.HEADER.size + index * frame_size,
+            Data.HEADER_SIZE + payload
+        )
+
+    def close(self):
+        self._mmap.close()
+
+    @classmethod
+    def build(cls, source, path, blksize):
+        """
+            Build store file at path from file source.
+            The file is written aside and renamed, sessions still
+            sending an older image are not affected.
+        """
+        blksize = int(blksize)
+        assert 8 <= blksize <= 65464
+
+        tmp_path = u'%s.%d.tmp' % (path, os.getpid())
+        with open(source, 'rb') as src:
+            st = os.fstat(src.fileno())
+            with open(tmp_path, 'wb') as dst:
+                dst.write(cls.HEADER.pack(
+                    cls.MAGIC, cls.VERSION, blksize, st.st_size, st.st_mtime
+                ))
+
+                index = 0
+                size = 0
+                while True:
+                    payload = src.read(blksize)
+                    # a short read only at EOF, keep frames aligned.
+                    while payload and len(payload) < blksize:
+                        data = src.read(blksize - len(payload))
+                        if not data:
+                            break
+                        payload += data
+
+                    dst.write(Data.HEADER.pack(
+                        Data.OPCODE_DATA, (index % Data.MAX_BLOCK_NUMBER) + 1
+                    ))
+                    dst.write(payload)
+                    index += 1
+                    size += len(payload)
+
+                    if len(payload) < blksize:
+                        break
+
+        if size != st.st_size:
+            # changed while building
+            os.unlink(tmp_path)
+            raise IOError(u'%s changed while building frame store' % source)
+
+        os.rename(tmp_path, path)
+        return cls(path)
+
+
+class FramedTarget(Target):
+    """
+        Target of a file in a FrameStore.
+
+        Read handlers in octet mode take packets from frames(blksize),
+        read/readinto (netascii mode, or blksize not in store) fall back
+        to the source file.
+    """
+
+    def __init__(self, store, path):
+        self._store = store
+        self._path = path
+        self._size = os.stat(path).st_size
+        self._source = None
+
+    def frames(self, blksize):
+        """
+            FramedImage of the file for blksize, or None (not served
+            from store, or being built).
+        """
+        return self._store.get_image(self._path, blksize)
+
+    def _get_source(self):
+        if self._source is None:
+            self._source = MmapFileTarget(self._path)
+        return self._source
+
+    def seek(self, offset):
+        self._get_source().seek(offset)
+
+    def tell(self):
+        return self._get_source().tell()
+
+    def read(self, size=-1):
+        return self._get_source().read(size)
+
+    def readinto(self, buffer):
+        return self._get_source().readinto(buffer)
+
+    def size(self):
+        return self._size
+
+    def cache_key(self):
+        return self._get_source().cache_key()
+
+    def close(self):
+        if self._source is not None:
+            self._source.close()
+            self._source = None
+
+
+class FrameStore(object):
+    """
+        Directory of FramedImages, built on demand (in the threadpool
+        of the hub) and rebuilt when the source file changes (mtime or
+        size).
+
+        blksizes -> block sizes to serve from store, None for any.
+
+        get_target() is thread-safe (gtftp.offload), images are
+        managed in the hub (get_image(), through FramedTarget.frames()).
+    """
+
+    SUFFIX = u'.frames'
+
+    def __init__(self, directory, blksizes=None):
+        self._dir = os.path.abspath(directory)
+        if not os.path.isdir(self._dir):
+            os.makedirs(self._dir)
+
+        self._blksizes = None
+        if blksizes is not None:
+            self._blksizes = frozenset(int(b) for b in blksizes)
+
+        self._images = {}   # (source path, blksize) -> FramedImage
+        self._building = {} # (source path, blksize) -> result of build in threadpool
+
+    def image_path(self, source, blksize):
+        source = os.path.abspath(source)
+        if isinstance(source, unicode):
+            source = source.encode(u'utf-8')
+        name = hashlib.sha1(source).hexdigest()
+        return os.path.join(self._dir, u'%s.%d%s' % (name, blksize, self.SUFFIX))
+
+    def get_target(self, path):
+        return FramedTarget(self, os.path.abspath(path))
+
+    def get_image(self, source, blksize):
+        """
+            Return the FramedImage of source for blksize.
+            Return None if blksize is not served from store, or if the
+            image does not exist or is out of date: it is built in
+            background, once at a time.
+        """
+        blksize = int(blksize)
+        if self._blksizes is not None and blksize not in self._blksizes:
+            return None
+
+        source = os.path.abspath(source)
+        st = os.stat(source)
+        key = (source, blksize)
+
+        image = self._images.get(key)
+        if image is not None and self._is_current(image, st):
+            return image
+
+        # replaced images are not closed, sessions may still send them.
+        self._images.pop(key, None)
+
+        path = self.image_path(source, blksize)
+        image = None
+        if os.path.exists(path):
+            try:
+                image = FramedImage(path)
+            except ValueError:
+                image = None
+            if image is not None and not self._is_current(image, st):
+                image = None
+
+        if image is None:
+            self._build_in_background(key, path)
+            return None
+
+        self._images[key] = image
+        return image
+
+    def _build_in_background(self, key, path):
+        if key in self._building:
+            return
+
+        source, blksize = key
+        result = get_hub().threadpool.spawn(FramedImage.build, source, path, blksize)
+        self._building[key] = result
+        result.rawlink(lambda result: self._built(key, result))
+
+    def _built(self, key, result):
+        """
+            called in the hub when a build ends.
+        """
+        del self._building[key]
+        if result.successful():
+            # checked against the source by the next get_image().
+            self._images[key] = result.value
+        else:
+            logger.error(u'Cannot build frame store image of %s (blksize %d): %s' % (
+                key[0], key[1], result.exception
+            ))
+
+    def build(self, source, blksize):
+        """
+            (re)build image of source for blksize.
+        """
+        source = os.path.abspath(source)
+        image = FramedImage.build(source, self.image_path(source, blksize), blksize)
+        self._images[(source, int(blksize))] = image
+        return image
+
+    @staticmethod
+    def _is_current(image, st):
+        return image.source_size == st.st_size and image.source_mtime == st.st_mtime
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description=u'Build pre-framed DATA packet images for gtftp.'
+    )
+    parser.add_argument(u'--store', required=True, help=u'store directory')
+    parser.add_argument(
+        u'--blksize', type=int, action=u'append', required=True,
+        help=u'block size, may be given several times'
+    )
+    parser.add_argument(u'files', nargs=u'+', help=u'source files')
+    args = parser.parse_args(argv)
+
+    store = FrameStore(args.store)
+    for path in args.files:
+        for blksize in args.blksize:
+            image = store.build(path, blksize)
+            print u'%s (blksize %d): %d blocks -> %s' % (
+                path, blksize, len(image), store.image_path(path, blksize)
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -5,10 +5,14 @@ import ipaddress
 import struct
 import time
 
-from gevent import socket, Timeout
+from gevent import socket, sleep, Timeout
 
 from .packet import *
 from .netascii import NetasciiReader, NetasciiWriter
+from .rtt import RttEstimator
+from .congestion import AimdController
+from .scheduler import get_scheduler
+from . import mmsg
 from .logger import logger
 
 
@@ -32,6 +36,20 @@ class Target(object):
         '''
         raise NotImplemented()
 
+    def readinto(self, buffer):
+        '''
+            Read at most len(buffer) bytes into buffer (a writable
+            buffer, e.g. memoryview), return the number of bytes read.
+            Return 0 at EOF.
+
+            Override it to avoid the copy made by this default
+            implementation based on read().
+        '''
+        # read() may return unicode (ascii), like Data() accepts.
+        data = str(self.read(len(buffer)))
+        buffer[:len(data)] = data
+        return len(data)
+
     def write(self, data):
         '''
             Write string to file.
@@ -47,6 +65,35 @@ class Target(object):
         '''
         raise NotImplemented()
 
+    def sync(self):
+        '''
+            optional, flush written data to stable storage (fsync).
+        '''
+        pass
+
+    def allocate(self, size):
+        '''
+            optional, reserve disk space for size bytes (the size
+            announced by the client of a WRQ, tsize option).
+            Raise IOError (ENOSPC ...) if it can not be reserved.
+        '''
+        pass
+
+    def truncate(self, size):
+        '''
+            optional, with allocate(): cut written target to size bytes
+            (the client sent less than it announced).
+        '''
+        pass
+
+    def cache_key(self):
+        '''
+            optional, a hashable value identifying the content of a
+            read-only target (e.g. (path, mtime, size)), so values
+            computed from it can be cached. None if unknown.
+        '''
+        return None
+
     def close(self):
         '''
             This method has no effect if the file is already closed.
@@ -56,6 +103,49 @@ class Target(object):
 
 
 class BaseReadHandler(object):
+    # retransmission timeout follows measured round trip time,
+    # instead of always waiting the full timeout.
+    ADAPTIVE_TIMEOUT = True
+    # lower bound of adaptive retransmission timeout, seconds
+    # (a client's utimeout option may be shorter).
+    MIN_TIMEOUT = RttEstimator.MIN_TIMEOUT
+
+    # number of duplicate ACKs which triggers retransmission of the
+    # first unacknowledged block before timeout (fast retransmit),
+    # None to disable.
+    DUPACK_THRESHOLD = 3
+
+    # adapt the number of blocks sent per round trip to losses (AIMD),
+    # bounded by negotiated windowsize.
+    CONGESTION_CONTROL = False
+    # with CONGESTION_CONTROL, spread blocks evenly across the round trip
+    # instead of sending them in bursts.
+    PACING = False
+
+    # gtftp.multicast.MulticastManager serving RFC 2090 'multicast'
+    # option, None to ignore the option.
+    MULTICAST = None
+
+    # gtftp.mux.SessionMux, to run transfers on shared sockets,
+    # None for a socket per transfer.
+    MUX = None
+
+    # gtftp.offload.Offload, to run target I/O in a threadpool,
+    # None to call targets in the session greenlet.
+    OFFLOAD = None
+
+    # gtftp.prefetch.Prefetch, to read targets in large chunks
+    # (and ahead), None to read them block by block.
+    PREFETCH = None
+
+    # gtftp.netascii.NetasciiSizeCache, tsize of netascii transfers
+    # shared by sessions, None to count it for every session.
+    NETASCII_SIZE_CACHE = None
+
+    # send the blocks of a window in one system call (sendmmsg),
+    # where the platform supports it.
+    BATCH_IO = True
+
     def __init__(self, req, server_addr, peer, retries, timeout):
         assert isinstance(req, Request)
         assert req.opcode == Packet.OPCODE_RRQ
@@ -65,7 +155,8 @@ class BaseReadHandler(object):
 
         self._options = None    # applied options
         self._blksize = Data.DEFAULT_BLKSIZE
-        self._timeout = timeout
+        self._timeout = timeout     # upper bound of retransmission timeout
+        self._utimeout = None
 
         self._family = socket.AF_INET6
         ip = server_addr[0]
@@ -80,8 +171,23 @@ class BaseReadHandler(object):
 
         self._ip = ip
 
+        self._windowsize = 1
+        self._window = []           # sent but unacknowledged DATA blocks, in order
+        self._eof = False           # the last (short) block has been read
+        self._frames = []           # preallocated DATA packet buffers, one per window slot
+        self._blocks_read = 0       # number of blocks read from target
+        self._image = None          # pre-framed packets of target (framestore)
+        self._multicast = False     # multicast requested (and enabled)
+        self._last_acked = None     # block number of the last ACK that slid window
+        self._dup_acks = 0          # duplicate ACKs received since
+        self._recover = 0           # blocks sent at the last retransmission (recovery point)
+        self._congestion = None     # AimdController, if CONGESTION_CONTROL
+
         self._cur_packet = None     # last sent packet, kept for retransmission
         self._retransmits = 0       # number of retranmissions of current data block
+        self._rtt = None            # retransmission timer
+        self._rtt_probe = None      # (block number, send time) of the timed packet
+        self._deadline = None       # of the awaited ACK
 
 
         self._listener = None
@@ -93,13 +199,24 @@ class BaseReadHandler(object):
         """
             To instantiate needed objects.
         """
-        self._listener = socket.socket(family=self._family, type=socket.SOCK_DGRAM)
-        self._listener.settimeout(None) # blocking
-        self._listener.bind((self._ip, 0))
-
-        self._target = self.get_target(self._req.path)
+        if self.MUX is not None:
+            # on a shared transfer socket
+            self._listener = self.MUX.open(self._peer)
+        if self._listener is None:
+            self._listener = socket.socket(family=self._family, type=socket.SOCK_DGRAM)
+            self._listener.settimeout(None) # blocking
+            self._listener.bind((self._ip, 0))
+        self._deadline = get_scheduler().deadline()
+
+        if self.OFFLOAD is not None:
+            self._target = self.OFFLOAD.get_target(self.get_target, self._req.path)
+        else:
+            self._target = self.get_target(self._req.path)
         if self._req.mode == Request.MODE_NETASCII:
-            self._target = NetasciiReader(self._target)
+            self._target = self._netascii_target(self._target)
+
+    def _netascii_target(self, target):
+        return NetasciiReader(target, self.NETASCII_SIZE_CACHE)
 
 
 
@@ -125,11 +242,6 @@ class BaseReadHandler(object):
             while not self._should_stop:
                 self.run_once()
 
-            # wait the last ACK
-            logger.info('waiting last ack')
-            while not self._wait_ack():
-                self._handle_timeout()
-
             logger.info(u'Session ends, peer: (%s, %d)' % (self._peer[0], self._peer[1]))
 
         except Error as e:
@@ -162,17 +274,33 @@ class BaseReadHandler(object):
         """
         self._apply_options()
 
+        if self._multicast and self._join_multicast():
+            # served by a multicast session.
+            self._should_stop = True
+            return
+
+        self._init_timer()
+
+        frames = getattr(self._target, 'frames', None)
+        if frames is not None:
+            # send ready-made DATA packets, if available for blksize.
+            self._image = frames(self._blksize)
+
+        if self._image is None and self.PREFETCH is not None:
+            self._target = self.PREFETCH.wrap(self._target)
+
+        if self.CONGESTION_CONTROL:
+            self._congestion = AimdController(self._windowsize)
+
         if self._options:
             # send OACK
             self._cur_packet = OACK(self._options)
             self._transmit(self._cur_packet)
+            self._rtt_probe = (0, time.time())
         else:
             # no options (or not accepted).
             # send the first block of data
-            self._cur_packet = self._next_block()
-            self._transmit(self._cur_packet)
-            if self._cur_packet.blocksize < self._blksize:
-                self._should_stop = True
+            self._fill_window()
 
     def _apply_options(self):
         """
@@ -224,89 +352,330 @@ class BaseReadHandler(object):
                 self._timeout = v
                 opts_to_ack[u'timeout'] = unicode(v)
 
+            elif k == u'utimeout':
+                # sub-second initial retransmission timeout, in microseconds.
+                try:
+                    v = int(v)
+                except ValueError as e:
+                    raise Error(
+                        Error.INVALID_OPTIONS,
+                        u'invalid utimeout %s' % v
+                    )
+
+                if v < 10000 or v > 255000000:
+                    raise Error(
+                        Error.INVALID_OPTIONS,
+                        u'utimeout value (%d) is out of range(10000-255000000)' % v
+                    )
+
+                self._utimeout = v
+                opts_to_ack[u'utimeout'] = unicode(v)
+
+            elif k == u'windowsize':
+                # RFC 7440
+                try:
+                    v = int(v)
+                except ValueError as e:
+                    raise Error(
+                        Error.INVALID_OPTIONS,
+                        u'invalid window size %s' % v
+                    )
+
+                if v < 1 or v > 65535:
+                    raise Error(
+                        Error.INVALID_OPTIONS,
+                        u'window size value (%d) is out of range(1-65535).' % v
+                    )
+
+                self._windowsize = v
+                opts_to_ack[u'windowsize'] = unicode(v)
+
+            elif k == u'multicast':
+                # RFC 2090, acknowledged by multicast session.
+                self._multicast = self.MULTICAST is not None
+
         self._options = opts_to_ack
 
-    @property
-    def _expected_block_num(self):
+    def _join_multicast(self):
         """
-            Expected block number in ACK.
+            Hand the request over to a multicast session.
+            return False if it is to be served by unicast.
         """
-        if self._cur_packet is None or isinstance(self._cur_packet, OACK):
-            return 0
+        if self._family != socket.AF_INET or self.MUX is not None:
+            # a multicast session talks to several peers,
+            # it needs a socket of its own.
+            return False
+
+        # multicast sessions are lock-step.
+        options = dict(self._options)
+        options.pop(u'windowsize', None)
+
+        return self.MULTICAST.join(
+            self._req.path, self._peer, options,
+            self._target, self._listener,
+            self._blksize, self._retries, self._timeout,
+            self._req.mode
+        )
+
+    def _init_timer(self):
+        """
+            retransmission timer, bounded by negotiated (or default) timeout.
+        """
+        if not self.ADAPTIVE_TIMEOUT:
+            self._rtt = RttEstimator(self._timeout, self._timeout, self._timeout)
+        elif self._utimeout is not None:
+            # the client asked for it, even below MIN_TIMEOUT.
+            utimeout = self._utimeout / 1000000.0
+            self._rtt = RttEstimator(
+                max(self._timeout, utimeout), utimeout,
+                min(self.MIN_TIMEOUT, utimeout)
+            )
         else:
-            return self._cur_packet.block_number
+            self._rtt = RttEstimator(self._timeout, min_timeout=self.MIN_TIMEOUT)
 
     def run_once(self):
         """
             recv ACK
-            send DATA
+            send DATA (a window of blocks)
         """
         # recv ack
         if self._wait_ack():
-            self._retransmits = 0
-            self._cur_packet = self._next_block()
-            self._transmit(self._cur_packet)
-            if self._cur_packet.blocksize < self._blksize:
-                self._should_stop = True
+            self._handle_ack()
         else:
             # timeout waiting for the expected ACK.
             self._handle_timeout()
 
+    def _handle_ack(self):
+        """
+            blocks of current window are acked:
+            send the next window, or stop after the last block.
+        """
+        self._retransmits = 0
+        if self._congestion is not None and not isinstance(self._cur_packet, OACK):
+            if self._window:
+                # acked in the middle of window, the next block is lost.
+                self._congestion.on_loss()
+            else:
+                self._congestion.on_round()
+
+        if self._eof and not self._window:
+            # the last block is acked.
+            self._should_stop = True
+        else:
+            self._fill_window()
+
+    def _fill_window(self):
+        """
+            send new blocks until windowsize blocks are in flight,
+            or the last block is sent.
+
+            If peer acknowledged a block in the middle of current window
+            (RFC 7440: lost block detected), the rest of the window is
+            retransmitted first.
+        """
+        retransmit = bool(self._window)
+        if retransmit:
+            # Karn's rule: retransmitted blocks are not timed.
+            self._rtt_probe = None
+
+        batch = list(self._window)
+        sent = len(self._window)
+        while len(self._window) < self._windowsize and not self._eof:
+            if sent:
+                delay = self._pace(sent)
+                if delay:
+                    self._transmit_many(batch)
+                    batch = []
+                    sleep(delay)
+            sent += 1
+
+            self._cur_packet = self._next_block()
+            self._window.append(self._cur_packet)
+            batch.append(self._cur_packet)
+            if self._rtt_probe is None:
+                self._rtt_probe = (self._cur_packet.block_number, time.time())
+            if self._cur_packet.blocksize < self._blksize:
+                self._eof = True
+
+        self._transmit_many(batch)
+        if retransmit:
+            self._recover = self._blocks_read
+
+    def _pace(self, sent):
+        """
+            Called before sending each block of a window but the first,
+            sent -> number of blocks sent so far.
+            return seconds to wait before sending the block.
+
+            Congestion window (cwnd) limits blocks sent per round trip:
+            a burst of cwnd blocks per srtt, or one block per srtt / cwnd
+            with PACING.
+
+            Receivers acknowledge once per negotiated windowsize
+            (RFC 7440), so the full window is always sent, just slower.
+        """
+        if self._congestion is None or self._rtt.srtt is None:
+            return 0
+
+        cwnd = self._congestion.window
+        if cwnd >= self._windowsize:
+            return 0
+
+        if self.PACING:
+            return self._rtt.srtt / cwnd
+        elif sent % cwnd == 0:
+            return self._rtt.srtt
+        return 0
+
     def _wait_ack(self):
         """
             ack or timeout
             return:
-                True -> current block is acked.
+                True -> one or more blocks of current window are acked.
                 False -> timeout waiting acknowledgement.
         """
-        timer = Timeout.start_new(self._timeout)
+        self._deadline.start(self._rtt.timeout)
 
         try:
-            while self.__wait_one_ack() != self._expected_block_num:
+            while True:
                 # timer's ticking.
-                pass
+                block_num = self.__wait_one_ack()
+                if self._slide_window(block_num):
+                    break
+                if block_num == self._last_acked:
+                    self._handle_dup_ack()
 
             return True
         except Timeout as e:
             return None
         finally:
-            timer.cancel()
+            self._deadline.cancel()
+
+    def _slide_window(self, block_num):
+        """
+            Remove acknowledged blocks from window.
+            Block numbers roll over, so ACK is matched against blocks in
+            window rather than compared numerically.
+
+            return:
+                True -> ACK acknowledges OACK or some blocks in window.
+                False -> ACK of a block out of current window, ignored.
+        """
+        if isinstance(self._cur_packet, OACK):
+            if block_num != 0:
+                return False
+            self._sample_rtt([0])
+        else:
+            for idx, packet in enumerate(self._window):
+                if packet.block_number == block_num:
+                    self._sample_rtt(p.block_number for p in self._window[:idx + 1])
+                    del self._window[:idx + 1]
+                    break
+            else:
+                return False
+
+        self._last_acked = block_num
+        self._dup_acks = 0
+        return True
+
+    @property
+    def _recovering(self):
+        """
+            blocks sent before the last retransmission are not all
+            acknowledged: ACKs they trigger are not news of a loss.
+        """
+        return self._blocks_read - len(self._window) < self._recover
+
+    def _handle_dup_ack(self):
+        """
+            Fast retransmit: resend the first block after the duplicated
+            ACK once duplicate ACKs reach DUPACK_THRESHOLD.
+
+            Duplicates are ignored until blocks sent up to the last
+            retransmission are acknowledged (NewReno recovery point),
+            so duplicates caused by blocks retransmitted or in flight
+            never multiply traffic (Sorcerer's Apprentice Syndrome).
+        """
+        if self._recovering:
+            return
+
+        self._dup_acks += 1
+        if (
+            self.DUPACK_THRESHOLD and self._window and
+            self._dup_acks == self.DUPACK_THRESHOLD
+        ):
+            logger.debug(u'fast retransmit block %d' % self._window[0].block_number)
+            self._rtt_probe = None
+            if self._congestion is not None:
+                self._congestion.on_loss()
+            self._transmit(self._window[0])
+            self._recover = self._blocks_read
+
+    def _sample_rtt(self, acked):
+        """
+            measure round trip time if the timed packet is acked.
+        """
+        if self._rtt_probe is not None and self._rtt_probe[0] in acked:
+            self._rtt.sample(time.time() - self._rtt_probe[1])
+            self._rtt_probe = None
 
     def __wait_one_ack(self):
         data, peer = self._listener.recvfrom(Data.DEFAULT_BLKSIZE)
+        return self._parse_ack(data, peer)
 
+    def _parse_ack(self, data, peer):
+        """
+            block number of ACK packet data from peer.
+            raise Error or PeerError if it is not an ACK of the session.
+        """
         if peer != self._peer:
             logger.warning(u'Packet received from wrong peer: %r. End the session.' % peer)
             raise Error(Error.UNDEFINED, u'from wrong peer')
 
-        err = Error.parse(data)
-        if err:
-            raise err
-
-        ack = ACK.parse(data)
-        if ack:
-            return ack.block_number
+        packet = parse_any(data)
+        if isinstance(packet, ACK):
+            return packet.block_number
+        elif isinstance(packet, Error):
+            raise packet
         else:
             raise Error(Error.ILLEGAL_OPERATION, u'Expecting an ACK.')
 
-        return block_num
-
 
     def _handle_timeout(self):
-        if self._retransmits < self._retries:
-            assert self._cur_packet
-            print 'retransmit:', self._cur_packet
-            self._transmit(self._cur_packet)
+        """
+            retransmit OACK, or all blocks of current window.
+        """
+        if self._rtt.backoff():
+            # the full timeout expired, it counts as a retry.
+            if self._retransmits >= self._retries:
+                raise TransmitTimeout()
             self._retransmits += 1
 
+        assert self._cur_packet
+        self._rtt_probe = None
+        if self._congestion is not None:
+            self._congestion.on_timeout()
+        if isinstance(self._cur_packet, OACK):
+            self._transmit(self._cur_packet)
         else:
-            raise TransmitTimeout()
+            logger.debug(
+                u'retransmit %d blocks from block %d' % \
+                (len(self._window), self._window[0].block_number)
+            )
+            self._transmit_many(self._window)
+            self._recover = self._blocks_read
 
 
     def _next_block(self):
         """
             prepare the next data block.
         """
+        if self._image is not None:
+            frame = self._image.frame(self._blocks_read)
+            self._blocks_read += 1
+            # block number is in the frame.
+            return DataFrame(frame)
+
         if self._cur_packet is None or isinstance(self._cur_packet, OACK):
             block_num = 1
         else:
@@ -314,14 +683,39 @@ class BaseReadHandler(object):
             if block_num > 65535:
                 block_num = 1
 
-        data = self._target.read(self._blksize)
-        block = data
-        while (len(block) < self._blksize) and (data):
-            # if no data -> EOF.
-            data = self._target.read(self._blksize - len(block))
-            block += data
+        # blocks in window have consecutive sequence numbers,
+        # so no buffer is reused before its block is acked.
+        slot = self._blocks_read % self._windowsize
+        if slot == len(self._frames):
+            self._frames.append(bytearray(Data.HEADER_SIZE + self._blksize))
+        buf = self._frames[slot]
+        self._blocks_read += 1
+
+        size = self._read_into(memoryview(buf)[Data.HEADER_SIZE:])
+        return DataBuffer(buf, block_num, size)
+
+    def _read_into(self, buf):
+        """
+            fill buf from target, return the number of bytes read,
+            less than len(buf) only at EOF.
+        """
+        readinto = getattr(self._target, 'readinto', None)
+        size = 0
+        while size < len(buf):
+            if readinto is not None:
+                n = readinto(buf[size:])
+            else:
+                # targets implementing read() only
+                data = str(self._target.read(len(buf) - size))
+                n = len(data)
+                buf[size:size + n] = data
+
+            if not n:
+                # EOF
+                break
+            size += n
 
-        return Data(block_num, block)
+        return size
 
     def _transmit(self, packet):
         if isinstance(packet, Packet):
@@ -329,6 +723,17 @@ class BaseReadHandler(object):
 
         self._listener.sendto(packet, self._peer)
 
+    def _transmit_many(self, packets):
+        """
+            send packets in one system call (sendmmsg) where possible.
+        """
+        if not self.BATCH_IO or len(packets) < 2:
+            for packet in packets:
+                self._transmit(packet)
+            return
+
+        mmsg.sendto_many(self._listener, [p.raw() for p in packets], self._peer)
+
     def get_target(self, path):
         """
             override this method.
@@ -338,6 +743,28 @@ class BaseReadHandler(object):
 
 
 class BaseWriteHandler(object):
+    # received data is written to target in chunks of (at least) this size.
+    WRITE_CHUNK_SIZE = 64 * 1024
+
+    # retransmission timeout follows measured round trip time,
+    # instead of always waiting the full timeout.
+    ADAPTIVE_TIMEOUT = True
+    # lower bound of adaptive retransmission timeout, seconds
+    # (a client's utimeout option may be shorter).
+    MIN_TIMEOUT = RttEstimator.MIN_TIMEOUT
+
+    # gtftp.mux.SessionMux, to run transfers on shared sockets,
+    # None for a socket per transfer.
+    MUX = None
+
+    # gtftp.offload.Offload, to run target I/O in a threadpool,
+    # None to call targets in the session greenlet.
+    OFFLOAD = None
+
+    # gtftp.writebehind.WriteBehind, to write targets in background,
+    # None to write them before acknowledging blocks.
+    WRITE_BEHIND = None
+
     def __init__(self, req, server_addr, peer, retries, timeout):
         assert isinstance(req, Request)
         assert req.opcode == Packet.OPCODE_WRQ
@@ -347,7 +774,8 @@ class BaseWriteHandler(object):
 
         self._options = None  # applied options
         self._blksize = Data.DEFAULT_BLKSIZE
-        self._timeout = timeout
+        self._timeout = timeout     # upper bound of retransmission timeout
+        self._utimeout = None
         self._tsize = None
 
         self._family = socket.AF_INET6
@@ -362,9 +790,23 @@ class BaseWriteHandler(object):
             self._peer = (self._peer[0].replace(u'::ffff:', ''), self._peer[1])
         self._ip = ip
 
+        self._windowsize = 1
+        self._block_num = 0         # last block received in order
+        self._window_received = 0   # blocks received in order since last ACK
+        self._pending = {}          # out-of-order blocks, by block number
+        self._gap_acked = False     # a lost block has been reported to peer
+
+        self._write_buffer = []     # received data not yet written to target
+        self._write_buffered = 0
+
         self._cur_packet = None     # last sent packet
         self._retransmits = 0
+        self._rtt = None            # retransmission timer
+        self._rtt_probe = None      # send time of the timed ACK/OACK
+        self._deadline = None       # of the awaited DATA
         self._received_size = 0
+        self._allocated = False     # target preallocated to tsize bytes
+        self._committed = False     # all data written
 
         self._listener = None
         self._target = None
@@ -375,17 +817,36 @@ class BaseWriteHandler(object):
         """
             To instantiate needed objects.
         """
-        self._listener = socket.socket(family=self._family, type=socket.SOCK_DGRAM)
-        self._listener.settimeout(None) # blocking
-        self._listener.bind((self._ip, 0))
-
-        self._target = self.get_target(self._req.path)
+        if self.MUX is not None:
+            # on a shared transfer socket
+            self._listener = self.MUX.open(self._peer)
+        if self._listener is None:
+            self._listener = socket.socket(family=self._family, type=socket.SOCK_DGRAM)
+            self._listener.settimeout(None) # blocking
+            self._listener.bind((self._ip, 0))
+        self._deadline = get_scheduler().deadline()
+
+        if self.OFFLOAD is not None:
+            self._target = self.OFFLOAD.get_target(self.get_target, self._req.path)
+        else:
+            self._target = self.get_target(self._req.path)
+        if self.WRITE_BEHIND is not None:
+            self._target = self.WRITE_BEHIND.wrap(self._target)
         if self._req.mode == Request.MODE_NETASCII:
-            self._target = NetasciiWriter(self._target)
+            self._target = self._netascii_target(self._target)
+
+    def _netascii_target(self, target):
+        return NetasciiWriter(target)
 
 
     def _close(self):
         if self._target is not None:
+            if self._allocated and not self._committed:
+                # interrupted, do not leave a file of the announced size.
+                try:
+                    self._truncate(self._received_size - self._write_buffered)
+                except Error as e:
+                    logger.error(u'Cannot truncate target: %s' % e.message)
             self._target.close()
         if self._listener is not None:
             self._listener.close()
@@ -437,6 +898,8 @@ class BaseWriteHandler(object):
                 ACK(0)
         """
         self._apply_options()
+        self._allocate()
+        self._init_timer()
 
         if self._options:
             # send OACK
@@ -447,6 +910,7 @@ class BaseWriteHandler(object):
             # Acknowledgement block num: 0
             self._cur_packet = ACK(0)
             self._transmit(self._cur_packet)
+        self._rtt_probe = time.time()
 
 
     def _apply_options(self):
@@ -510,53 +974,250 @@ class BaseWriteHandler(object):
                 self._timeout = v
                 opts_to_ack[u'timeout'] = unicode(v)
 
+            elif k == u'utimeout':
+                # sub-second initial retransmission timeout, in microseconds.
+                try:
+                    v = int(v)
+                except ValueError as e:
+                    raise Error(
+                        Error.INVALID_OPTIONS,
+                        u'invalid utimeout %s' % v
+                    )
+
+                if v < 10000 or v > 255000000:
+                    raise Error(
+                        Error.INVALID_OPTIONS,
+                        u'utimeout value (%d) is out of range(10000-255000000)' % v
+                    )
+
+                self._utimeout = v
+                opts_to_ack[u'utimeout'] = unicode(v)
+
+            elif k == u'windowsize':
+                # RFC 7440
+                try:
+                    v = int(v)
+                except ValueError as e:
+                    raise Error(
+                        Error.INVALID_OPTIONS,
+                        u'invalid window size %s' % v
+                    )
+
+                if v < 1 or v > 65535:
+                    raise Error(
+                        Error.INVALID_OPTIONS,
+                        u'window size value (%d) is out of range(1-65535).' % v
+                    )
+
+                self._windowsize = v
+                opts_to_ack[u'windowsize'] = unicode(v)
+
         self._options = opts_to_ack
 
 
+    def _init_timer(self):
+        """
+            retransmission timer, bounded by negotiated (or default) timeout.
+        """
+        if not self.ADAPTIVE_TIMEOUT:
+            self._rtt = RttEstimator(self._timeout, self._timeout, self._timeout)
+        elif self._utimeout is not None:
+            # the client asked for it, even below MIN_TIMEOUT.
+            utimeout = self._utimeout / 1000000.0
+            self._rtt = RttEstimator(
+                max(self._timeout, utimeout), utimeout,
+                min(self.MIN_TIMEOUT, utimeout)
+            )
+        else:
+            self._rtt = RttEstimator(self._timeout, min_timeout=self.MIN_TIMEOUT)
+
+    def _allocate(self):
+        """
+            preallocate target to the size announced by tsize, before
+            accepting the request: if the disk is full, the client gets
+            DISK_FULL instead of OACK.
+            netascii targets are not preallocated (tsize is the size on
+            the wire, not on disk).
+        """
+        if not self._tsize or self._req.mode == Request.MODE_NETASCII:
+            return
+        allocate = getattr(self._target, 'allocate', None)
+        if allocate is None:
+            return
+        try:
+            allocate(self._tsize)
+        except (IOError, OSError) as e:
+            raise Error.from_io_error(e)
+        self._allocated = True
+
+    def _truncate(self, size):
+        truncate = getattr(self._target, 'truncate', None)
+        if truncate is not None:
+            try:
+                truncate(size)
+            except (IOError, OSError) as e:
+                raise Error.from_io_error(e)
+
     def run_once(self):
+        """
+            recv DATA (and buffered blocks following it)
+            send ACK once per window, or at the last block
+        """
         data = self._wait_data()
         if data:
-            self._retransmits = 0
-            print 'write data, block: %d, size: %d' % (data.block_number, data.blocksize)
-            self._target.write(data.data)
-            self._received_size += data.blocksize
+            self._handle_data(data)
+        else:
+            self._handle_timeout()
 
-            self._cur_packet = ACK(data.block_number)
-            self._transmit(self._cur_packet)
+    def _handle_data(self, data):
+        """
+            the expected block is received: write it and the buffered
+            blocks following it, acknowledge if window is complete.
+        """
+        self._retransmits = 0
+        self._gap_acked = False
+        if self._rtt_probe is not None:
+            self._rtt.sample(time.time() - self._rtt_probe)
+            self._rtt_probe = None
+
+        while data:
+            if self._allocated and self._received_size + data.blocksize > self._tsize:
+                raise Error(
+                    Error.DISK_FULL,
+                    u'more data than announced (tsize %d).' % self._tsize
+                )
+            self._write(data.data)
+            self._received_size += data.blocksize
+            self._block_num = data.block_number
+            self._window_received += 1
 
             if data.blocksize < self._blksize:
                 self._should_stop = True
+                break
+
+            data = self._pending.pop(self._expected_block_num, None)
+
+        if self._should_stop:
+            self._flush()
+            self._commit()
+            self._ack()
+        elif self._window_received >= self._windowsize:
+            self._ack()
+            self._rtt_probe = time.time()
+
+    def _ack(self):
+        """
+            acknowledge the last block received in order.
+        """
+        self._cur_packet = ACK(self._block_num)
+        self._transmit(self._cur_packet)
+        self._window_received = 0
+
+    def _handle_timeout(self):
+        """
+            retransmit OACK, or acknowledge blocks received so far.
+        """
+        if self._rtt.backoff():
+            # the full timeout expired, it counts as a retry.
+            if self._retransmits >= self._retries:
+                raise TransmitTimeout()
+            self._retransmits += 1
+
+        self._rtt_probe = None
+        if isinstance(self._cur_packet, OACK) and self._block_num == 0:
+            self._transmit(self._cur_packet)
         else:
-            self._handle_timeout()
+            self._ack()
+
+    def _write(self, data):
+        """
+            buffer data, write to target in large chunks.
+        """
+        self._write_buffer.append(data)
+        self._write_buffered += len(data)
+        if self._write_buffered >= self.WRITE_CHUNK_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if self._write_buffer:
+            try:
+                self._target.write(''.join(self._write_buffer))
+            except (IOError, OSError) as e:
+                raise Error.from_io_error(e)
+            self._write_buffer = []
+            self._write_buffered = 0
+
+    def _commit(self):
+        """
+            before acknowledging the last block:
+            wait for target to have written all data, if it buffers it,
+            and cut its preallocated space to the size received.
+        """
+        flush = getattr(self._target, 'flush', None)
+        if flush is not None:
+            try:
+                flush()
+            except (IOError, OSError) as e:
+                raise Error.from_io_error(e)
+        if self._allocated and self._received_size < self._tsize:
+            self._truncate(self._received_size)
+        self._committed = True
 
     @property
     def _expected_block_num(self):
-        if self._cur_packet is None:
-            # transfer is not started
-            return None
-        elif isinstance(self._cur_packet, OACK):
+        if self._block_num >= Data.MAX_BLOCK_NUMBER:
             return 1
         else:
-            assert isinstance(self._cur_packet, ACK)
-            return self._cur_packet.block_number + 1
+            return self._block_num + 1
 
     def _wait_data(self):
         """
-            wait a data or timeout
+            wait the expected data block or timeout
+
+            Blocks ahead of the expected one (but inside the window) are
+            kept in self._pending, and the first of them triggers an ACK
+            of the last block received in order, so that peer restarts
+            the window from the lost block (RFC 7440).
         """
-        timer = Timeout.start_new(self._timeout)
+        self._deadline.start(self._rtt.timeout)
 
         try:
             while True:
                 data = self._wait_one_block()
-                if isinstance(data, Data) and data.block_number == self._expected_block_num:
-                    break
-
-            return data
+                if self._accept_block(data):
+                    return data
         except Timeout as e:
             return None
         finally:
-            timer.cancel()
+            self._deadline.cancel()
+
+    def _accept_block(self, data):
+        """
+            return True if data is the expected block,
+            otherwise buffer it or answer it, as it deserves.
+        """
+        distance = (data.block_number - self._expected_block_num) % Data.MAX_BLOCK_NUMBER
+        if distance == 0:
+            return True
+
+        elif distance < self._windowsize:
+            # out of order
+            self._pending.setdefault(data.block_number, data)
+            if not self._gap_acked:
+                self._gap_acked = True
+                # Karn's rule: the expected block will be a retransmission.
+                self._rtt_probe = None
+                self._ack()
+
+        elif (
+            isinstance(self._cur_packet, ACK) and
+            data.block_number == self._cur_packet.block_number
+        ):
+            # retransmitted by peer, our ACK may be lost.
+            self._rtt_probe = None
+            self._transmit(self._cur_packet)
+
+        return False
 
 
     def _wait_one_block(self):
@@ -571,22 +1232,25 @@ class BaseWriteHandler(object):
                 end session
         """
         block, peer = self._listener.recvfrom(self._blksize + 4)
+        return self._parse_data(block, peer)
 
+    def _parse_data(self, block, peer):
+        """
+            Data packet of block from peer.
+            raise Error or PeerError if it is not a DATA of the session.
+        """
         if peer != self._peer:
             raise Error(Error.UNDEFINED, u'from wrong peer')
 
-        err = Error.parse(block)
-        if err:
-            raise err
-
-        data = Data.parse(block)
-
-        if not data:
+        packet = parse_any(block)
+        if isinstance(packet, Data):
+            return packet
+        elif isinstance(packet, Error):
+            raise packet
+        else:
             # malformed packet, end the session.
             raise Error(Error.ILLEGAL_OPERATION, u'Expecting a data block.')
 
-        return data
-
 
     def _transmit(self, packet):
         if isinstance(packet, Packet):
@@ -0,0 +1,262 @@
+# -*- coding:utf-8 -*-
+
+"""
+    Batched datagram I/O: Linux recvmmsg/sendmmsg through ctypes,
+    several datagrams per system call.
+
+    Where they are not available (other platforms, old libc, sockets
+    without a file descriptor such as gtftp.mux.Channel), the functions
+    fall back to one recvfrom/sendto per datagram.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import struct
+
+from gevent import socket
+
+
+class _iovec(ctypes.Structure):
+    _fields_ = [
+        ('iov_base', ctypes.c_void_p),
+        ('iov_len', ctypes.c_size_t),
+    ]
+
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(_iovec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+    ]
+
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_hdr', _msghdr),
+        ('msg_len', ctypes.c_uint),
+    ]
+
+
+class _Py_buffer(ctypes.Structure):
+    _fields_ = [
+        ('buf', ctypes.c_void_p),
+        ('obj', ctypes.c_void_p),
+        ('len', ctypes.c_ssize_t),
+        ('itemsize', ctypes.c_ssize_t),
+        ('readonly', ctypes.c_int),
+        ('ndim', ctypes.c_int),
+        ('format', ctypes.c_char_p),
+        ('shape', ctypes.c_void_p),
+        ('strides', ctypes.c_void_p),
+        ('suboffsets', ctypes.c_void_p),
+        ('smalltable', ctypes.c_ssize_t * 2),
+        ('internal', ctypes.c_void_p),
+    ]
+
+
+MSG_DONTWAIT = 0x40
+SOCKADDR_SIZE = 128     # sizeof(struct sockaddr_storage)
+
+
+def _load():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        sendmmsg = libc.sendmmsg
+        recvmmsg = libc.recvmmsg
+    except (OSError, AttributeError):
+        return None, None
+
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr), ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    recvmmsg.argtypes = [
+        ctypes.c_int, ctypes.POINTER(_mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p
+    ]
+    recvmmsg.restype = ctypes.c_int
+    return sendmmsg, recvmmsg
+
+
+_sendmmsg, _recvmmsg = _load()
+
+_as_read_buffer = ctypes.pythonapi.PyObject_AsReadBuffer
+_as_read_buffer.argtypes = [
+    ctypes.py_object, ctypes.POINTER(ctypes.c_void_p), ctypes.POINTER(ctypes.c_ssize_t)
+]
+_get_buffer = ctypes.pythonapi.PyObject_GetBuffer
+_get_buffer.argtypes = [ctypes.py_object, ctypes.POINTER(_Py_buffer), ctypes.c_int]
+_release_buffer = ctypes.pythonapi.PyBuffer_Release
+_release_buffer.argtypes = [ctypes.POINTER(_Py_buffer)]
+
+
+def available():
+    return _sendmmsg is not None
+
+
+def _fileno(sock):
+    fileno = getattr(sock, 'fileno', None)
+    if fileno is None:
+        return None
+    return fileno()
+
+
+def _sockaddr(family, address):
+    if family == socket.AF_INET:
+        return (
+            struct.pack('=H', family) + struct.pack('!H', address[1]) +
+            socket.inet_aton(address[0]) + '\x00' * 8
+        )
+    else:
+        flowinfo = address[2] if len(address) > 2 else 0
+        scope_id = address[3] if len(address) > 3 else 0
+        return (
+            struct.pack('=H', family) + struct.pack('!HI', address[1], flowinfo) +
+            socket.inet_pton(socket.AF_INET6, address[0]) + struct.pack('=I', scope_id)
+        )
+
+
+def _address(raw):
+    family = struct.unpack_from('=H', raw)[0]
+    port = struct.unpack_from('!H', raw, 2)[0]
+    if family == socket.AF_INET:
+        return (socket.inet_ntoa(raw[4:8]), port)
+    else:
+        flowinfo = struct.unpack_from('!I', raw, 4)[0]
+        scope_id = struct.unpack_from('=I', raw, 24)[0]
+        return (socket.inet_ntop(socket.AF_INET6, raw[8:24]), port, flowinfo, scope_id)
+
+
+class _Buffers(object):
+    """
+        addresses of python buffers (str, bytearray, buffer, mmap,
+        memoryview), without copying them.
+    """
+
+    def __init__(self):
+        self._views = []
+
+    def address(self, data):
+        ptr = ctypes.c_void_p()
+        size = ctypes.c_ssize_t()
+        try:
+            _as_read_buffer(data, ctypes.byref(ptr), ctypes.byref(size))
+            return ptr.value, size.value
+        except TypeError:
+            # memoryview has only the new buffer interface.
+            view = _Py_buffer()
+            _get_buffer(data, ctypes.byref(view), 0)
+            self._views.append(view)
+            return view.buf, view.len
+
+    def release(self):
+        for view in self._views:
+            _release_buffer(ctypes.byref(view))
+        self._views = []
+
+
+def sendto_many(sock, packets, address):
+    """
+        send packets (buffers) to address, in as few system calls
+        as possible.
+    """
+    if not packets:
+        return
+
+    fd = _fileno(sock) if _sendmmsg is not None else None
+    if fd is None or len(packets) == 1:
+        for packet in packets:
+            sock.sendto(packet, address)
+        return
+
+    count = len(packets)
+    addr = _sockaddr(sock.family, address)
+    name = ctypes.create_string_buffer(addr, len(addr))
+    iovs = (_iovec * count)()
+    msgs = (_mmsghdr * count)()
+    buffers = _Buffers()
+    try:
+        for i, packet in enumerate(packets):
+            iovs[i].iov_base, iovs[i].iov_len = buffers.address(packet)
+            hdr = msgs[i].msg_hdr
+            hdr.msg_name = ctypes.cast(name, ctypes.c_void_p)
+            hdr.msg_namelen = len(addr)
+            hdr.msg_iov = ctypes.pointer(iovs[i])
+            hdr.msg_iovlen = 1
+
+        sent = _sendmmsg(fd, msgs, count, MSG_DONTWAIT)
+        if sent < 0:
+            err = ctypes.get_errno()
+            if err not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                raise socket.error(err, u'sendmmsg failed')
+            sent = 0
+    finally:
+        buffers.release()
+
+    # socket buffer is full, the rest waits for the socket.
+    for packet in packets[sent:]:
+        sock.sendto(packet, address)
+
+
+class BatchReceiver(object):
+    """
+        Receives up to count datagrams of at most bufsize bytes
+        per system call, buffers are allocated once.
+    """
+
+    def __init__(self, sock, count, bufsize):
+        self._fd = _fileno(sock) if _recvmmsg is not None else None
+        self._count = int(count)
+        self._bufsize = int(bufsize)
+        if self._fd is None:
+            return
+
+        self._bufs = ctypes.create_string_buffer(self._count * self._bufsize)
+        self._names = ctypes.create_string_buffer(self._count * SOCKADDR_SIZE)
+        self._iovs = (_iovec * self._count)()
+        self._msgs = (_mmsghdr * self._count)()
+
+        self._base = ctypes.addressof(self._bufs)
+        self._names_base = ctypes.addressof(self._names)
+        for i in xrange(self._count):
+            self._iovs[i].iov_base = self._base + i * self._bufsize
+            self._iovs[i].iov_len = self._bufsize
+            hdr = self._msgs[i].msg_hdr
+            hdr.msg_iov = ctypes.pointer(self._iovs[i])
+            hdr.msg_iovlen = 1
+
+    @property
+    def available(self):
+        return self._fd is not None
+
+    def recvfrom_many(self):
+        """
+            return a list of (data, address) of the datagrams already
+            queued on the socket, without blocking. Empty list if none.
+        """
+        for i in xrange(self._count):
+            hdr = self._msgs[i].msg_hdr
+            hdr.msg_name = self._names_base + i * SOCKADDR_SIZE
+            hdr.msg_namelen = SOCKADDR_SIZE
+            hdr.msg_flags = 0
+
+        received = _recvmmsg(self._fd, self._msgs, self._count, MSG_DONTWAIT, None)
+        if received < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return []
+            raise socket.error(err, u'recvmmsg failed')
+
+        result = []
+        for i in xrange(received):
+            msg = self._msgs[i]
+            data = ctypes.string_at(self._base + i * self._bufsize, msg.msg_len)
+            name = ctypes.string_at(
+                self._names_base + i * SOCKADDR_SIZE, msg.msg_hdr.msg_namelen
+            )
+            result.append((data, _address(name)))
+
+        return result
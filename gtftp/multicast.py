@@ -0,0 +1,305 @@
+# -*- coding:utf-8 -*-
+
+"""
+    Multicast TFTP (RFC 2090).
+
+    Concurrent read requests of the same file (with the same mode and
+    blksize) carrying the 'multicast' option are grouped into one session,
+    DATA blocks are sent once, to a multicast group.
+
+    One client at a time is the master client: it acknowledges blocks,
+    the others listen passively. When the master has the whole file
+    (or times out), the next client becomes master, and acknowledges
+    the last block it has in sequence, so that the blocks it missed
+    (joined late, or lost) are sent again.
+
+    Usage:
+        BaseReadHandler.MULTICAST = MulticastManager(
+            [u'239.255.69.%d' % i for i in range(1, 17)]
+        )
+
+    Only IPv4 sessions on targets with random access (seek(), or
+    pre-framed images) of at most 65535 blocks are served by multicast,
+    other requests fall back to unicast.
+"""
+
+import time
+from collections import OrderedDict
+
+from gevent import socket, Timeout
+
+from .packet import *
+from .rtt import RttEstimator
+from .scheduler import get_scheduler
+from .logger import logger
+
+
+class MulticastManager(object):
+    """
+        Allocates multicast groups, keeps multicast sessions by
+        (path, mode, blksize).
+    """
+
+    DEFAULT_PORT = 1758
+
+    def __init__(self, groups, port=DEFAULT_PORT, ttl=1):
+        """
+            groups -> multicast addresses to use, one per session.
+            port -> destination port of DATA packets.
+            ttl -> time to live of DATA packets.
+        """
+        self._free = [
+            g if isinstance(g, unicode) else str(g).decode(u'utf-8')
+            for g in groups
+        ]
+        self._port = int(port)
+        self._ttl = int(ttl)
+        self._sessions = {}     # (path, mode, blksize) -> MulticastSession
+
+    @property
+    def sessions(self):
+        return self._sessions.values()
+
+    def join(self, path, peer, options, target, listener, blksize, retries, timeout,
+             mode=Request.MODE_BINARY):
+        """
+            Add peer to the session of (path, mode, blksize), returns at once.
+            If there is none, start a session on target and listener
+            (the caller's) and return when it ends.
+
+            options -> options to acknowledge, without 'multicast'.
+
+            return:
+                True -> peer is served by multicast.
+                False -> not possible, serve peer by unicast.
+        """
+        # the content sent depends on the mode (netascii encoding).
+        key = (path, mode, blksize)
+        session = self._sessions.get(key)
+        if session is not None and session.add_client(peer, options):
+            return True
+
+        if not self._free or not MulticastSession.accepts(target, blksize):
+            return False
+
+        group = self._free.pop(0)
+        session = MulticastSession(
+            (group, self._port), self._ttl,
+            listener, target, blksize, retries, timeout
+        )
+        self._sessions[key] = session
+        try:
+            session.add_client(peer, options)
+            session.run()
+        finally:
+            del self._sessions[key]
+            self._free.append(group)
+
+        return True
+
+
+class MulticastSession(object):
+    """
+        Sends a file to a multicast group, driven by the master client.
+    """
+
+    def __init__(self, group, ttl, listener, target, blksize, retries, timeout):
+        self._group = group
+        self._listener = listener
+        self._target = target
+        self._blksize = blksize
+        self._retries = int(retries)
+        self._timeout = timeout
+
+        self._listener.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        ip = self._listener.getsockname()[0]
+        if ip != u'0.0.0.0':
+            # send DATA through the interface of the server address.
+            self._listener.setsockopt(
+                socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(ip)
+            )
+
+        self._blocks = target.size() // blksize + 1
+
+        self._image = None
+        frames = getattr(target, 'frames', None)
+        if frames is not None:
+            self._image = frames(blksize)
+        self._buf = bytearray(Data.HEADER_SIZE + blksize)
+
+        self._clients = OrderedDict()   # peer -> options, in order of arrival
+        self._master = None
+        self._closed = False
+        self._deadline = get_scheduler().deadline()
+
+    @staticmethod
+    def accepts(target, blksize):
+        """
+            if target can be sent by a multicast session.
+        """
+        if not (hasattr(target, 'frames') or hasattr(target, 'seek')):
+            # blocks must be read again for late clients.
+            return False
+
+        size = target.size()
+        if size is None:
+            return False
+
+        # ACKs of late clients are ambiguous once block number rolls over.
+        return size // blksize + 1 <= Data.MAX_BLOCK_NUMBER
+
+    @property
+    def group(self):
+        return self._group
+
+    @property
+    def clients(self):
+        return self._clients.keys()
+
+    @property
+    def master(self):
+        return self._master
+
+    def _oack(self, peer, master):
+        options = dict(self._clients[peer])
+        options[u'multicast'] = u'%s,%d,%d' % (
+            self._group[0], self._group[1], 1 if master else 0
+        )
+        return OACK(options)
+
+    def add_client(self, peer, options):
+        """
+            return False if session is ended.
+        """
+        if self._closed:
+            return False
+
+        if peer not in self._clients:
+            logger.info(u'Multicast client joins %s:%d, peer: (%s, %d)' % (
+                self._group[0], self._group[1], peer[0], peer[1]
+            ))
+            self._clients[peer] = options
+
+        if self._master is None and peer == next(iter(self._clients)):
+            # about to be master, its OACK is sent by _serve_master().
+            return True
+
+        if peer != self._master:
+            # also when RRQ is retransmitted, the OACK may be lost.
+            self._listener.sendto(self._oack(peer, False).raw(), peer)
+
+        return True
+
+    def run(self):
+        while self._clients:
+            peer = next(iter(self._clients))
+            self._master = peer
+            try:
+                self._serve_master(peer)
+            except PeerError as e:
+                logger.error(
+                    u'Multicast client quits, code: %d, message: %s' % \
+                    (e.code, e.message)
+                )
+            except TransmitTimeout as e:
+                logger.error(
+                    u'Multicast client timeout, peer: (%s, %d)' % (peer[0], peer[1])
+                )
+
+            del self._clients[peer]
+            self._master = None
+
+        self._closed = True
+
+    def _serve_master(self, peer):
+        """
+            send blocks the master client asks for, until it acks the
+            last one.
+        """
+        rtt = RttEstimator(self._timeout)
+        retransmits = 0
+        acked = None
+
+        packet = self._oack(peer, True).raw()
+        dest = peer
+        self._listener.sendto(packet, dest)
+        sent_at = time.time()
+
+        while True:
+            block_num = self._wait_ack(peer, rtt.timeout)
+            if block_num is None:
+                if rtt.backoff():
+                    if retransmits >= self._retries:
+                        raise TransmitTimeout()
+                    retransmits += 1
+                self._listener.sendto(packet, dest)
+                continue
+
+            if acked is not None and block_num <= acked:
+                # duplicate, do not answer (Sorcerer's Apprentice Syndrome)
+                continue
+
+            if block_num > self._blocks:
+                raise PeerError(Error.ILLEGAL_OPERATION, u'ACK of block %d' % block_num)
+
+            if not retransmits:
+                rtt.sample(time.time() - sent_at)
+            retransmits = 0
+            acked = block_num
+
+            if block_num == self._blocks:
+                # master has the whole file.
+                return
+
+            packet = self._block(block_num)
+            dest = self._group
+            self._listener.sendto(packet, dest)
+            sent_at = time.time()
+
+    def _wait_ack(self, peer, timeout):
+        """
+            ACK from peer, or None if timeout.
+            ACKs of other clients are ignored, a client sending ERROR
+            leaves the session (it would be elected master, and time out).
+        """
+        self._deadline.start(timeout)
+
+        try:
+            while True:
+                data, addr = self._listener.recvfrom(Data.DEFAULT_BLKSIZE)
+                packet = parse_any(data)
+                if addr != peer:
+                    if isinstance(packet, Error) and addr in self._clients:
+                        logger.error(
+                            u'Multicast client quits, code: %d, message: %s' % \
+                            (packet.code, packet.message)
+                        )
+                        del self._clients[addr]
+                    continue
+
+                if isinstance(packet, ACK):
+                    return packet.block_number
+                elif isinstance(packet, Error):
+                    raise PeerError(packet.code, packet.message)
+        except Timeout as e:
+            return None
+        finally:
+            self._deadline.cancel()
+
+    def _block(self, index):
+        """
+            DATA packet of block (index + 1).
+        """
+        if self._image is not None:
+            return self._image.frame(index)
+
+        self._target.seek(index * self._blksize)
+        payload = memoryview(self._buf)[Data.HEADER_SIZE:]
+        size = 0
+        while size < self._blksize:
+            n = self._target.readinto(payload[size:])
+            if not n:
+                break
+            size += n
+
+        return DataBuffer(self._buf, index + 1, size).raw()
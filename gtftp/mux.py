@@ -0,0 +1,189 @@
+# -*- coding:utf-8 -*-
+
+"""
+    Session multiplexing: transfers share a small pool of UDP sockets
+    instead of binding one socket each.
+
+    A reader greenlet per socket dispatches incoming packets to
+    sessions by peer address. Each session sees a Channel, which has
+    the socket methods handlers use (recvfrom, sendto, close ...).
+
+    All sessions on a socket have the same server TID (port), so a
+    peer (address, port) can only have one transfer per socket.
+    Clients use a new port per transfer, as RFC 1350 asks.
+
+    Usage:
+        mux = SessionMux(u'0.0.0.0', sockets=4)
+        BaseReadHandler.MUX = mux
+        BaseWriteHandler.MUX = mux
+"""
+
+import errno
+import ipaddress
+
+from gevent import socket, spawn
+from gevent.queue import Queue, Full
+
+from .packet import *
+from .logger import logger
+
+
+class Channel(object):
+    """
+        Packets of one session (peer) on a shared socket.
+    """
+
+    def __init__(self, mux, sock, peer, queue_size):
+        self._mux = mux
+        self._sock = sock
+        self._peer = peer
+        self._queue = Queue(queue_size)
+        self._closed = False
+
+    @property
+    def peer(self):
+        return self._peer
+
+    def _put(self, data):
+        """
+            called by reader, packets are dropped when queue is full,
+            as the kernel does on a socket.
+        """
+        try:
+            self._queue.put_nowait(data)
+        except Full:
+            pass
+
+    def recvfrom(self, bufsize):
+        data = self._queue.get()
+        return data[:bufsize], self._peer
+
+    def sendto(self, data, address):
+        return self._sock.sendto(data, address)
+
+    def getsockname(self):
+        return self._sock.getsockname()
+
+    def setsockopt(self, *args):
+        # shared by all sessions on the socket.
+        return self._sock.setsockopt(*args)
+
+    def settimeout(self, timeout):
+        pass
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._mux._release(self)
+
+
+class SessionMux(object):
+    """
+        Pool of shared transfer sockets, bound to ip (ephemeral ports).
+    """
+
+    RECV_SIZE = 65536
+    QUEUE_SIZE = 128    # packets queued per session
+    # socket errors after which a shared socket is still usable:
+    # ECONNREFUSED reports an ICMP port unreachable of a peer.
+    TRANSIENT_ERRORS = frozenset([errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR, errno.ECONNREFUSED])
+
+    def __init__(self, ip=u'0.0.0.0', sockets=1):
+        if not isinstance(ip, unicode):
+            ip = str(ip).decode(u'utf-8')
+        self._ip = ip
+        self._family = socket.AF_INET6
+        if isinstance(ipaddress.ip_address(ip), ipaddress.IPv4Address):
+            self._family = socket.AF_INET
+
+        self._size = max(int(sockets), 1)
+        self._sockets = []      # [(socket, {peer: Channel})]
+        self._next = 0
+
+        self._dispatched = 0
+        self._dropped = 0       # packets of unknown peers
+
+    def _start(self):
+        for i in xrange(self._size):
+            sock = socket.socket(family=self._family, type=socket.SOCK_DGRAM)
+            sock.bind((self._ip, 0))
+            channels = {}
+            self._sockets.append((sock, channels))
+            spawn(self._read, sock, channels)
+
+    @property
+    def sessions(self):
+        return sum(len(channels) for _, channels in self._sockets)
+
+    def stats(self):
+        return {
+            u'sockets': len(self._sockets),
+            u'sessions': self.sessions,
+            u'dispatched': self._dispatched,
+            u'dropped': self._dropped,
+        }
+
+    def open(self, peer):
+        """
+            Channel for a new session with peer,
+            None if peer has a session on every socket.
+        """
+        if not self._sockets:
+            self._start()
+
+        size = len(self._sockets)
+        for i in xrange(size):
+            sock, channels = self._sockets[(self._next + i) % size]
+            if peer not in channels:
+                self._next = (self._next + i + 1) % size
+                channel = Channel(self, sock, peer, self.QUEUE_SIZE)
+                channels[peer] = channel
+                return channel
+
+        return None
+
+    def _release(self, channel):
+        for sock, channels in self._sockets:
+            if channels.get(channel.peer) is channel:
+                del channels[channel.peer]
+                return
+
+    def _read(self, sock, channels):
+        """
+            reader of a shared socket.
+            On a persistent error (e.g. socket closed), the socket is
+            dropped from the pool, its sessions time out; new sessions
+            go to the other sockets, or to new ones if none is left.
+        """
+        while True:
+            try:
+                data, peer = sock.recvfrom(self.RECV_SIZE)
+            except socket.error as e:
+                if e.args[0] in self.TRANSIENT_ERRORS:
+                    continue
+                logger.error(u'Shared transfer socket error, socket dropped: %s' % e)
+                self._drop(sock)
+                return
+
+            channel = channels.get(peer)
+            if channel is not None:
+                self._dispatched += 1
+                channel._put(data)
+                continue
+
+            self._dropped += 1
+            opcode = Packet.OPCODE.unpack_from(data)[0] if len(data) >= 2 else None
+            if opcode != Packet.OPCODE_ERROR:
+                # RFC 1350, never answer an ERROR.
+                try:
+                    sock.sendto(
+                        Error(Error.UNKNOWN_TRANSFER_ID, u'unknown transfer id').raw(),
+                        peer
+                    )
+                except socket.error as e:
+                    logger.warning(u'Cannot answer (%s, %d): %s' % (peer[0], peer[1], e))
+
+    def _drop(self, sock):
+        self._sockets = [(s, channels) for s, channels in self._sockets if s is not sock]
+        self._next = 0
+        sock.close()
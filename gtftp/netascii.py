@@ -1,43 +1,91 @@
 # -*- coding:utf-8 -*-
 
-import io
+from collections import deque, OrderedDict
 
 
-class NetasciiReader(object):
+class NetasciiSizeCache(object):
+    """
+        Sizes of files once encoded in netascii (tsize option), shared
+        by sessions, keyed by Target.cache_key() (path, mtime, size),
+        so a changed file is counted again.
     """
-        copied from fbtftp.netascii:NetasciiReader
 
-        NetasciiReader encodes (asci) data coming from a reader into NetASCII.
+    def __init__(self, max_entries=1024):
+        self._max_entries = int(max_entries)
+        self._sizes = OrderedDict()     # key -> size, LRU first
+
+    def __len__(self):
+        return len(self._sizes)
+
+    def get(self, key):
+        size = self._sizes.pop(key, None)
+        if size is not None:
+            self._sizes[key] = size     # most recently used
+        return size
 
-        If the size of the returned data needs to be known in advance this will
-        actually have to load the whole content of its underlying reader into
-        memory which is suboptimal but also the only way in which we can make
-        NetASCII work with the 'tsize' TFTP extension.
+    def put(self, key, size):
+        self._sizes.pop(key, None)
+        self._sizes[key] = size
+        while len(self._sizes) > self._max_entries:
+            self._sizes.popitem(last=False)
+
+
+class NetasciiReader(object):
+    """
+        NetasciiReader encodes (ascii) data coming from a reader into
+        NetASCII: LF -> CR LF, CR -> CR NUL.
+
+        The reader is read in chunks of CHUNK_SIZE bytes, each chunk
+        is encoded at once with str.replace(); every input byte maps to
+        its own output bytes, so only encoded bytes not yet returned
+        are carried from a chunk to the next.
+
+        size() (tsize option) counts CR and LF in a pass over the
+        reader, then seeks it back to the start; a reader without
+        seek() is kept in memory (not encoded) to be replayed.
+        It is to be called before reading.
+        Sizes can be shared through a NetasciiSizeCache.
     """
 
-    def __init__(self, reader):
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, reader, size_cache=None):
         self._reader = reader
-        self._buffer = bytearray()
-        self._slurp = None
+        self._size_cache = size_cache
+        self._buffer = ''           # encoded data
+        self._offset = 0            # of the first byte not returned in buffer
+        self._replay = None         # chunks read by size(), if reader can't seek
         self._size = None
 
+    @staticmethod
+    def encode(data):
+        return data.replace('\r', '\r\x00').replace('\n', '\r\n')
+
+    def _read_chunk(self):
+        if self._replay:
+            return self._replay.popleft()
+
+        data = self._reader.read(self.CHUNK_SIZE)
+        if isinstance(data, unicode):
+            data = data.encode(u'utf-8')
+        return data
+
     def read(self, size):
-        if self._slurp is not None:
-            return self._slurp.read(size)
-        data, buffer_size = bytearray(), 0
-        if self._buffer:
-            buffer_size = len(self._buffer)
-            data.extend(self._buffer)
-        for char in self._reader.read(size - buffer_size):
-            char = ord(char)
-            if char == ord(u'\n'):
-                data.extend([ord(u'\r'), ord(u'\n')])
-            elif char == ord('\r'):
-                data.extend([ord(u'\r'), 0])
-            else:
-                data.append(char)
-        self._buffer = bytearray(data[size:])
-        return str(data[:size])
+        while len(self._buffer) - self._offset < size:
+            data = self._read_chunk()
+            if not data:
+                break
+            self._buffer = self._buffer[self._offset:] + self.encode(data)
+            self._offset = 0
+
+        data = self._buffer[self._offset:self._offset + size]
+        self._offset += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
 
     def write(self, data):
         raise NotImplemented()
@@ -48,61 +96,115 @@ class NetasciiReader(object):
     def size(self):
         if self._size is not None:
             return self._size
-        slurp, size = io.BytesIO(), 0
+
+        key = None
+        cache_key = getattr(self._reader, 'cache_key', None)
+        if self._size_cache is not None and cache_key is not None:
+            key = cache_key()
+            if key is not None:
+                self._size = self._size_cache.get(key)
+                if self._size is not None:
+                    return self._size
+
+        seek = getattr(self._reader, 'seek', None)
+        if seek is None:
+            self._replay = deque()
+
+        size = 0
         while True:
-            data = self.read(512)
+            data = self._reader.read(self.CHUNK_SIZE)
             if not data:
                 break
-            size += slurp.write(data)
-        self._slurp, self._size = slurp, size
-        self._slurp.seek(0)
+            if isinstance(data, unicode):
+                data = data.encode(u'utf-8')
+            size += len(data) + data.count('\r') + data.count('\n')
+            if seek is None:
+                self._replay.append(data)
+
+        if seek is not None:
+            seek(0)
+
+        self._size = size
+        if key is not None:
+            self._size_cache.put(key, size)
         return size
 
 
 class NetasciiWriter(object):
     """
-        To write netascii data to a file.
+        To write netascii data to a file: CR LF -> LF, CR NUL -> CR.
+
+        Each write() is decoded at once with str.replace(). A CR at the
+        end of data is held until the next write() (or close()), as its
+        meaning depends on the byte following it.
+        Decoded data is written to the file in chunks of (at least)
+        CHUNK_SIZE bytes, and the rest by flush() or close().
     """
+
+    CHUNK_SIZE = 64 * 1024
+
     def __init__(self, writer):
         self._writer = writer
+        self._cr = False            # data ended with a CR
+        self._buffer = []           # decoded data not written yet
+        self._buffered = 0
+
+    @staticmethod
+    def decode(data):
+        return data.replace('\r\n', '\n').replace('\r\x00', '\r')
 
     def read(self, size):
         raise NotImplemented()
 
     def write(self, data):
         """
-            data - unicode, bytearray, str
+            data - unicode, bytearray, memoryview, str
         """
         if isinstance(data, unicode):
             data = data.encode('ascii')
-        data = bytearray(data)
-
-        idx = 0
-        data_len = len(data)
-        enc_data = []
-        while idx < data_len:
-            char = data[idx]
-            next_char = data[idx+1]
-            if (char == ord(u'\r')) and (next_char == ord(u'\n')):
-                enc_data.append(u'\n'.encode(u'ascii'))
-                idx += 1
-            elif (char == ord(u'\r')) and (next_char == ord(u'\0')):
-                enc_data.append(u'\r'.encode(u'ascii'))
-                idx += 1
-            else:
-                enc_data.append(chr(char))
-
-            idx += 1
-
-        self._writer.write(''.join(enc_data))
+        elif isinstance(data, memoryview):
+            data = data.tobytes()
+        else:
+            data = str(data)
+        if not data:
+            return
+
+        if self._cr:
+            data = '\r' + data
+        self._cr = data.endswith('\r')
+        if self._cr:
+            data = data[:-1]
+
+        data = self.decode(data)
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.CHUNK_SIZE:
+            self._write_buffer()
+
+    def _write_buffer(self):
+        if self._buffer:
+            self._writer.write(''.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+
+    def flush(self):
+        """
+            write decoded data, flush the writer if it buffers too.
+        """
+        self._write_buffer()
+        flush = getattr(self._writer, 'flush', None)
+        if flush is not None:
+            flush()
 
     def size(self):
         raise NotImplemented()
 
     def close(self):
-        self._writer.close()
-
-
-
-
-
+        try:
+            if self._cr:
+                # a CR alone at the end, not valid netascii, kept.
+                self._buffer.append('\r')
+                self._cr = False
+            self._write_buffer()
+        finally:
+            self._writer.close()
@@ -0,0 +1,168 @@
+# -*- coding:utf-8 -*-
+
+"""
+    Blocking target I/O run in a threadpool.
+
+    A read or write on a regular file blocks the whole hub (every
+    session of the process) while the disk or the NFS server answers.
+    With an Offload, sessions open their targets (get_target) and call
+    read/readinto/write/size/sync/allocate/truncate/close in a bounded
+    pool of threads, and only the calling session waits.
+
+    Usage:
+        offload = Offload(max_threads=16)
+        BaseReadHandler.OFFLOAD = offload
+        BaseWriteHandler.OFFLOAD = offload
+        ...
+        offload.stats()
+
+    Targets whose I/O yields to the hub by itself (gevent sockets,
+    cooperative clients of remote stores) subclass CooperativeTarget,
+    and are called directly.
+
+    get_target() of handlers runs in the pool, for several sessions at
+    once: what it shares must be thread-safe (gtftp.cache.FileCache
+    and gtftp.framestore.FrameStore get_target() are). Target methods
+    of a session are never called concurrently.
+"""
+
+import os
+import time
+
+from gevent.threadpool import ThreadPool
+
+from .handler import Target
+
+
+class CooperativeTarget(Target):
+    """
+        Base of targets whose operations yield to the hub while they
+        wait (gevent-native I/O), they are never offloaded.
+    """
+
+    cooperative = True
+
+
+class OffloadedTarget(Target):
+    """
+        Target calling its target through an Offload.
+        Other attributes (frames, seek, view ...) are the target's.
+
+        Optional methods of Target (readinto, sync, allocate, truncate,
+        cache_key) are defined on it, so they are forwarded explicitly:
+        __getattr__ only gets names not found on the class.
+    """
+
+    def __init__(self, target, offload):
+        self._target = target
+        self._offload = offload
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+    def read(self, size=-1):
+        return self._offload.call(u'read', self._target.read, size)
+
+    def readinto(self, buffer):
+        readinto = getattr(self._target, 'readinto', None)
+        if readinto is None:
+            return super(OffloadedTarget, self).readinto(buffer)
+        return self._offload.call(u'readinto', readinto, buffer)
+
+    def write(self, data):
+        return self._offload.call(u'write', self._target.write, data)
+
+    def size(self):
+        return self._offload.call(u'size', self._target.size)
+
+    def sync(self):
+        sync = getattr(self._target, 'sync', None)
+        if sync is not None:
+            return self._offload.call(u'sync', sync)
+
+    def allocate(self, size):
+        allocate = getattr(self._target, 'allocate', None)
+        if allocate is not None:
+            return self._offload.call(u'allocate', allocate, size)
+
+    def truncate(self, size):
+        truncate = getattr(self._target, 'truncate', None)
+        if truncate is not None:
+            return self._offload.call(u'truncate', truncate, size)
+
+    def cache_key(self):
+        # no I/O, computed when the target is opened.
+        cache_key = getattr(self._target, 'cache_key', None)
+        return cache_key() if cache_key is not None else None
+
+    def close(self):
+        return self._offload.call(u'close', self._target.close)
+
+
+class Offload(object):
+    """
+        Bounded threadpool for target I/O, with latency metrics per
+        operation (as seen by sessions: time queued included).
+    """
+
+    def __init__(self, max_threads=8):
+        self._max_threads = int(max_threads)
+        self._pool = None
+        self._pid = None
+        self._pending = 0
+        self._ops = {}      # name -> [calls, errors, total seconds, max seconds]
+
+    def _get_pool(self):
+        if self._pool is None or self._pid != os.getpid():
+            # threads do not survive fork(), workers get their own.
+            self._pool = ThreadPool(self._max_threads)
+            self._pid = os.getpid()
+        return self._pool
+
+    def call(self, name, func, *args):
+        """
+            run func(*args) in the pool, the current greenlet waits.
+        """
+        op = self._ops.get(name)
+        if op is None:
+            op = self._ops[name] = [0, 0, 0.0, 0.0]
+
+        self._pending += 1
+        start = time.time()
+        try:
+            return self._get_pool().apply(func, args)
+        except Exception:
+            op[1] += 1
+            raise
+        finally:
+            elapsed = time.time() - start
+            self._pending -= 1
+            op[0] += 1
+            op[2] += elapsed
+            op[3] = max(op[3], elapsed)
+
+    def get_target(self, get_target, path):
+        """
+            open target of path with get_target in the pool, and wrap it.
+        """
+        return self.wrap(self.call(u'open', get_target, path))
+
+    def wrap(self, target):
+        if getattr(target, 'cooperative', False):
+            return target
+        return OffloadedTarget(target, self)
+
+    def stats(self):
+        ops = {}
+        for name, (calls, errors, total, longest) in self._ops.iteritems():
+            ops[name] = {
+                u'calls': calls,
+                u'errors': errors,
+                u'avg_latency': total / calls if calls else 0.0,
+                u'max_latency': longest,
+            }
+        return {
+            u'threads': self._max_threads,
+            u'pending': self._pending,
+            u'operations': ops,
+        }
@@ -1,12 +1,26 @@
 # -*- coding:utf-8 -*-
 
+import errno
 import struct
 import copy
 
 from .exception import *
 
 
+def _bytes(raw):
+    """
+        str of raw (str, buffer, bytearray or memoryview).
+    """
+    if isinstance(raw, memoryview):
+        return raw.tobytes()
+    return str(raw)
+
+
 class Packet(object):
+    __slots__ = ()
+
+    OPCODE = struct.Struct(u'!H')
+
     # opcode
     OPCODE_RRQ = 1
     OPCODE_WRQ = 2
@@ -49,6 +63,7 @@ class Request(Packet):
         <  optN  | 0 | valueN | 0 |
          >-------+---+---~~---+---+
     """
+    __slots__ = ('_opcode', '_path', '_mode', '_options')
 
     def __init__(self, opcode, path, mode, options=None):
         assert opcode in (self.OPCODE_RRQ, self.OPCODE_WRQ)
@@ -116,17 +131,23 @@ class Request(Packet):
             If failed, raise InvalidTftpPacket if safe==False, else return None.
         """
 
-        raw = str(raw)
+        raw = _bytes(raw)
 
         try:
-            opcode = struct.unpack(u'!H', raw[:2])[0]
+            if len(raw) < 2:
+                raise InvalidTftpPacket(u'packet too short')
+
+            opcode = Packet.OPCODE.unpack_from(raw)[0]
             if opcode not in (Request.OPCODE_RRQ, Request.OPCODE_WRQ):
                 raise InvalidTftpPacket(u"invalid request opcode: %d" % opcode)
 
-            tokens = filter(
-                bool, 
-                raw[2:].decode(u'ascii').split(u'\x00')
-            )
+            # option values may be empty (e.g. RFC 2090 'multicast'),
+            # only drop the terminating NUL and trailing padding.
+            tokens = raw[2:].decode(u'ascii').split(u'\x00')
+            if tokens and not tokens[-1]:
+                tokens.pop()
+            while len(tokens) % 2 != 0 and tokens and not tokens[-1]:
+                tokens.pop()
 
             if len(tokens) < 2 or len(tokens) % 2 != 0:
                 raise InvalidTftpPacket(u'malformed packet, not even number of tokens')
@@ -138,10 +159,19 @@ class Request(Packet):
             pos = 2
 
             while pos < len(tokens):
-                options[tokens[pos].lower()] = tokens[pos + 1]
+                if tokens[pos]:
+                    options[tokens[pos].lower()] = tokens[pos + 1]
                 pos += 2
 
+            if mode not in (Request.MODE_NETASCII, Request.MODE_BINARY):
+                raise InvalidTftpPacket(u'invalid mode: %s' % mode)
+
             return Request(opcode, path, mode, options)
+        except UnicodeDecodeError as e:
+            if safe:
+                return None
+            else:
+                raise InvalidTftpPacket(u'not an ascii request')
         except InvalidTftpPacket as e:
             if safe:
                 return None
@@ -151,6 +181,8 @@ class Request(Packet):
 
 
 class RRQ(Request):
+    __slots__ = ()
+
     def __init__(self, path, mode, options=None):
         super(RRQ, self).__init__(self.OPCODE_RRQ, path, mode, options)
 
@@ -172,6 +204,8 @@ class RRQ(Request):
 
 
 class WRQ(Request):
+    __slots__ = ()
+
     def __init__(self, path, mode, options=None):
         super(WRQ, self).__init__(self.OPCODE_WRQ, path, mode, options)
 
@@ -200,11 +234,15 @@ class Data(Packet):
         | Opcode |   Block #  |   Data     |
         ----------------------------------
     """
+    __slots__ = ('_block_num', '_data')
 
     MAX_BLOCK_NUMBER = 65535
     DEFAULT_BLKSIZE = 512
     # DEFAULT_BLKSIZE = 508
 
+    HEADER = struct.Struct(u'!HH')      # opcode, block number
+    HEADER_SIZE = HEADER.size
+
     def __init__(self, block_number, data):
         """
             block_number: 1 - 65535
@@ -227,32 +265,22 @@ class Data(Packet):
         return self._data
 
     def raw(self):
-        fmt = u'!HH%ds' % len(self._data)
-        packet = struct.pack(
-            fmt, 
-            self.OPCODE_DATA,
-            self._block_num,
-            self._data
-        )
-
-        return packet
+        return self.HEADER.pack(self.OPCODE_DATA, self._block_num) + self._data
 
     @staticmethod
     def parse(raw, safe=True):
-        raw = str(raw)
-
         try:
-            opcode = struct.unpack(u'!H', raw[:2])[0]
+            if len(raw) < Data.HEADER_SIZE:
+                raise InvalidDataPacket(u'DATA packet is at least 4 bytes.')
+
+            opcode, block_num = Data.HEADER.unpack_from(raw)
             if opcode != Data.OPCODE_DATA:
                 raise InvalidDataPacket(u"invalid data opcode: %d" % opcode)
 
-            block_num = struct.unpack(u'!H', raw[2:4])[0]
             if block_num == 0:
                 raise InvalidDataPacket(u"invalid data data block number: %d" % block_num)
 
-            data = raw[4:]
-
-            return Data(block_num, data)
+            return Data(block_num, _bytes(raw[Data.HEADER_SIZE:]))
         except InvalidDataPacket as e:
             if safe:
                 return None
@@ -260,6 +288,60 @@ class Data(Packet):
                 raise
 
 
+class DataFrame(Data):
+    """
+        DATA packet on an already framed buffer (header and payload),
+        e.g. a slice of a memory mapped file. raw() returns the buffer
+        itself, no copy.
+    """
+    __slots__ = ('_frame',)
+
+    def __init__(self, frame):
+        """
+            frame -> memoryview/buffer of a whole DATA packet.
+        """
+        opcode, block_number = self.HEADER.unpack_from(frame)
+        assert opcode == self.OPCODE_DATA
+        assert block_number >= 1 and block_number <= 65535
+        self._block_num = block_number
+        self._frame = frame
+
+    @property
+    def blocksize(self):
+        return len(self._frame) - self.HEADER_SIZE
+
+    @property
+    def data(self):
+        """
+            payload, of the same buffer type as frame.
+        """
+        return self._frame[self.HEADER_SIZE:]
+
+    def raw(self):
+        return self._frame
+
+
+class DataBuffer(DataFrame):
+    """
+        DATA packet built in place on a preallocated buffer:
+        the payload is already at buf[4:4 + size], header is written
+        in front of it.
+
+        The packet is only valid until the buffer is reused.
+    """
+    __slots__ = ()
+
+    def __init__(self, buf, block_number, size):
+        """
+            buf -> bytearray, at least HEADER_SIZE + size bytes.
+            block_number: 1 - 65535
+        """
+        block_number = int(block_number)
+        assert block_number >= 1 and block_number <= 65535
+        self.HEADER.pack_into(buf, 0, self.OPCODE_DATA, block_number)
+        super(DataBuffer, self).__init__(memoryview(buf)[:self.HEADER_SIZE + size])
+
+
 class ACK(Packet):
     """
          2 bytes     2 bytes
@@ -267,6 +349,10 @@ class ACK(Packet):
         | Opcode |   Block #  |
          ---------------------
     """
+    __slots__ = ('_block_num',)
+
+    HEADER = struct.Struct(u'!HH')      # opcode, block number
+
     def __init__(self, block_number):
         block_number = int(block_number)
         assert block_number >= 0 and block_number <= 65535
@@ -277,24 +363,18 @@ class ACK(Packet):
         return self._block_num
 
     def raw(self):
-        packet = struct.pack(
-            u'!HH', self.OPCODE_ACK, self._block_num
-        )
-        return packet
+        return self.HEADER.pack(self.OPCODE_ACK, self._block_num)
 
     @staticmethod
     def parse(raw, safe=True):
-        raw = str(raw)
         try:
             if len(raw) != 4:
                 raise InvalidACK('ACK packet length is 4.')
 
-            opcode = struct.unpack(u'!H', raw[:2])[0]
+            opcode, block_num = ACK.HEADER.unpack_from(raw)
             if opcode != ACK.OPCODE_ACK:
                 raise InvalidACK(u"invalid ACK opcode: %d" % opcode)
 
-            block_num = struct.unpack(u'!H', raw[2:4])[0]
-
             return ACK(block_num)
 
         except InvalidACK as e:
@@ -311,6 +391,9 @@ class Error(Packet, TftpError):
       | Opcode |  ErrorCode |   ErrMsg   |   0  |
        -----------------------------------------
     """
+    __slots__ = ('_code', '_msg')
+
+    HEADER = struct.Struct(u'!HH')      # opcode, error code
 
     # error code
     UNDEFINED = 0           # Not defined, see error msg (if any) - RFC 1350.
@@ -342,6 +425,26 @@ class Error(Packet, TftpError):
             message = str(message).decode(u'utf-8')
         self._msg = message
 
+    @staticmethod
+    def from_io_error(e):
+        """
+            Error to report IOError/OSError e (of a target) to peer.
+        """
+        code = {
+            errno.ENOSPC: Error.DISK_FULL,
+            errno.EDQUOT: Error.DISK_FULL,
+            errno.EFBIG: Error.DISK_FULL,
+            errno.EACCES: Error.ACCESS_VIOLATION,
+            errno.EPERM: Error.ACCESS_VIOLATION,
+            errno.EROFS: Error.ACCESS_VIOLATION,
+        }.get(e.errno, Error.UNDEFINED)
+
+        message = e.strerror or u'I/O error'
+        if not isinstance(message, unicode):
+            message = str(message).decode(u'ascii', u'replace')
+        # sent as ascii
+        return Error(code, message.encode(u'ascii', u'replace'))
+
     def __repr__(self):
         return u'<Error: code=%d, message="%s">' % (self._code, self._msg)
 
@@ -357,30 +460,28 @@ class Error(Packet, TftpError):
         return self._msg
 
     def raw(self):
-        msg = self._msg.encode(u'ascii')
-        packet = struct.pack(
-            u'!HH%dsx' % len(msg),
-            self.OPCODE_ERROR, self._code, msg
-        )
-
-        return packet
+        return self.HEADER.pack(self.OPCODE_ERROR, self._code) + \
+            self._msg.encode(u'ascii') + '\x00'
 
     @staticmethod
     def parse(raw, safe=True):
         try:
-            opcode = struct.unpack(u'!H', raw[:2])[0]
+            if len(raw) < 4:
+                raise InvalidErrorPacket(u'ERROR packet is at least 4 bytes.')
+
+            opcode, err_code = Error.HEADER.unpack_from(raw)
             if opcode != Error.OPCODE_ERROR:
                 raise InvalidErrorPacket(u"invalid ERROR opcode: %d" % opcode)
 
-            err_code = struct.unpack(u'!H', raw[2:4])[0]
             if err_code not in Error.ERR_CODES:
                 raise InvalidErrorPacket(u'Invalid error code: %d' % err_code)
 
-            message = raw[4:]
-            if message[-1] == '\x00':
+            message = _bytes(raw[4:])
+            if message.endswith('\x00'):
                 message = message[:-1]
 
-            return Error(err_code, message.decode(u'ascii'))
+            # messages are netascii, be lenient with peers.
+            return Error(err_code, message.decode(u'ascii', u'replace'))
 
         except InvalidErrorPacket as e:
             if safe:
@@ -396,6 +497,7 @@ class OACK(Packet):
         |  opc  |  opt1  | 0 | value1 | 0 |  optN  | 0 | valueN | 0 |
         +-------+---~~---+---+---~~---+---+---~~---+---+---~~---+---+
     """
+    __slots__ = ('_opts',)
 
     def __init__(self, options):
         options = dict(options)
@@ -421,7 +523,7 @@ class OACK(Packet):
             ))
 
         opts = '\x00'.join(opts) + '\x00'
-        packet = struct.pack(u'!H', self.OPCODE_OACK) + opts
+        packet = self.OPCODE.pack(self.OPCODE_OACK) + opts
 
         return packet
 
@@ -429,13 +531,16 @@ class OACK(Packet):
     @staticmethod
     def parse(raw, safe=True):
         try:
-            opcode = struct.unpack(u'!H', raw[:2])[0]
+            if len(raw) < 2:
+                raise InvalidOACK(u'packet too short')
+
+            opcode = Packet.OPCODE.unpack_from(raw)[0]
             if opcode != OACK.OPCODE_OACK:
                 raise InvalidOACK(u"invalid OACK opcode: %d" % opcode)
 
             tokens = filter(
                 bool, 
-                raw[2:].decode(u'ascii').split(u'\x00')
+                _bytes(raw[2:]).decode(u'ascii').split(u'\x00')
             )
 
             options = {}
@@ -453,5 +558,28 @@ class OACK(Packet):
                 raise
 
 
+_PARSERS = {
+    Packet.OPCODE_RRQ: Request.parse,
+    Packet.OPCODE_WRQ: Request.parse,
+    Packet.OPCODE_DATA: Data.parse,
+    Packet.OPCODE_ACK: ACK.parse,
+    Packet.OPCODE_ERROR: Error.parse,
+    Packet.OPCODE_OACK: OACK.parse,
+}
+
 
+def parse_any(raw):
+    """
+        Parse a packet of any type, dispatched by opcode.
+        raw -> str, buffer, bytearray or memoryview, not copied
+               (but the payload of DATA).
+        Return an instance of Request, Data, ACK, Error or OACK,
+        None if raw is not a valid TFTP packet.
+    """
+    if len(raw) < 2:
+        return None
 
+    parse = _PARSERS.get(Packet.OPCODE.unpack_from(raw)[0])
+    if parse is None:
+        return None
+    return parse(raw)
@@ -0,0 +1,168 @@
+# -*- coding:utf-8 -*-
+
+"""
+    Large and read-ahead reads of read targets.
+
+    Without it, a read handler reads one block (blksize bytes) from its
+    target each time it sends one. BufferedTarget reads chunks of
+    chunk_size bytes instead, ReadAheadTarget also reads them ahead in
+    a greenlet of its own, up to read_ahead bytes, while the session
+    waits for ACKs.
+
+    Reading ahead only overlaps with the transfer when target reads
+    yield to the hub (network backends, targets run in a threadpool),
+    a regular file read blocks the hub anyway.
+    Blocks to retransmit are kept in the session window, they are not
+    read again.
+
+    Usage:
+        BaseReadHandler.PREFETCH = Prefetch(read_ahead=1024 * 1024)
+
+    Targets with pre-framed images (gtftp.framestore) are not wrapped.
+"""
+
+from gevent import spawn
+from gevent.queue import Queue
+
+from .handler import Target
+
+
+class BufferedTarget(Target):
+    """
+        Read-only target reading its target in chunks of chunk_size.
+    """
+
+    CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, target, chunk_size=None):
+        self._target = target
+        self._chunk_size = int(chunk_size or self.CHUNK_SIZE)
+        self._chunk = ''        # last chunk read
+        self._offset = 0        # in chunk, of the next byte to return
+        self._eof = False
+
+    def _next_chunk(self):
+        return str(self._target.read(self._chunk_size))
+
+    def _take(self, size):
+        """
+            at most size bytes of the current chunk, read the next one
+            if it is consumed. '' at EOF.
+        """
+        if self._offset >= len(self._chunk):
+            if self._eof:
+                return ''
+            self._chunk = self._next_chunk()
+            self._offset = 0
+            if not self._chunk:
+                self._eof = True
+                return ''
+
+        data = self._chunk[self._offset:self._offset + size]
+        self._offset += len(data)
+        return data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = float(u'inf')
+
+        data = []
+        n = 0
+        while n < size:
+            chunk = self._take(min(size - n, self._chunk_size))
+            if not chunk:
+                break
+            data.append(chunk)
+            n += len(chunk)
+        return ''.join(data)
+
+    def readinto(self, buffer):
+        n = 0
+        while n < len(buffer):
+            data = self._take(len(buffer) - n)
+            if not data:
+                break
+            buffer[n:n + len(data)] = data
+            n += len(data)
+        return n
+
+    def size(self):
+        return self._target.size()
+
+    def cache_key(self):
+        cache_key = getattr(self._target, 'cache_key', None)
+        return cache_key() if cache_key is not None else None
+
+    def close(self):
+        self._target.close()
+
+
+class ReadAheadTarget(BufferedTarget):
+    """
+        BufferedTarget reading chunks ahead in a greenlet, at most
+        read_ahead bytes (rounded up to a chunk) are waiting.
+        Started by the first read.
+    """
+
+    def __init__(self, target, read_ahead, chunk_size=None):
+        super(ReadAheadTarget, self).__init__(target, chunk_size)
+        self._queue = Queue(max(1, -(-int(read_ahead) // self._chunk_size)))
+        self._reader = None     # greenlet
+        self._reading = False   # reader is in a read of target
+        self._closed = False
+
+    def _read_ahead(self):
+        try:
+            while True:
+                self._reading = True
+                try:
+                    data = str(self._target.read(self._chunk_size))
+                finally:
+                    self._reading = False
+                if self._closed:
+                    return
+                self._queue.put(data)
+                if not data:
+                    return
+        except Exception as e:
+            # raised to the session by its next read.
+            if not self._closed:
+                self._queue.put(e)
+
+    def _next_chunk(self):
+        if self._reader is None:
+            self._reader = spawn(self._read_ahead)
+
+        data = self._queue.get()
+        if isinstance(data, Exception):
+            raise data
+        return data
+
+    def close(self):
+        if self._reader is not None:
+            self._closed = True
+            if self._reading:
+                # a read run in a thread (gtftp.offload) goes on if its
+                # greenlet is killed: target is closed once it returns.
+                self._reader.join()
+            self._reader.kill()
+            self._reader = None
+        super(ReadAheadTarget, self).close()
+
+
+class Prefetch(object):
+    """
+        Wraps targets of read sessions (BaseReadHandler.PREFETCH).
+
+        chunk_size -> bytes per read of target.
+        read_ahead -> bytes read ahead in background, 0 for none.
+    """
+
+    def __init__(self, read_ahead=0, chunk_size=BufferedTarget.CHUNK_SIZE):
+        self._read_ahead = int(read_ahead)
+        self._chunk_size = int(chunk_size)
+
+    def wrap(self, target):
+        if self._read_ahead > 0:
+            return ReadAheadTarget(target, self._read_ahead, self._chunk_size)
+        return BufferedTarget(target, self._chunk_size)
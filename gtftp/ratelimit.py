@@ -0,0 +1,59 @@
+# -*- coding:utf-8 -*-
+
+"""
+    Per-source rate limit of new sessions.
+
+    Each source address (IP, any port) has a token bucket of burst
+    requests, refilled at rate requests per second. Requests of a
+    source whose bucket is empty are dropped by the server, in the hub,
+    before a greenlet is spawned for them.
+
+    Buckets of the max_sources most recently seen sources are kept, a
+    source forgotten starts again with a full bucket.
+
+    Usage:
+        Server.RATE_LIMIT = RateLimit(rate=5, burst=20)
+"""
+
+import time
+from collections import OrderedDict
+
+
+class RateLimit(object):
+    """
+        Token buckets of request sources.
+
+        rate -> requests per second, per source.
+        burst -> requests a source can send at once.
+        max_sources -> sources remembered.
+    """
+
+    def __init__(self, rate=10.0, burst=20, max_sources=65536):
+        self._rate = float(rate)
+        self._burst = float(burst)
+        self._max_sources = int(max_sources)
+        self._buckets = OrderedDict()   # source -> [tokens, time of update], LRU first
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def allow(self, source):
+        """
+            True if a request of source (an IP address) may be handled,
+            it takes a token of its bucket.
+        """
+        now = time.time()
+        bucket = self._buckets.pop(source, None)
+        if bucket is None:
+            bucket = [self._burst, now]
+            while len(self._buckets) >= self._max_sources:
+                self._buckets.popitem(last=False)
+        else:
+            bucket[0] = min(self._burst, bucket[0] + (now - bucket[1]) * self._rate)
+            bucket[1] = now
+        self._buckets[source] = bucket     # most recently used
+
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
@@ -0,0 +1,94 @@
+# -*- coding:utf-8 -*-
+
+
+class RttEstimator(object):
+    """
+        Retransmission timer of a session, as in RFC 6298.
+
+        Round trip samples update smoothed rtt (srtt) and its variation
+        (rttvar), timeout is srtt + 4 * rttvar. Every expiration doubles
+        the timeout (exponential backoff) until next valid sample.
+        Timeout always stays in range [min_timeout, max_timeout].
+
+        Karn's rule is up to the caller: do not sample packets
+        that have been retransmitted.
+    """
+
+    # seconds, slow clients (PXE ROMs, embedded) take this long to
+    # answer on a LAN, shorter timeouts only cause spurious retransmits.
+    MIN_TIMEOUT = 0.2
+    INITIAL_TIMEOUT = 1.0   # seconds, before first sample (RFC 6298)
+
+    ALPHA = 0.125
+    BETA = 0.25
+    K = 4
+
+    def __init__(self, max_timeout, initial_timeout=None, min_timeout=None):
+        """
+            max_timeout -> upper bound, seconds.
+            initial_timeout -> timeout before first sample, seconds.
+            min_timeout -> lower bound, seconds.
+        """
+        self._max = float(max_timeout)
+
+        if min_timeout is None:
+            min_timeout = self.MIN_TIMEOUT
+        self._min = min(float(min_timeout), self._max)
+
+        if initial_timeout is None:
+            initial_timeout = self.INITIAL_TIMEOUT
+        self._rto = self._bound(initial_timeout)
+
+        self._srtt = None
+        self._rttvar = None
+        self._backoff = 1
+
+    def _bound(self, value):
+        return min(max(float(value), self._min), self._max)
+
+    @property
+    def srtt(self):
+        return self._srtt
+
+    @property
+    def rttvar(self):
+        return self._rttvar
+
+    @property
+    def max_timeout(self):
+        return self._max
+
+    @property
+    def timeout(self):
+        """
+            current retransmission timeout, seconds.
+        """
+        return min(self._rto * self._backoff, self._max)
+
+    def sample(self, rtt):
+        """
+            feed a round trip time (seconds) measured on a packet
+            which was not retransmitted.
+        """
+        rtt = max(float(rtt), 0.0)
+        if self._srtt is None:
+            self._srtt = rtt
+            self._rttvar = rtt / 2
+        else:
+            self._rttvar = (1 - self.BETA) * self._rttvar + self.BETA * abs(self._srtt - rtt)
+            self._srtt = (1 - self.ALPHA) * self._srtt + self.ALPHA * rtt
+
+        self._rto = self._bound(self._srtt + self.K * self._rttvar)
+        self._backoff = 1
+
+    def backoff(self):
+        """
+            called when the timer expires.
+            return:
+                True -> the expired timeout was the upper bound.
+                False -> the expired timeout was shorter.
+        """
+        at_limit = self.timeout >= self._max
+        if not at_limit:
+            self._backoff *= 2
+        return at_limit
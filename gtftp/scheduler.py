@@ -0,0 +1,155 @@
+# -*- coding:utf-8 -*-
+
+"""
+    Retransmission deadlines of all sessions, on one timer.
+
+    gevent's Timeout.start_new() creates and starts a hub timer, and
+    cancel() stops it; a session does that for every block it waits
+    for. Here, each session owns a Deadline, and re-arming it only
+    updates a number: a heap holds the deadlines, checked by one
+    periodic hub timer (every RESOLUTION seconds, while any deadline
+    is armed), and only sessions whose deadline expires are woken up,
+    with gevent.Timeout raised in their greenlet.
+
+    A deadline pushed back (the usual case: a block is acknowledged
+    and the next one is waited for) stays in the heap at its old
+    position, it is moved when reached, so the heap changes about
+    once per timeout rather than once per block.
+
+    Usage:
+        deadline = get_scheduler().deadline()
+        deadline.start(seconds)
+        try:
+            ... wait ...
+        except Timeout:
+            ... expired ...
+        finally:
+            deadline.cancel()
+"""
+
+import heapq
+import os
+import time
+
+from gevent import getcurrent, get_hub, Timeout
+
+
+class Deadline(object):
+    """
+        A reusable deadline of one session.
+    """
+
+    def __init__(self, scheduler):
+        self._scheduler = scheduler
+        self._exception = Timeout()   # raised at expiration, not started
+        self._greenlet = None
+        self._deadline = None       # absolute time, None if not armed
+        self._scheduled = None      # time of its heap entry, None if none
+
+    @property
+    def exception(self):
+        return self._exception
+
+    @property
+    def pending(self):
+        return self._deadline is not None
+
+    def start(self, seconds):
+        """
+            raise gevent.Timeout in the current greenlet in seconds,
+            unless cancelled or started again before.
+        """
+        self._greenlet = getcurrent()
+        self._deadline = time.time() + seconds
+        self._scheduler._arm(self)
+
+    def cancel(self):
+        self._deadline = None
+        self._greenlet = None
+
+
+class Scheduler(object):
+    """
+        Heap of session deadlines, checked by one periodic timer.
+    """
+
+    RESOLUTION = 0.01   # seconds, timers expire up to this late
+
+    def __init__(self, resolution=None):
+        if resolution is None:
+            resolution = self.RESOLUTION
+        self._resolution = float(resolution)
+        self._pid = os.getpid()
+        self._heap = []         # [(time, seq, Deadline)]
+        self._seq = 0
+        self._timer = None      # periodic hub timer, while heap is not empty
+
+        self._fired = 0
+        self._moved = 0         # heap entries moved to a later deadline
+
+    def deadline(self):
+        return Deadline(self)
+
+    def stats(self):
+        return {
+            u'scheduled': len(self._heap),
+            u'fired': self._fired,
+            u'moved': self._moved,
+        }
+
+    def _push(self, deadline, at):
+        self._seq += 1
+        deadline._scheduled = at
+        heapq.heappush(self._heap, (at, self._seq, deadline))
+
+    def _arm(self, deadline):
+        if deadline._scheduled is None or deadline._deadline < deadline._scheduled:
+            # the entry at the later time becomes stale.
+            self._push(deadline, deadline._deadline)
+
+        if self._timer is None:
+            self._timer = get_hub().loop.timer(self._resolution, self._resolution)
+            self._timer.start(self._tick)
+
+    def _tick(self):
+        now = time.time()
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            at, _, deadline = heapq.heappop(heap)
+            if deadline._scheduled != at:
+                # stale entry
+                continue
+            deadline._scheduled = None
+
+            if deadline._deadline is None:
+                # cancelled
+                continue
+            if deadline._deadline > now:
+                self._moved += 1
+                self._push(deadline, deadline._deadline)
+                continue
+
+            greenlet = deadline._greenlet
+            deadline.cancel()
+            self._fired += 1
+            # runs in the hub, as gevent's own timers do.
+            greenlet.throw(deadline.exception)
+
+        if not heap:
+            self._timer.stop()
+            self._timer.close()
+            self._timer = None
+
+
+_scheduler = None
+
+
+def get_scheduler():
+    """
+        the Scheduler of this process, created on first use
+        (worker processes get their own).
+    """
+    global _scheduler
+    if _scheduler is None or _scheduler._pid != os.getpid():
+        _scheduler = Scheduler()
+    return _scheduler
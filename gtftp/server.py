@@ -1,10 +1,21 @@
 # -*- coding:utf-8 -*-
 
+import collections
+import errno
+import fcntl
+import json
+import os
+import select
+import signal
 import struct
+import time
+
+import gevent
 from gevent.server import DatagramServer
 from gevent import socket
 
 from .packet import *
+from . import mmsg
 from .logger import logger
 
 
@@ -12,15 +23,63 @@ class UdpServer(DatagramServer):
     """
         Tuned for TFTP server
     """
-    def __init__(self, listener, handle=None, spawn='default', blksize=Data.DEFAULT_BLKSIZE):
+    # datagrams received per system call (recvmmsg), 1 to disable.
+    BATCH_SIZE = 32
+
+    def __init__(self, listener, handle=None, spawn='default', blksize=Data.DEFAULT_BLKSIZE, accept=None):
         """
             extra parameters to DatagramServer:
                 blksize -> receive block size
+                accept -> accept(data, address), called in the hub for
+                          each datagram: a greenlet is spawned to handle
+                          it only if it returns True.
         """
         super(UdpServer, self).__init__(listener, handle=handle, spawn=spawn)
         self._blksize = int(blksize)
+        self._accept = accept
+        self._receiver = None
+        self._received = collections.deque()    # datagrams of the last batch
+
+    def start_accepting(self):
+        super(UdpServer, self).start_accepting()
+        self._drain_received()
+
+    def _do_read(self):
+        super(UdpServer, self)._do_read()
+        self._drain_received()
+
+    def _drain_received(self):
+        """
+            datagrams left from a batch do not make the socket readable,
+            handle them in the next loop iteration.
+        """
+        if self._received and self._watcher is not None:
+            self.loop.run_callback(self._do_read)
 
     def do_read(self):
+        # datagrams rejected by accept() are skipped, at most max_accept
+        # per call, the next ones are read in the next loop iteration.
+        for _ in xrange(self.max_accept):
+            datagram = self._recv()
+            if datagram is None or self._accept is None or self._accept(*datagram):
+                return datagram
+
+    def _recv(self):
+        """
+            next datagram, None if none is waiting.
+        """
+        if self._received:
+            return self._received.popleft()
+
+        if self.BATCH_SIZE > 1:
+            if self._receiver is None:
+                self._receiver = mmsg.BatchReceiver(self._socket, self.BATCH_SIZE, self._blksize)
+            if self._receiver.available:
+                self._received.extend(self._receiver.recvfrom_many())
+                if self._received:
+                    return self._received.popleft()
+                return
+
         try:
             data, address = self._socket.recvfrom(self._blksize)
         except socket.error as err:
@@ -29,44 +88,381 @@ class UdpServer(DatagramServer):
             raise
         return data, address
 
+    def reply(self, data, address):
+        """
+            send data from the server socket, without waiting (e.g. in
+            accept()): dropped if the socket buffer is full.
+        """
+        try:
+            self._socket.sendto(data, address)
+        except socket.error as err:
+            if err.args[0] != socket.EWOULDBLOCK:
+                logger.warning(u'Cannot reply to (%s, %d): %s' % (address[0], address[1], err))
+
 
 class Server(object):
-    def __init__(self, ip='0.0.0.0', port=69, retries=3, timeout=5, concurrency=None):
+    # seconds between stats reports of a worker process, and of the
+    # supervisor (report_stats) in multi-process mode.
+    STATS_INTERVAL = 1.0
+    # seconds to wait before restarting a dead worker process.
+    RESTART_DELAY = 1.0
+    # gtftp.ratelimit.RateLimit, to limit requests per source address,
+    # None for no limit.
+    RATE_LIMIT = None
+    # gtftp.admission.Admission, to queue requests over a number of
+    # sessions (concurrency is not used then), None to start them all.
+    ADMISSION = None
+
+    def __init__(self, ip='0.0.0.0', port=69, retries=3, timeout=5, concurrency=None, workers=None):
+        """
+            workers -> number of worker processes, each one binds
+                       (ip, port) with SO_REUSEPORT and runs its own hub,
+                       the kernel shares requests among them.
+                       None: serve in this process.
+        """
         spawner = 'default'
         self._retries = retries
         self._timeout = timeout
-        if concurrency:
+        if concurrency and self.ADMISSION is None:
             # an integer -- a shortcut for ``gevent.pool.Pool(integer)``
             spawner = int(concurrency)
+        self._spawner = spawner
+
+        self._ip = ip
+        self._port = port
+        self._workers = int(workers) if workers else None
+        self._worker_fds = {}       # pid -> read end of stats pipe
+        self._worker_stats = {}     # pid -> last stats reported
+        self._retired_stats = {}    # counters of dead workers
+
+        self._stats = {
+            u'requests': 0,         # datagrams received on server port
+            u'invalid': 0,          # not a request
+            u'limited': 0,          # over rate limit of source
+            u'sessions': 0,         # handlers started
+            u'active': 0,           # handlers running
+            u'duplicates': 0,       # requests of a running session
+        }
+        self._sessions = {}         # (peer, opcode, path) -> session info
+
+        self._unknown_tid = Error(
+            Error.UNKNOWN_TRANSFER_ID, u'no transfer on server port'
+        ).raw()
+        self._busy = Error(Error.UNDEFINED, u'server busy, try later').raw()
+
+        self._udp_server = None
+        if self._workers is None:
+            self._udp_server = UdpServer(
+                (ip, port), handle=self.handle_request, spawn=spawner, accept=self.accept_request
+            )
+
+
+    def accept_request(self, data, peer):
+        """
+            Called in the hub for each datagram on server port, before a
+            greenlet is spawned for it: cheap checks of its opcode and
+            shape, of running sessions (retransmitted requests), and of
+            the rate limit of its source, before admission.
+            return True to handle it (handle_request), otherwise it is
+            dropped, or answered here.
+        """
+        self._stats[u'requests'] += 1
 
-        self._udp_server = UdpServer((ip, port), handle=self.handle_request, spawn=spawner)
+        opcode = Packet.OPCODE.unpack_from(data)[0] if len(data) >= 4 else None
+        if opcode in (Packet.OPCODE_RRQ, Packet.OPCODE_WRQ) and data[-1] == '\x00':
+            if self._sessions and self._session_key(data, peer, opcode) in self._sessions:
+                # retransmitted by peer, the running session answers it.
+                self._stats[u'duplicates'] += 1
+                return False
+            if self.RATE_LIMIT is not None and not self.RATE_LIMIT.allow(peer[0]):
+                self._stats[u'limited'] += 1
+                return False
+            if self.ADMISSION is None:
+                return True
+            start, shed = self.ADMISSION.admit(data, peer)
+            self._shed(shed)
+            return start
 
+        self._stats[u'invalid'] += 1
+        if opcode in (Packet.OPCODE_DATA, Packet.OPCODE_ACK, Packet.OPCODE_OACK):
+            # of a transfer (ended?), peer should stop it.
+            # ERROR packets and garbage are not answered.
+            if self.RATE_LIMIT is None or self.RATE_LIMIT.allow(peer[0]):
+                self._udp_server.reply(self._unknown_tid, peer)
+        return False
+
+    @staticmethod
+    def _session_key(data, peer, opcode):
+        """
+            key of a request in the session table, as in _handle_request(),
+            from its datagram (path is the first token, ascii).
+        """
+        try:
+            path = data[2:data.index('\x00', 2)].decode(u'ascii')
+        except (ValueError, UnicodeDecodeError):
+            return None
+        return (peer, opcode, path)
+
+    def _shed(self, requests):
+        """
+            requests [(data, peer)] shed by ADMISSION.
+        """
+        if self.ADMISSION.policy == self.ADMISSION.ERROR:
+            for data, peer in requests:
+                self._udp_server.reply(self._busy, peer)
 
     def handle_request(self, data, peer):
         """
-            This func is called in a new greenlet.
+            This func is called in a new greenlet,
+            for datagrams accepted by accept_request().
         """
+        try:
+            self._handle_request(data, peer)
+        finally:
+            if self.ADMISSION is not None:
+                # start the next queued request
+                request, shed = self.ADMISSION.release()
+                self._shed(shed)
+                if request is not None:
+                    gevent.spawn(self.handle_request, *request)
 
+    def _handle_request(self, data, peer):
         req = Request.parse(data)
         if req:
+            key = (peer, req.opcode, req.path)
+            if key in self._sessions:
+                # retransmitted by peer, the running session answers it.
+                self._stats[u'duplicates'] += 1
+                return
+
             handler = self.get_hanlder(
                 req, (self.host, self.port), peer, 
                 self._retries, self._timeout
             )
-            handler.run()
+            self._sessions[key] = {
+                u'peer': peer,
+                u'opcode': req.opcode,
+                u'path': req.path,
+                u'mode': req.mode,
+                u'options': dict(req.options),
+                u'started': time.time(),
+            }
+            self._stats[u'sessions'] += 1
+            self._stats[u'active'] += 1
+            try:
+                handler.run()
+            finally:
+                self._stats[u'active'] -= 1
+                del self._sessions[key]
+        else:
+            self._stats[u'invalid'] += 1
 
 
     @property
     def host(self):
+        if self._udp_server is None:
+            return self._ip
         return self._udp_server.server_host
 
     @property
     def port(self):
+        if self._udp_server is None:
+            return self._port
         return self._udp_server.server_port
 
+    def stats(self):
+        """
+            counters of this server,
+            summed over all worker processes in multi-process mode
+            (the supervisor hands them to report_stats()).
+        """
+        if self._workers is None:
+            return self._process_stats()
+
+        stats = dict((k, 0) for k in self._stats)
+        for k, v in self._retired_stats.iteritems():
+            stats[k] = stats.get(k, 0) + v
+        for worker_stats in self._worker_stats.itervalues():
+            for k, v in worker_stats.iteritems():
+                stats[k] = stats.get(k, 0) + v
+        stats[u'workers'] = len(self._worker_fds)
+        return stats
+
+    def _process_stats(self):
+        stats = dict(self._stats)
+        if self.ADMISSION is not None:
+            for k, v in self.ADMISSION.stats().iteritems():
+                if k != u'active':
+                    stats[k] = v
+        return stats
+
+    def sessions(self):
+        """
+            sessions running in this process, a list of dicts:
+                peer, opcode, path, mode, options (requested),
+                started (time.time()).
+            In multi-process mode, each worker has its own (requests
+            of a peer always reach the same worker), the supervisor none.
+        """
+        return [dict(session) for session in self._sessions.itervalues()]
+
     def serve(self):
+        if self._workers is None:
+            self._udp_server.serve_forever()
+        else:
+            self._supervise()
+
+    def _supervise(self):
+        """
+            start worker processes, restart them when they die,
+            collect their stats, and report them (report_stats).
+        """
+        for i in xrange(self._workers):
+            self._start_worker()
+
+        dead = 0
+        reported = time.time()
+        try:
+            while True:
+                fds = dict((fd, pid) for pid, fd in self._worker_fds.iteritems())
+                try:
+                    readable, _, _ = select.select(fds.keys(), [], [], self.STATS_INTERVAL)
+                except select.error as e:
+                    if e.args[0] != errno.EINTR:
+                        raise
+                    readable = []
+
+                for fd in readable:
+                    self._read_worker_stats(fds[fd], fd)
+
+                while True:
+                    try:
+                        pid, status = os.waitpid(-1, os.WNOHANG)
+                    except OSError as e:
+                        if e.args[0] != errno.ECHILD:
+                            raise
+                        pid = 0
+                    if not pid:
+                        break
+                    if pid in self._worker_fds:
+                        logger.error(u'Worker %d exited, status: %d' % (pid, status))
+                        self._retire_worker(pid)
+                        dead += 1
+
+                if dead:
+                    time.sleep(self.RESTART_DELAY)
+                    for i in xrange(dead):
+                        self._start_worker()
+                    dead = 0
+
+                now = time.time()
+                if now - reported >= self.STATS_INTERVAL:
+                    reported = now
+                    self.report_stats(self.stats())
+        finally:
+            for pid in self._worker_fds.keys():
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                    os.waitpid(pid, 0)
+                except OSError:
+                    pass
+                self._retire_worker(pid)
+
+    def report_stats(self, stats):
+        """
+            Called by the supervisor every STATS_INTERVAL in
+            multi-process mode (serve() does not return), with stats()
+            summed over workers; override it to export them.
+        """
+        logger.info(u'Stats: %s' % json.dumps(stats, sort_keys=True))
+
+    def _start_worker(self):
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # worker
+            os.close(rfd)
+            for fd in self._worker_fds.itervalues():
+                os.close(fd)
+            try:
+                self._run_worker(wfd)
+            except BaseException:
+                logger.exception(u'Worker %d failed' % os.getpid())
+            finally:
+                os._exit(1)
+
+        os.close(wfd)
+        self._worker_fds[pid] = rfd
+        self._worker_stats[pid] = {}
+        logger.info(u'Worker %d started' % pid)
+
+    def _retire_worker(self, pid):
+        fd = self._worker_fds.pop(pid)
+        self._read_worker_stats(pid, fd)
+        os.close(fd)
+
+        for k, v in self._worker_stats.pop(pid, {}).iteritems():
+            if k not in (u'active', u'queued'):
+                self._retired_stats[k] = self._retired_stats.get(k, 0) + v
+
+    def _read_worker_stats(self, pid, fd):
+        """
+            keep the last complete report in pipe.
+        """
+        try:
+            data = os.read(fd, 65536)
+        except OSError:
+            return
+
+        for line in reversed(data.split('\n')):
+            try:
+                self._worker_stats[pid] = json.loads(line)
+                break
+            except ValueError:
+                # partial line
+                continue
+
+    def _run_worker(self, wfd):
+        """
+            main of a worker process.
+        """
+        gevent.reinit()
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        reuseport = getattr(socket, 'SO_REUSEPORT', None)
+        if reuseport is None:
+            raise TftpError(u'SO_REUSEPORT is not supported')
+
+        family = socket.AF_INET6 if u':' in unicode(self._ip) else socket.AF_INET
+        listener = socket.socket(family=family, type=socket.SOCK_DGRAM)
+        listener.setsockopt(socket.SOL_SOCKET, reuseport, 1)
+        listener.bind((self._ip, self._port))
+
+        self._udp_server = UdpServer(
+            listener, handle=self.handle_request, spawn=self._spawner, accept=self.accept_request
+        )
+
+        # reports are dropped, rather than blocking, if supervisor is behind.
+        flags = fcntl.fcntl(wfd, fcntl.F_GETFL)
+        fcntl.fcntl(wfd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        gevent.spawn(self._report_stats, wfd)
+
         self._udp_server.serve_forever()
 
+    def _report_stats(self, wfd):
+        while True:
+            try:
+                os.write(wfd, json.dumps(self._process_stats()) + '\n')
+            except OSError as e:
+                if e.args[0] == errno.EPIPE:
+                    # supervisor is gone.
+                    logger.error(u'Supervisor exited, worker %d stops' % os.getpid())
+                    self._udp_server.stop()
+                    return
+                if e.args[0] != errno.EAGAIN:
+                    raise
+            gevent.sleep(self.STATS_INTERVAL)
+
 
     def get_hanlder(self, req, server_addr, peer, retries, timeout):
         """
@@ -76,7 +472,8 @@ class Server(object):
                 servre_addr -> (host, port)
                 peer -> (host, port)
                 retries -> times of retranmission when timeout.
-                timeout -> timeout of receiving packets.
+                timeout -> timeout of receiving packets (upper bound of
+                           adaptive retransmission timeout), seconds.
         """
         raise NotImplemented()
 
@@ -0,0 +1,128 @@
+# -*- coding:utf-8 -*-
+
+import ctypes
+import ctypes.util
+import errno
+import mmap
+import os
+
+from .handler import Target
+
+
+try:
+    _fallocate = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True).fallocate
+except (OSError, AttributeError):
+    # not Linux
+    _fallocate = None
+else:
+    _fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    _fallocate.restype = ctypes.c_int
+
+
+def preallocate(fd, size):
+    """
+        Reserve disk blocks for the first size bytes of file fd (the
+        file size grows to size), raise IOError(ENOSPC) if the file
+        system has not enough free space.
+
+        File systems without fallocate() are only checked for free
+        space, no blocks are reserved.
+    """
+    st = os.fstat(fd)
+    needed = size - st.st_size
+    if needed <= 0:
+        return
+
+    vfs = os.fstatvfs(fd)
+    if vfs.f_bavail * vfs.f_frsize < needed:
+        raise IOError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+
+    if _fallocate is None:
+        return
+    if _fallocate(fd, 0, 0, size) != 0:
+        err = ctypes.get_errno()
+        if err in (errno.EOPNOTSUPP, errno.ENOSYS):
+            return
+        raise IOError(err, os.strerror(err))
+
+
+class MmapFileTarget(Target):
+    """
+        Read-only file target on a memory mapping.
+
+        Blocks are copied straight from the page cache into packet
+        buffers (readinto), so sessions reading the same file share
+        its pages without per-session buffering.
+        Any part of the file can be accessed at any time (view),
+        e.g. to retransmit earlier blocks.
+
+        Touching a page of a mapping beyond the end of its file kills
+        the process with SIGBUS (every session, not only this one): a
+        file truncated or rewritten in place while it is served. The
+        file size is checked again before each access, parts no longer
+        in the file are read() instead; a truncation racing with the
+        copy itself is still fatal, so serve files which are replaced
+        (rename) rather than rewritten, or use a plain file target.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        st = os.fstat(self._file.fileno())
+        self._size = st.st_size
+        self._key = (os.path.abspath(path), st.st_mtime, st.st_size)
+        self._pos = 0
+
+        self._mmap = None
+        if self._size:
+            # a file of 0 bytes can not be mapped.
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def view(self, offset, size):
+        """
+            Zero-copy, read-only buffer of (at most) size bytes at offset,
+            fewer if the file was truncated (a copy then).
+            Only valid until the target is closed.
+        """
+        offset = min(max(int(offset), 0), self._size)
+        size = min(max(int(size), 0), self._size - offset)
+        if not size:
+            return buffer('')
+        if os.fstat(self._file.fileno()).st_size < offset + size:
+            # truncated since it was mapped, see class docstring.
+            self._file.seek(offset)
+            return buffer(self._file.read(size))
+        # mmap has no new-style buffer interface in python 2,
+        # buffer() is the zero-copy way to slice it.
+        return buffer(self._mmap, offset, size)
+
+    def seek(self, offset):
+        self._pos = min(max(int(offset), 0), self._size)
+
+    def tell(self):
+        return self._pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._size - self._pos
+        data = str(self.view(self._pos, size))
+        self._pos += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.view(self._pos, len(buffer))
+        n = len(data)
+        buffer[:n] = data
+        self._pos += n
+        return n
+
+    def size(self):
+        return self._size
+
+    def cache_key(self):
+        return self._key
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
@@ -0,0 +1,170 @@
+# -*- coding:utf-8 -*-
+
+"""
+    Write-behind for write sessions.
+
+    Received data is queued, and written to the target by a greenlet
+    of its own, in chunks of chunk_size (data queued meanwhile is
+    coalesced), so the session acknowledges blocks without waiting for
+    the disk. The session only waits when max_buffered bytes are
+    queued (backpressure), and at the end of the transfer: the last
+    block is acknowledged once all data is written, and synced to
+    disk (Target.sync(), fsync) if asked, in a thread.
+
+    Write errors are reported to the client as ERROR packets (DISK_FULL,
+    ACCESS_VIOLATION ...) at its next block, or its last one.
+
+    Writes overlap with the transfer when they yield to the hub, e.g.
+    with gtftp.offload.
+
+    Usage:
+        BaseWriteHandler.WRITE_BEHIND = WriteBehind(max_buffered=4 * 1024 * 1024, fsync=True)
+"""
+
+from collections import deque
+
+from gevent import spawn, get_hub
+from gevent.event import Event
+
+from .packet import Error
+from .handler import Target
+from .logger import logger
+
+
+class WriteBehindTarget(Target):
+    """
+        Write-only target queueing data for its target.
+    """
+
+    def __init__(self, target, max_buffered, chunk_size, fsync=False):
+        self._target = target
+        self._max_buffered = int(max_buffered)
+        self._chunk_size = int(chunk_size)
+        self._fsync = fsync
+
+        self._buffer = deque()      # data not written yet
+        self._buffered = 0
+        self._error = None          # Error of a failed write
+        self._writer = None         # greenlet
+
+        self._has_data = Event()
+        self._has_space = Event()
+        self._has_space.set()
+        self._idle = Event()        # all data written
+        self._idle.set()
+
+    def __getattr__(self, name):
+        # optional hooks of target
+        return getattr(self._target, name)
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def write(self, data):
+        self._raise_error()
+        while self._buffered >= self._max_buffered:
+            self._has_space.clear()
+            self._has_space.wait()
+            self._raise_error()
+
+        self._buffer.append(data)
+        self._buffered += len(data)
+        self._idle.clear()
+        self._has_data.set()
+        if self._writer is None:
+            self._writer = spawn(self._write_behind)
+
+    def _write_behind(self):
+        while True:
+            self._has_data.wait()
+
+            chunk = []
+            size = 0
+            while self._buffer and size < self._chunk_size:
+                data = self._buffer.popleft()
+                chunk.append(data)
+                size += len(data)
+            if not self._buffer:
+                self._has_data.clear()
+
+            try:
+                self._target.write(''.join(chunk))
+            except (IOError, OSError) as e:
+                logger.error(u'Write failed: %s' % e)
+                self._error = Error.from_io_error(e)
+                # wake up the session, to raise the error.
+                self._buffer.clear()
+                self._buffered = 0
+                self._has_space.set()
+                self._idle.set()
+                return
+
+            self._buffered -= size
+            self._has_space.set()
+            if not self._buffer:
+                self._idle.set()
+
+    def flush(self):
+        """
+            wait for queued data to be written (and synced, with fsync).
+            raise Error if a write failed.
+        """
+        self._raise_error()
+        self._idle.wait()
+        self._raise_error()
+
+        if self._fsync:
+            sync = getattr(self._target, 'sync', None)
+            if sync is not None:
+                try:
+                    # fsync blocks, run it off the hub.
+                    get_hub().threadpool.apply(sync)
+                except (IOError, OSError) as e:
+                    self._error = Error.from_io_error(e)
+                    raise self._error
+
+    def allocate(self, size):
+        allocate = getattr(self._target, 'allocate', None)
+        if allocate is not None:
+            return allocate(size)
+
+    def truncate(self, size):
+        truncate = getattr(self._target, 'truncate', None)
+        if truncate is not None:
+            # after queued data is written.
+            self._idle.wait()
+            return truncate(size)
+
+    def size(self):
+        raise NotImplemented()
+
+    def close(self):
+        try:
+            if self._error is None:
+                self.flush()
+        except Error as e:
+            logger.error(u'Data lost at close: %s' % e.message)
+        finally:
+            if self._writer is not None:
+                self._writer.kill()
+                self._writer = None
+            self._target.close()
+
+
+class WriteBehind(object):
+    """
+        Wraps targets of write sessions (BaseWriteHandler.WRITE_BEHIND).
+
+        max_buffered -> bytes queued before a session waits for writes.
+        chunk_size -> bytes to coalesce per write to target.
+        fsync -> sync data to disk before acknowledging the last block.
+    """
+
+    def __init__(self, max_buffered=1024 * 1024, chunk_size=256 * 1024, fsync=False):
+        self._max_buffered = int(max_buffered)
+        self._chunk_size = int(chunk_size)
+        self._fsync = fsync
+
+    def wrap(self, target):
+        return WriteBehindTarget(target, self._max_buffered, self._chunk_size, self._fsync)
@@ -0,0 +1,11 @@
+# -*- coding:utf-8 -*-
+
+"""
+    Run with: python -m unittest discover -t . -s tests
+"""
+
+import logging
+
+from gtftp.logger import logger
+
+logger.setLevel(logging.CRITICAL)
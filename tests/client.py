@@ -0,0 +1,98 @@
+# -*- coding:utf-8 -*-
+
+"""
+    Minimal blocking TFTP client for tests, on gevent sockets: servers
+    run in greenlets of the test process can answer it.
+"""
+
+import struct
+
+from gevent import socket
+
+
+class TftpError(Exception):
+    def __init__(self, code, message):
+        super(TftpError, self).__init__(code, message)
+        self.code = code
+        self.message = message
+
+
+def request(opcode, path, mode='octet', options=None):
+    packet = struct.pack('!H', opcode) + path + '\x00' + mode + '\x00'
+    for k, v in sorted((options or {}).items()):
+        packet += k + '\x00' + str(v) + '\x00'
+    return packet
+
+
+def parse_oack(packet):
+    fields = packet[2:].split('\x00')[:-1]
+    return dict(zip(fields[::2], fields[1::2]))
+
+
+def raise_error(packet):
+    if struct.unpack('!H', packet[:2])[0] == 5:
+        code = struct.unpack('!H', packet[2:4])[0]
+        raise TftpError(code, packet[4:].rstrip('\x00'))
+
+
+def rrq(address, path, options=None, mode='octet', timeout=2.0):
+    """
+        read path, return (content, oack options).
+        raise TftpError on ERROR.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(timeout)
+    try:
+        sock.sendto(request(1, path, mode, options), address)
+        blksize = 512
+        oack = {}
+        data = []
+        expected = 1
+        while True:
+            packet, peer = sock.recvfrom(65536)
+            raise_error(packet)
+            opcode = struct.unpack('!H', packet[:2])[0]
+            if opcode == 6:
+                oack = parse_oack(packet)
+                blksize = int(oack.get('blksize', blksize))
+                sock.sendto(struct.pack('!HH', 4, 0), peer)
+                continue
+
+            block = struct.unpack('!H', packet[2:4])[0]
+            if block == expected:
+                data.append(packet[4:])
+                expected += 1
+                if 'windowsize' not in oack or len(packet) - 4 < blksize or \
+                        (block % int(oack['windowsize'])) == 0:
+                    sock.sendto(struct.pack('!HH', 4, block), peer)
+                if len(packet) - 4 < blksize:
+                    return ''.join(data), oack
+    finally:
+        sock.close()
+
+
+def wrq(address, path, content, options=None, timeout=2.0):
+    """
+        write content to path, return oack options.
+        raise TftpError on ERROR.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(timeout)
+    try:
+        sock.sendto(request(2, path, 'octet', options), address)
+        packet, peer = sock.recvfrom(65536)
+        raise_error(packet)
+        oack = parse_oack(packet) if struct.unpack('!H', packet[:2])[0] == 6 else {}
+        blksize = int(oack.get('blksize', 512))
+
+        block = 0
+        while True:
+            chunk = content[block * blksize:(block + 1) * blksize]
+            block += 1
+            sock.sendto(struct.pack('!HH', 3, block) + chunk, peer)
+            packet, _ = sock.recvfrom(65536)
+            raise_error(packet)
+            if len(chunk) < blksize:
+                return oack
+    finally:
+        sock.close()
@@ -0,0 +1,32 @@
+# -*- coding:utf-8 -*-
+
+"""
+    Server run in the hub of the test process, on a free port.
+"""
+
+from gtftp.server import Server
+
+
+class HandlerServer(Server):
+    def __init__(self, read_handler=None, write_handler=None, retries=3, timeout=1):
+        self.read_handler = read_handler
+        self.write_handler = write_handler
+        super(HandlerServer, self).__init__(u'127.0.0.1', 0, retries, timeout)
+
+    def get_hanlder(self, req, server_addr, peer, retries, timeout):
+        if req.opcode == req.OPCODE_RRQ:
+            handler_class = self.read_handler
+        else:
+            handler_class = self.write_handler
+        return handler_class(req, server_addr, peer, retries, timeout)
+
+    @property
+    def address(self):
+        return (self.host, self.port)
+
+    def start(self):
+        self._udp_server.start()
+        return self
+
+    def stop(self):
+        self._udp_server.stop()
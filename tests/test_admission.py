@@ -0,0 +1,67 @@
+# -*- coding:utf-8 -*-
+
+import time
+import unittest
+
+from gtftp.admission import Admission, Priority
+
+from .client import request
+
+
+def rrq(path):
+    return request(1, path)
+
+
+class AdmissionTest(unittest.TestCase):
+    def test_no_queue(self):
+        admission = Admission(max_active=1, max_queued=0)
+        self.assertEqual(admission.admit(rrq('a'), ('10.0.0.1', 1)), (True, []))
+        self.assertEqual(
+            admission.admit(rrq('b'), ('10.0.0.1', 2)),
+            (False, [(rrq('b'), ('10.0.0.1', 2))])
+        )
+        self.assertEqual(admission.release(), (None, []))
+        self.assertEqual(admission.admit(rrq('c'), ('10.0.0.1', 3)), (True, []))
+
+        stats = admission.stats()
+        self.assertEqual(stats[u'admitted'], 2)
+        self.assertEqual(stats[u'shed'], 1)
+        self.assertEqual(stats[u'queued'], 0)
+
+    def test_no_queue_with_priority(self):
+        admission = Admission(max_active=1, max_queued=0, priority=Priority(paths=[(u'boot', 0)], default=1))
+        admission.admit(rrq('a'), ('10.0.0.1', 1))
+        start, shed = admission.admit(rrq('boot'), ('10.0.0.1', 2))
+        self.assertFalse(start)
+        self.assertEqual(shed, [(rrq('boot'), ('10.0.0.1', 2))])
+
+    def test_priority_and_retransmission(self):
+        admission = Admission(
+            max_active=1, max_queued=2,
+            priority=Priority(paths=[(u'boot', 0)], subnets=[(u'10.1.0.0/16', 1)], default=2)
+        )
+        self.assertTrue(admission.admit(rrq('a'), ('10.0.0.1', 1))[0])
+        self.assertEqual(admission.admit(rrq('b'), ('10.0.0.1', 2)), (False, []))
+        self.assertEqual(admission.admit(rrq('c'), ('10.1.0.1', 3)), (False, []))
+        # retransmitted, keeps its place
+        self.assertEqual(admission.admit(rrq('c'), ('10.1.0.1', 3)), (False, []))
+        # queue full: the newest of the lowest priority is shed
+        self.assertEqual(
+            admission.admit(rrq('boot'), ('10.0.0.1', 4)),
+            (False, [(rrq('b'), ('10.0.0.1', 2))])
+        )
+        self.assertEqual(admission.release()[0], (rrq('boot'), ('10.0.0.1', 4)))
+        self.assertEqual(admission.release()[0], (rrq('c'), ('10.1.0.1', 3)))
+        self.assertEqual(admission.release()[0], None)
+
+    def test_expired(self):
+        admission = Admission(max_active=1, max_queued=2, max_wait=0.01)
+        admission.admit(rrq('a'), ('10.0.0.1', 1))
+        admission.admit(rrq('b'), ('10.0.0.1', 2))
+        time.sleep(0.02)
+        self.assertEqual(admission.release(), (None, [(rrq('b'), ('10.0.0.1', 2))]))
+        self.assertEqual(admission.stats()[u'expired'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
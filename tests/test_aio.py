@@ -0,0 +1,94 @@
+# -*- coding:utf-8 -*-
+
+import errno
+import io
+import threading
+import unittest
+
+from gtftp.aio import AsyncServer, AsyncReadHandler, AsyncWriteHandler, asyncio
+from gtftp.handler import Target
+from gtftp.packet import Packet, Error
+
+from .client import rrq, wrq, TftpError
+
+
+CONTENT = 'x' * 3000
+
+
+class StringTarget(Target):
+    def __init__(self, content=''):
+        self._io = io.BytesIO(content)
+        self._size = len(content)
+
+    def read(self, n):
+        return self._io.read(n)
+
+    def write(self, data):
+        self._io.write(data)
+
+    def size(self):
+        return self._size
+
+    def close(self):
+        pass
+
+
+class FullDiskTarget(StringTarget):
+    def allocate(self, size):
+        raise IOError(errno.ENOSPC, u'No space left on device')
+
+
+class ReadHandler(AsyncReadHandler):
+    def get_target(self, path):
+        return StringTarget(CONTENT)
+
+
+class WriteHandler(AsyncWriteHandler):
+    def get_target(self, path):
+        if path == u'full':
+            return FullDiskTarget()
+        return StringTarget()
+
+
+class TestServer(AsyncServer):
+    def get_hanlder(self, req, server_addr, peer, retries, timeout):
+        if req.opcode == Packet.OPCODE_RRQ:
+            return ReadHandler(req, server_addr, peer, retries, timeout)
+        return WriteHandler(req, server_addr, peer, retries, timeout)
+
+
+class AsyncServerTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = TestServer(u'127.0.0.1', 0, timeout=1, loop=self.loop)
+        self.loop.run_until_complete(self.server.start())
+        self.address = (self.server.host, self.server.port)
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.server.close()
+        self.loop.close()
+
+    def test_session_after_rejected_options(self):
+        for i in range(3):
+            with self.assertRaises(TftpError) as cm:
+                rrq(self.address, 'file', {'blksize': 1})
+            self.assertEqual(cm.exception.code, Error.INVALID_OPTIONS)
+
+            data, _ = rrq(self.address, 'file')
+            self.assertEqual(data, CONTENT)
+
+    def test_session_after_disk_full(self):
+        for i in range(3):
+            with self.assertRaises(TftpError) as cm:
+                wrq(self.address, 'full', 'abc', {'tsize': 3})
+            self.assertEqual(cm.exception.code, Error.DISK_FULL)
+
+            wrq(self.address, 'file', 'abc' * 400, {'tsize': 1200})
+
+
+if __name__ == '__main__':
+    unittest.main()
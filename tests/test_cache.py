@@ -0,0 +1,56 @@
+# -*- coding:utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from gtftp.cache import FileCache
+
+
+class FileCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.paths = []
+        for i in range(20):
+            path = os.path.join(self.dir, '%d.bin' % i)
+            with open(path, 'wb') as f:
+                f.write(chr(i) * (1000 + i))
+            self.paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_concurrent_get_target(self):
+        # as called by sessions with gtftp.offload
+        cache = FileCache(max_bytes=8000)
+        errors = []
+
+        def run(offset):
+            try:
+                for i in range(300):
+                    path = self.paths[(i * 7 + offset) % len(self.paths)]
+                    target = cache.get_target(path)
+                    data = target.read(-1)
+                    target.close()
+                    if data != open(path, 'rb').read():
+                        errors.append(path)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(cache.size, sum(len(e[1]) for e in cache._entries.values()))
+        self.assertLessEqual(cache.size, 8000)
+        stats = cache.stats()
+        self.assertEqual(stats[u'hits'] + stats[u'misses'], 8 * 300)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding:utf-8 -*-
+
+import os
+import shutil
+import struct
+import tempfile
+import time
+import unittest
+
+import gevent
+from gevent.monkey import get_original
+
+from gtftp.framestore import FrameStore, FramedImage
+
+
+thread_sleep = get_original('time', 'sleep')
+
+
+def wait_image(store, source, blksize, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        image = store.get_image(source, blksize)
+        if image is not None:
+            return image
+        gevent.sleep(0.01)
+    raise AssertionError(u'image not built')
+
+
+class FrameStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.dir, 'image.bin')
+        with open(self.source, 'wb') as f:
+            f.write(''.join(chr(i % 251) for i in xrange(5000)))
+        self.store = FrameStore(os.path.join(self.dir, 'store'))
+
+        self.builds = 0
+        self._build = FramedImage.__dict__['build']
+        build = FramedImage.build
+
+        def counting_build(cls, *args):
+            self.builds += 1
+            # long enough for the test to look at it while it runs.
+            thread_sleep(0.1)
+            return build(*args)
+        FramedImage.build = classmethod(counting_build)
+
+    def tearDown(self):
+        FramedImage.build = self._build
+        shutil.rmtree(self.dir)
+
+    def test_built_in_background_once(self):
+        self.assertIsNone(self.store.get_image(self.source, 512))
+        # source is served meanwhile, no second build
+        self.assertIsNone(self.store.get_image(self.source, 512))
+        target = self.store.get_target(self.source)
+        self.assertIsNone(target.frames(512))
+        self.assertEqual(len(target.read(-1)), 5000)
+        target.close()
+
+        image = wait_image(self.store, self.source, 512)
+        self.assertEqual(self.builds, 1)
+        self.assertEqual(len(image), 5000 // 512 + 1)
+        frame = str(image.frame(1))
+        self.assertEqual(struct.unpack('!HH', frame[:4]), (3, 2))
+        with open(self.source, 'rb') as f:
+            self.assertEqual(frame[4:], f.read()[512:1024])
+
+    def test_rebuilt_when_source_changes(self):
+        wait_image(self.store, self.source, 512)
+        with open(self.source, 'ab') as f:
+            f.write('more')
+
+        self.assertIsNone(self.store.get_image(self.source, 512))
+        image = wait_image(self.store, self.source, 512)
+        self.assertEqual(image.source_size, 5004)
+        self.assertEqual(self.builds, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+# -*- coding:utf-8 -*-
+
+import io
+import struct
+import unittest
+
+import gevent
+from gevent import socket
+
+from gtftp.handler import BaseReadHandler, Target
+from gtftp.multicast import MulticastManager
+from gtftp.packet import Request
+
+from .client import request, parse_oack
+
+
+CONTENT = 'line\n' * 300
+
+
+class SeekableTarget(Target):
+    def __init__(self, content):
+        self._io = io.BytesIO(content)
+        self._size = len(content)
+
+    def read(self, n):
+        return self._io.read(n)
+
+    def readinto(self, buffer):
+        return self._io.readinto(buffer)
+
+    def seek(self, offset):
+        self._io.seek(offset)
+
+    def size(self):
+        return self._size
+
+    def close(self):
+        pass
+
+
+class MulticastHandler(BaseReadHandler):
+    MULTICAST = None
+
+    def get_target(self, path):
+        return SeekableTarget(CONTENT)
+
+
+class MulticastTest(unittest.TestCase):
+    def setUp(self):
+        MulticastHandler.MULTICAST = MulticastManager([u'239.255.69.1'])
+        self.sessions = []
+        self.clients = []
+
+    def tearDown(self):
+        gevent.killall(self.sessions)
+        for sock in self.clients:
+            sock.close()
+
+    def start(self, mode):
+        """
+            client socket of a new session of a multicast RRQ.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.settimeout(2)
+        self.clients.append(sock)
+
+        req = Request.parse(request(1, 'file', mode, {'multicast': '', 'tsize': 0}))
+        handler = MulticastHandler(req, ('127.0.0.1', 0), sock.getsockname(), 3, 1)
+        self.sessions.append(gevent.spawn(handler.run))
+        return sock
+
+    def test_first_client_is_master_at_once(self):
+        master = self.start('octet')
+        packet, _ = master.recvfrom(65536)
+        self.assertTrue(parse_oack(packet)['multicast'].endswith(',1'))
+
+        other = self.start('octet')
+        packet, _ = other.recvfrom(65536)
+        self.assertTrue(parse_oack(packet)['multicast'].endswith(',0'))
+
+    def test_client_error_leaves_session(self):
+        master = self.start('octet')
+        _, server = master.recvfrom(65536)
+        other = self.start('octet')
+        other.recvfrom(65536)
+        # other aborts, while it is not master
+        other.sendto(struct.pack('!HH', 5, 0) + 'cancelled\x00', server)
+
+        # master gets the whole file (DATA to the group are not read)
+        for block in xrange(len(CONTENT) // 512 + 2):
+            master.sendto(struct.pack('!HH', 4, block), server)
+            gevent.sleep(0.01)
+
+        # other is not elected master, the session ends.
+        self.sessions[0].join(timeout=0.5)
+        self.assertTrue(self.sessions[0].dead)
+        self.assertEqual(MulticastHandler.MULTICAST.sessions, [])
+
+    def test_netascii_does_not_join_octet_session(self):
+        master = self.start('octet')
+        packet, _ = master.recvfrom(65536)
+        self.assertIn('multicast', parse_oack(packet))
+
+        sock = self.start('netascii')
+        packet, peer = sock.recvfrom(65536)
+        oack = parse_oack(packet)
+        # served by unicast, with netascii tsize
+        self.assertNotIn('multicast', oack)
+        encoded = CONTENT.replace('\n', '\r\n')
+        self.assertEqual(int(oack['tsize']), len(encoded))
+
+        sock.sendto(struct.pack('!HH', 4, 0), peer)
+        data = []
+        while True:
+            packet, peer = sock.recvfrom(65536)
+            block = struct.unpack('!H', packet[2:4])[0]
+            data.append(packet[4:])
+            sock.sendto(struct.pack('!HH', 4, block), peer)
+            if len(packet) - 4 < 512:
+                break
+        self.assertEqual(''.join(data), encoded)
+
+
+if __name__ == '__main__':
+    unittest.main()
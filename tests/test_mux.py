@@ -0,0 +1,68 @@
+# -*- coding:utf-8 -*-
+
+import struct
+import unittest
+
+import gevent
+from gevent import socket
+
+from gtftp.mux import SessionMux
+
+
+class SessionMuxTest(unittest.TestCase):
+    def setUp(self):
+        self.mux = SessionMux(u'127.0.0.1', sockets=2)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(2)
+        self.peer = self.sock.getsockname()
+
+    def tearDown(self):
+        self.sock.close()
+        for sock, _ in self.mux._sockets:
+            sock.close()
+
+    def test_dispatch(self):
+        channel = self.mux.open(self.peer)
+        channel.sendto('hello', self.peer)
+        _, address = self.sock.recvfrom(65536)
+        self.assertEqual(address, channel.getsockname())
+
+        self.sock.sendto('\x00\x04\x00\x01', address)
+        self.assertEqual(channel.recvfrom(65536), ('\x00\x04\x00\x01', self.peer))
+
+        # unknown peer
+        other = self.mux.open(self.peer)
+        self.assertNotEqual(other.getsockname(), address)
+        other.close()
+        self.sock.sendto('\x00\x04\x00\x01', other.getsockname())
+        packet, _ = self.sock.recvfrom(65536)
+        self.assertEqual(struct.unpack('!HH', packet[:4]), (5, 5))    # UNKNOWN_TRANSFER_ID
+        self.assertEqual(self.mux.stats()[u'dropped'], 1)
+        channel.close()
+        self.assertIsNone(self.mux.open(self.peer).close())
+        self.assertEqual(self.mux.sessions, 0)
+
+    def test_closed_socket(self):
+        channel = self.mux.open(self.peer)
+        dead = channel._sock
+        dead.close()
+        # the reader stops (does not spin), the socket leaves the pool
+        gevent.sleep(0.01)
+        self.assertEqual(self.mux.stats()[u'sockets'], 1)
+
+        channel = self.mux.open(self.peer)
+        self.assertIsNot(channel._sock, dead)
+        channel.sendto('hello', self.peer)
+        self.assertEqual(self.sock.recvfrom(65536)[0], 'hello')
+
+        # every socket lost: new ones
+        channel._sock.close()
+        gevent.sleep(0.01)
+        self.assertEqual(self.mux.stats()[u'sockets'], 0)
+        self.assertIsNotNone(self.mux.open(self.peer))
+        self.assertEqual(self.mux.stats()[u'sockets'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# -*- coding:utf-8 -*-
+
+import io
+import unittest
+
+from gtftp.netascii import NetasciiReader, NetasciiWriter
+
+
+class Sink(object):
+    def __init__(self):
+        self.data = []
+        self.closed = False
+
+    def write(self, data):
+        self.data.append(data)
+
+    def close(self):
+        self.closed = True
+
+
+def encode(content, blksize, chunk_size=None):
+    """
+        content read through a NetasciiReader, blksize bytes at a time.
+        return ([blocks], size()).
+    """
+    reader = NetasciiReader(io.BytesIO(content))
+    if chunk_size is not None:
+        reader.CHUNK_SIZE = chunk_size
+    size = reader.size()
+    blocks = []
+    while True:
+        block = reader.read(blksize)
+        blocks.append(block)
+        if len(block) < blksize:
+            return blocks, size
+
+
+def decode(blocks):
+    sink = Sink()
+    writer = NetasciiWriter(sink)
+    for block in blocks:
+        writer.write(block)
+    writer.close()
+    assert sink.closed
+    return ''.join(sink.data)
+
+
+class NetasciiReaderTest(unittest.TestCase):
+    def test_line_ends(self):
+        blocks, size = encode('a\nb\rc\r\n', 512)
+        self.assertEqual(blocks, ['a\r\nb\r\x00c\r\x00\r\n'])
+        self.assertEqual(size, 11)
+
+    def test_cr_at_block_boundary(self):
+        # 'ab\r' encodes to 'ab\r\x00', split after its CR
+        blocks, size = encode('ab\rcd\nef', 3)
+        self.assertEqual(blocks, ['ab\r', '\x00cd', '\r\ne', 'f'])
+        self.assertEqual(size, 10)
+
+    def test_cr_at_chunk_boundary(self):
+        content = 'ab\r\ncd\r' * 100
+        blocks, size = encode(content, 7, chunk_size=3)
+        self.assertEqual(''.join(blocks), NetasciiReader.encode(content))
+        self.assertEqual(size, len(NetasciiReader.encode(content)))
+
+    def test_trailing_cr(self):
+        blocks, size = encode('abc\r', 4)
+        self.assertEqual(blocks, ['abc\r', '\x00'])
+        self.assertEqual(size, 5)
+
+
+class NetasciiWriterTest(unittest.TestCase):
+    def test_line_ends(self):
+        self.assertEqual(decode(['a\r\nb\r\x00c\r\x00\r\n']), 'a\nb\rc\r\n')
+
+    def test_cr_lf_at_block_boundary(self):
+        self.assertEqual(decode(['ab\r', '\ncd']), 'ab\ncd')
+
+    def test_cr_nul_at_block_boundary(self):
+        self.assertEqual(decode(['ab\r', '\x00cd']), 'ab\rcd')
+
+    def test_cr_at_every_boundary(self):
+        content = 'ab\r\ncd\r' * 100
+        encoded = NetasciiReader.encode(content)
+        blocks = [encoded[i:i + 3] for i in xrange(0, len(encoded), 3)]
+        self.assertEqual(decode(blocks), content)
+
+    def test_trailing_cr(self):
+        # not valid netascii, kept.
+        self.assertEqual(decode(['abc\r']), 'abc\r')
+        self.assertEqual(decode(['abc\r', '']), 'abc\r')
+
+    def test_buffer_types(self):
+        self.assertEqual(decode([bytearray('a\r'), memoryview('\nb'), u'\r\x00']), 'a\nb\r')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# -*- coding:utf-8 -*-
+
+import io
+import unittest
+
+from gevent.monkey import get_original
+
+from gtftp.handler import Target
+from gtftp.netascii import NetasciiReader, NetasciiSizeCache
+from gtftp.offload import Offload
+from gtftp.prefetch import ReadAheadTarget
+
+
+get_ident = get_original('thread', 'get_ident')
+thread_sleep = get_original('time', 'sleep')
+
+
+class RecordingTarget(Target):
+    """
+        records (method, thread) of calls.
+    """
+
+    def __init__(self, content=''):
+        self._io = io.BytesIO(content)
+        self._size = len(content)
+        self.calls = []
+
+    def _record(self, name):
+        self.calls.append((name, get_ident()))
+
+    def read(self, size=-1):
+        self._record(u'read')
+        return self._io.read(size)
+
+    def write(self, data):
+        self._record(u'write')
+        self._io.write(data)
+
+    def seek(self, offset):
+        self._io.seek(offset)
+
+    def size(self):
+        self._record(u'size')
+        return self._size
+
+    def sync(self):
+        self._record(u'sync')
+
+    def allocate(self, size):
+        self._record(u'allocate')
+
+    def truncate(self, size):
+        self._record(u'truncate')
+
+    def cache_key(self):
+        return (u'key', self._size)
+
+    def close(self):
+        self._record(u'close')
+
+
+class OffloadedTargetTest(unittest.TestCase):
+    def setUp(self):
+        self.target = RecordingTarget('a\nb\n')
+        self.offloaded = Offload(max_threads=2).wrap(self.target)
+
+    def test_optional_methods_reach_target_in_pool(self):
+        self.offloaded.allocate(10)
+        self.offloaded.write('data')
+        self.offloaded.truncate(4)
+        self.offloaded.sync()
+        self.offloaded.close()
+
+        names = [name for name, _ in self.target.calls]
+        self.assertEqual(names, [u'allocate', u'write', u'truncate', u'sync', u'close'])
+        for _, ident in self.target.calls:
+            self.assertNotEqual(ident, get_ident())
+
+    def test_cache_key(self):
+        self.assertEqual(self.offloaded.cache_key(), (u'key', 4))
+
+    def test_netascii_size_cache(self):
+        cache = NetasciiSizeCache()
+        self.assertEqual(NetasciiReader(self.offloaded, cache).size(), 6)
+        self.assertEqual(cache.get((u'key', 4)), 6)
+
+
+class SlowTarget(RecordingTarget):
+    def read(self, size=-1):
+        self._record(u'read-start')
+        thread_sleep(0.05)
+        data = self._io.read(size)
+        self._record(u'read-end')
+        return data
+
+
+class ReadAheadCloseTest(unittest.TestCase):
+    def test_close_waits_for_offloaded_read(self):
+        target = SlowTarget('x' * 64)
+        read_ahead = ReadAheadTarget(Offload(max_threads=2).wrap(target), 16, 16)
+        self.assertEqual(read_ahead.read(16), 'x' * 16)
+        # the reader is reading the next chunks in a thread.
+        read_ahead.close()
+
+        names = [name for name, _ in target.calls]
+        self.assertEqual(names[-1], u'close')
+        self.assertEqual(names.count(u'read-start'), names.count(u'read-end'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+# -*- coding:utf-8 -*-
+
+import unittest
+
+from gtftp.packet import *
+
+
+class RequestParseTest(unittest.TestCase):
+    def parse(self, raw):
+        req = Request.parse(raw)
+        return (req.opcode, req.path, req.mode, req.options) if req else None
+
+    def test_request(self):
+        self.assertEqual(
+            self.parse('\x00\x01file\x00OCTET\x00BlkSize\x001024\x00'),
+            (1, u'file', u'octet', {u'blksize': u'1024'})
+        )
+        self.assertEqual(self.parse('\x00\x02file\x00netascii\x00'), (2, u'file', u'netascii', {}))
+
+    def test_empty_option_value(self):
+        # RFC 2090 'multicast' has an empty value
+        self.assertEqual(
+            self.parse('\x00\x01file\x00octet\x00multicast\x00\x00blksize\x00512\x00'),
+            (1, u'file', u'octet', {u'multicast': u'', u'blksize': u'512'})
+        )
+
+    def test_empty_option_name(self):
+        self.assertEqual(
+            self.parse('\x00\x01file\x00octet\x00\x001\x00blksize\x00512\x00'),
+            (1, u'file', u'octet', {u'blksize': u'512'})
+        )
+
+    def test_padding(self):
+        self.assertEqual(self.parse('\x00\x01file\x00octet\x00\x00\x00'), (1, u'file', u'octet', {}))
+        self.assertEqual(self.parse('\x00\x01file\x00octet\x00\x00\x00\x00\x00'), (1, u'file', u'octet', {}))
+
+    def test_odd_tokens(self):
+        self.assertIsNone(self.parse('\x00\x01file\x00octet\x00blksize\x00'))
+        self.assertIsNone(self.parse('\x00\x01file\x00'))
+        with self.assertRaises(InvalidTftpPacket):
+            Request.parse('\x00\x01file\x00octet\x00blksize\x00', safe=False)
+
+    def test_invalid(self):
+        self.assertIsNone(self.parse('\x00\x01'))
+        self.assertIsNone(self.parse('\x00\x01file\x00mail\x00'))
+        self.assertIsNone(self.parse('\x00\x01f\xe9\x00octet\x00'))
+        self.assertIsNone(self.parse('\x00\x04\x00\x01'))
+        self.assertIsNone(self.parse(''))
+
+    def test_raw(self):
+        req = Request(1, u'file', u'octet', {u'blksize': 512})
+        self.assertEqual(self.parse(req.raw()), (1, u'file', u'octet', {u'blksize': u'512'}))
+
+
+class ParseAnyTest(unittest.TestCase):
+    def test_dispatch(self):
+        self.assertIsInstance(parse_any('\x00\x01file\x00octet\x00'), Request)
+        data = parse_any(bytearray('\x00\x03\x00\x01abc'))
+        self.assertIsInstance(data, Data)
+        self.assertEqual((data.block_number, data.data), (1, 'abc'))
+        self.assertEqual(parse_any(memoryview('\x00\x04\x00\x07')).block_number, 7)
+        err = parse_any('\x00\x05\x00\x01oops\x00')
+        self.assertEqual((err.code, err.message), (1, u'oops'))
+
+    def test_short(self):
+        for raw in ('', '\x00', '\x00\x03\x00', '\x00\x04\x00', '\x00\x05\x00', '\x00\x09\x00\x00'):
+            self.assertIsNone(parse_any(raw), repr(raw))
+
+    def test_error_without_message(self):
+        err = parse_any('\x00\x05\x00\x01')
+        self.assertEqual((err.code, err.message), (1, u''))
+
+
+if __name__ == '__main__':
+    unittest.main()
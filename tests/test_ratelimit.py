@@ -0,0 +1,61 @@
+# -*- coding:utf-8 -*-
+
+import unittest
+
+from gtftp import ratelimit
+from gtftp.ratelimit import RateLimit
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class RateLimitTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self._time = ratelimit.time
+        ratelimit.time = self.clock
+
+    def tearDown(self):
+        ratelimit.time = self._time
+
+    def allowed(self, limit, source, count):
+        return sum(1 for _ in xrange(count) if limit.allow(source))
+
+    def test_burst_and_refill(self):
+        limit = RateLimit(rate=2, burst=4)
+        self.assertEqual(self.allowed(limit, u'10.0.0.1', 10), 4)
+        # other sources have their own bucket
+        self.assertEqual(self.allowed(limit, u'10.0.0.2', 10), 4)
+
+        self.clock.now += 1.0
+        self.assertEqual(self.allowed(limit, u'10.0.0.1', 10), 2)
+        self.clock.now += 0.25
+        self.assertEqual(self.allowed(limit, u'10.0.0.1', 10), 0)
+        self.clock.now += 0.25
+        self.assertEqual(self.allowed(limit, u'10.0.0.1', 10), 1)
+
+        # refilled up to burst only
+        self.clock.now += 100
+        self.assertEqual(self.allowed(limit, u'10.0.0.1', 10), 4)
+
+    def test_lru_eviction(self):
+        limit = RateLimit(rate=1, burst=1, max_sources=2)
+        self.assertTrue(limit.allow(u'a'))
+        self.assertTrue(limit.allow(u'b'))
+        self.assertFalse(limit.allow(u'a'))     # a is the most recent
+        self.assertTrue(limit.allow(u'c'))      # b is evicted
+        self.assertEqual(len(limit), 2)
+
+        self.assertFalse(limit.allow(u'a'))     # a is remembered
+        # b was forgotten, it starts again with a full bucket
+        self.assertTrue(limit.allow(u'b'))
+        self.assertEqual(len(limit), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+# -*- coding:utf-8 -*-
+
+import io
+import struct
+import time
+import unittest
+
+import gevent
+from gevent import socket
+
+from gtftp.handler import BaseReadHandler, Target
+from gtftp.packet import Request
+from gtftp.prefetch import Prefetch
+
+from .client import request, rrq
+from .server import HandlerServer
+
+
+class StringTarget(Target):
+    def __init__(self, content):
+        self._io = io.BytesIO(content)
+        self._size = len(content)
+
+    def read(self, n):
+        return self._io.read(n)
+
+    def size(self):
+        return self._size
+
+    def close(self):
+        pass
+
+
+class ReadHandler(BaseReadHandler):
+    content = ''
+
+    def get_target(self, path):
+        return StringTarget(self.content)
+
+
+class StringResponseData(Target):
+    # README example, read() returns unicode.
+    def __init__(self, path):
+        if not isinstance(path, unicode):
+            path = str(path).decode('utf-8')
+
+        content = (path + u"\n") * 30
+        self._size = len(content)
+        self._io = io.StringIO(content)
+
+    def read(self, n):
+        return self._io.read(n)
+
+    def size(self):
+        return self._size
+
+    def close(self):
+        self._io.close()
+
+
+class StringResponseHandler(BaseReadHandler):
+    def get_target(self, path):
+        return StringResponseData(path)
+
+
+class PrefetchStringResponseHandler(StringResponseHandler):
+    PREFETCH = Prefetch(read_ahead=1024)
+
+
+class NoFastRetransmitHandler(ReadHandler):
+    DUPACK_THRESHOLD = None
+
+
+def lossy_rrq(handler_class, blksize, windowsize, lost, ack_duplicates=False, keep=False):
+    """
+        read with a client acknowledging every block received out of
+        order with the last block received in order, the first copy of
+        blocks in lost is dropped.
+
+        ack_duplicates -> also acknowledge blocks received twice.
+        keep -> keep blocks received out of order, instead of dropping.
+
+        return (content, number of DATA packets received).
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(5)
+    options = {'blksize': blksize, 'windowsize': windowsize}
+    req = Request.parse(request(1, 'file', 'octet', options))
+    handler = handler_class(req, ('127.0.0.1', 0), sock.getsockname(), 3, 1)
+    session = gevent.spawn(handler.run)
+
+    lost = set(lost)
+    data = []
+    pending = {}
+    received = 0
+    try:
+        packet, peer = sock.recvfrom(65536)     # OACK
+        sock.sendto(struct.pack('!HH', 4, 0), peer)
+        expected = 1
+        while True:
+            packet, peer = sock.recvfrom(65536)
+            received += 1
+            block = struct.unpack('!H', packet[2:4])[0]
+            if block in lost:
+                lost.discard(block)
+                continue
+
+            if block != expected:
+                if keep and block > expected:
+                    pending[block] = packet
+                if ack_duplicates or block > expected:
+                    sock.sendto(struct.pack('!HH', 4, expected - 1), peer)
+                continue
+
+            while packet is not None:
+                data.append(packet[4:])
+                last = len(packet) - 4 < blksize
+                if last or expected % windowsize == 0:
+                    sock.sendto(struct.pack('!HH', 4, expected), peer)
+                expected += 1
+                packet = pending.pop(expected, None)
+            if last:
+                break
+    finally:
+        session.join(timeout=5)
+        session.kill()
+        sock.close()
+    return ''.join(data), received
+
+
+class FastRetransmitTest(unittest.TestCase):
+    BLOCKS = 200
+    LOST = [20, 57, 58, 130]
+
+    def setUp(self):
+        ReadHandler.content = ''.join(chr(i % 251) for i in xrange(self.BLOCKS * 1400 + 100))
+
+    def assertTransfer(self, handler_class, lost, **kwargs):
+        data, received = lossy_rrq(handler_class, 1400, 16, lost, **kwargs)
+        self.assertEqual(data, ReadHandler.content)
+        return received
+
+    def test_no_loss(self):
+        self.assertEqual(self.assertTransfer(ReadHandler, []), self.BLOCKS + 1)
+
+    def test_losses_do_not_multiply_traffic(self):
+        received = self.assertTransfer(ReadHandler, self.LOST)
+        # a loss costs at most the rest of its window, twice
+        self.assertLess(received, self.BLOCKS + 1 + len(self.LOST) * 2 * 16)
+        self.assertLessEqual(received, self.assertTransfer(NoFastRetransmitHandler, self.LOST))
+
+    def test_duplicate_acks_do_not_multiply_traffic(self):
+        with_fast = self.assertTransfer(ReadHandler, self.LOST, ack_duplicates=True)
+        without = self.assertTransfer(NoFastRetransmitHandler, self.LOST, ack_duplicates=True)
+        self.assertLessEqual(with_fast, without)
+
+    def test_fast_retransmit_before_timeout(self):
+        # first block of a window lost: ACKs of the previous window
+        # are duplicated, only fast retransmit resends it before the
+        # timeout (1 s).
+        start = time.time()
+        received = self.assertTransfer(ReadHandler, [17], keep=True)
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual(received, self.BLOCKS + 2)
+
+
+class UnicodeTargetTest(unittest.TestCase):
+    def setUp(self):
+        self.server = HandlerServer(StringResponseHandler).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_read(self):
+        content, oack = rrq(self.server.address, 'hello', {'blksize': 8, 'tsize': 0})
+        self.assertEqual(content, 'hello\n' * 30)
+        self.assertEqual(oack['tsize'], str(len(content)))
+
+    def test_read_netascii(self):
+        content, _ = rrq(self.server.address, 'hello', mode='netascii')
+        self.assertEqual(content, 'hello\r\n' * 30)
+
+    def test_read_prefetch(self):
+        self.server.read_handler = PrefetchStringResponseHandler
+        content, _ = rrq(self.server.address, 'hello', {'blksize': 8})
+        self.assertEqual(content, 'hello\n' * 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+# -*- coding:utf-8 -*-
+
+import unittest
+
+from gtftp.handler import BaseReadHandler, BaseWriteHandler
+from gtftp.packet import Request
+from gtftp.rtt import RttEstimator
+
+from .client import request
+
+
+class RttEstimatorTest(unittest.TestCase):
+    def test_floor(self):
+        rtt = RttEstimator(5)
+        for i in range(20):
+            rtt.sample(0.0005)
+        self.assertEqual(rtt.timeout, RttEstimator.MIN_TIMEOUT)
+        self.assertGreaterEqual(RttEstimator.MIN_TIMEOUT, 0.2)
+
+    def test_backoff(self):
+        rtt = RttEstimator(1, min_timeout=0.3)
+        rtt.sample(0.001)
+        self.assertEqual(rtt.timeout, 0.3)
+        self.assertFalse(rtt.backoff())
+        self.assertEqual(rtt.timeout, 0.6)
+        self.assertFalse(rtt.backoff())
+        self.assertEqual(rtt.timeout, 1.0)
+        self.assertTrue(rtt.backoff())
+
+
+def session_timer(handler_class, opcode, options=None):
+    req = Request.parse(request(opcode, 'file', 'octet', options))
+    handler = handler_class(req, ('127.0.0.1', 0), ('127.0.0.1', 1), 3, 5)
+    handler._apply_options()
+    handler._init_timer()
+    for i in range(20):
+        handler._rtt.sample(0.0005)
+    return handler._rtt.timeout
+
+
+class HandlerTimerTest(unittest.TestCase):
+    def test_handler_floor(self):
+        for handler_class, opcode in ((BaseReadHandler, 1), (BaseWriteHandler, 2)):
+            self.assertEqual(session_timer(handler_class, opcode), RttEstimator.MIN_TIMEOUT)
+
+            class Handler(handler_class):
+                MIN_TIMEOUT = 0.5
+            self.assertEqual(session_timer(Handler, opcode), 0.5)
+
+    def test_utimeout_below_floor(self):
+        self.assertEqual(session_timer(BaseReadHandler, 1, {'utimeout': 50000}), 0.05)
+        self.assertEqual(session_timer(BaseWriteHandler, 2, {'utimeout': 50000}), 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
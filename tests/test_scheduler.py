@@ -0,0 +1,90 @@
+# -*- coding:utf-8 -*-
+
+import time
+import unittest
+
+import gevent
+from gevent import Timeout
+
+from gtftp.scheduler import Scheduler
+
+
+class SchedulerTest(unittest.TestCase):
+    RESOLUTION = 0.01
+
+    def setUp(self):
+        self.scheduler = Scheduler(self.RESOLUTION)
+        self.deadline = self.scheduler.deadline()
+
+    def wait(self, seconds):
+        """
+            sleep, return seconds slept until the deadline expired,
+            None if it did not.
+        """
+        start = time.time()
+        try:
+            gevent.sleep(seconds)
+        except Timeout as e:
+            self.assertIs(e, self.deadline.exception)
+            return time.time() - start
+        return None
+
+    def test_fires_within_one_tick(self):
+        self.deadline.start(0.05)
+        elapsed = self.wait(1)
+        self.assertIsNotNone(elapsed)
+        self.assertGreaterEqual(elapsed, 0.05 - 0.001)
+        # expires up to a tick late, plus scheduling noise
+        self.assertLess(elapsed, 0.05 + self.RESOLUTION + 0.01)
+        self.assertFalse(self.deadline.pending)
+        self.assertEqual(self.scheduler.stats()[u'fired'], 1)
+
+    def test_cancel_before_fire(self):
+        self.deadline.start(0.03)
+        self.assertIsNone(self.wait(0.01))
+        self.deadline.cancel()
+        self.assertIsNone(self.wait(0.05))
+        self.assertEqual(self.scheduler.stats(), {u'scheduled': 0, u'fired': 0, u'moved': 0})
+        # the timer stops with the heap empty
+        self.assertIsNone(self.scheduler._timer)
+
+    def test_rearm(self):
+        self.deadline.start(0.03)
+        self.assertIsNone(self.wait(0.02))
+        # pushed back, before the first deadline
+        self.deadline.start(0.03)
+        self.assertIsNone(self.wait(0.02))
+        elapsed = self.wait(1)
+        self.assertIsNotNone(elapsed)
+        self.assertLess(elapsed, 0.01 + self.RESOLUTION + 0.01)
+
+        stats = self.scheduler.stats()
+        self.assertEqual(stats[u'fired'], 1)
+        self.assertEqual(stats[u'moved'], 1)
+
+    def test_rearm_earlier(self):
+        self.deadline.start(1)
+        self.deadline.start(0.02)
+        self.assertIsNotNone(self.wait(0.5))
+        # the entry of the first deadline is stale
+        self.deadline.cancel()
+        self.assertIsNone(self.wait(0.05))
+        self.assertEqual(self.scheduler.stats()[u'fired'], 1)
+
+    def test_deadlines_of_greenlets(self):
+        expired = []
+
+        def session(seconds):
+            deadline = self.scheduler.deadline()
+            deadline.start(seconds)
+            try:
+                gevent.sleep(1)
+            except Timeout:
+                expired.append(seconds)
+
+        gevent.joinall([gevent.spawn(session, s) for s in (0.04, 0.02, 0.03)])
+        self.assertEqual(expired, [0.02, 0.03, 0.04])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+# -*- coding:utf-8 -*-
+
+import struct
+import unittest
+
+import gevent
+from gevent import socket
+
+from gtftp.admission import Admission
+from gtftp.ratelimit import RateLimit
+from gtftp.server import Server
+
+from .client import request
+from .server import HandlerServer
+from .test_read_handler import StringResponseHandler
+
+
+class Client(object):
+    """
+        sends requests from a port of its own, reads nothing
+        (sessions wait for its ACKs).
+    """
+
+    def __init__(self, address):
+        self._address = address
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(2)
+
+    def send(self, path):
+        self.sock.sendto(request(1, path), self._address)
+
+    def recv(self):
+        return self.sock.recvfrom(65536)
+
+    def close(self):
+        self.sock.close()
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = HandlerServer(StringResponseHandler, retries=3, timeout=1).start()
+        self.clients = []
+
+    def tearDown(self):
+        self.server.stop()
+        for client in self.clients:
+            client.close()
+
+    def client(self):
+        client = Client(self.server.address)
+        self.clients.append(client)
+        return client
+
+    def test_retransmitted_request(self):
+        client = self.client()
+        client.send('a')
+        client.send('a')    # before the session has started
+        client.recv()
+        for _ in xrange(2):
+            client.send('a')
+        gevent.sleep(0.05)
+
+        stats = self.server.stats()
+        self.assertEqual(stats[u'sessions'], 1)
+        self.assertEqual(stats[u'duplicates'], 3)
+        sessions = self.server.sessions()
+        self.assertEqual(len(sessions), 1)
+        self.assertEqual(sessions[0][u'path'], u'a')
+        self.assertEqual(sessions[0][u'peer'], client.sock.getsockname())
+
+        # another file, or another peer: other sessions
+        client.send('b')
+        self.client().send('a')
+        gevent.sleep(0.05)
+        self.assertEqual(self.server.stats()[u'sessions'], 3)
+
+    def test_filters(self):
+        self.server.RATE_LIMIT = RateLimit(rate=0.001, burst=2)
+        client = self.client()
+        for path in ('a', 'b', 'c', 'd'):
+            client.send(path)
+        gevent.sleep(0.05)
+        stats = self.server.stats()
+        self.assertEqual(stats[u'sessions'], 2)
+        self.assertEqual(stats[u'limited'], 2)
+
+        # ACK of an ended transfer: answered, garbage is not
+        # (unless over the rate limit too, like requests)
+        self.server.RATE_LIMIT = None
+        other = self.client()
+        other.sock.sendto('\x00\x09garbage', self.server.address)
+        other.sock.sendto(struct.pack('!HH', 4, 1), self.server.address)
+        packet, _ = other.recv()
+        self.assertEqual(struct.unpack('!HH', packet[:4]), (5, 5))    # UNKNOWN_TRANSFER_ID
+        self.assertEqual(self.server.stats()[u'invalid'], 2)
+
+    def test_admission_skips_retransmitted_requests(self):
+        self.server.ADMISSION = Admission(max_active=1, max_queued=1)
+        first = self.client()
+        first.send('a')
+        first.recv()    # its session is running
+        for _ in xrange(3):
+            first.send('a')
+        gevent.sleep(0.05)
+
+        self.client().send('b')
+        gevent.sleep(0.05)
+        stats = self.server.stats()
+        self.assertEqual(stats[u'duplicates'], 3)
+        self.assertEqual(stats[u'queued'], 1)
+        self.assertEqual(stats[u'shed'], 0)
+
+
+class Stop(Exception):
+    pass
+
+
+class SupervisorServer(Server):
+    STATS_INTERVAL = 0.05
+
+    def __init__(self):
+        super(SupervisorServer, self).__init__(u'127.0.0.1', 0, workers=2)
+        self.reports = []
+
+    def report_stats(self, stats):
+        self.reports.append(stats)
+        if len(self.reports) == 3:
+            raise Stop()
+
+
+class SupervisorTest(unittest.TestCase):
+    def test_report_stats(self):
+        server = SupervisorServer()
+        with self.assertRaises(Stop):
+            server.serve()
+
+        stats = server.reports[-1]
+        self.assertEqual(stats[u'workers'], 2)
+        self.assertEqual(stats[u'requests'], 0)
+        # workers were stopped
+        self.assertEqual(server.stats()[u'workers'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+# -*- coding:utf-8 -*-
+
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+
+from gtftp.handler import BaseWriteHandler, Target
+from gtftp.target import MmapFileTarget, preallocate
+
+from .client import TftpError, wrq
+from .server import HandlerServer
+
+
+class TempDirTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def create(self, name, content):
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+
+class MmapFileTargetTest(TempDirTest):
+    def test_read(self):
+        target = MmapFileTarget(self.create('file', 'abc' * 1000))
+        buf = bytearray(512)
+        self.assertEqual(target.readinto(memoryview(buf)), 512)
+        self.assertEqual(str(buf), ('abc' * 1000)[:512])
+        self.assertEqual(target.read(), ('abc' * 1000)[512:])
+        target.close()
+
+    def test_truncated_while_served(self):
+        content = 'x' * 8192 + 'y' * 8192
+        path = self.create('file', content)
+        target = MmapFileTarget(path)
+        self.assertEqual(target.read(4096), content[:4096])
+
+        with open(path, 'r+b') as f:
+            f.truncate(6000)
+        # past the end of the file: no SIGBUS, a short read.
+        self.assertEqual(target.read(4096), content[4096:6000])
+        buf = bytearray(4096)
+        self.assertEqual(target.readinto(memoryview(buf)), 0)
+        self.assertEqual(str(target.view(8192, 4096)), '')
+        target.close()
+
+
+class FileTarget(Target):
+    # LocalFileTarget of the README, recording allocate/truncate.
+    def __init__(self, path):
+        self._file = open(path, 'wb+')
+        self.calls = []
+
+    def write(self, data):
+        self._file.write(data)
+
+    def allocate(self, size):
+        self.calls.append((u'allocate', size))
+        preallocate(self._file.fileno(), size)
+
+    def truncate(self, size):
+        self.calls.append((u'truncate', size))
+        self._file.flush()
+        self._file.truncate(size)
+
+    def close(self):
+        self._file.close()
+
+
+class FileWriteHandler(BaseWriteHandler):
+    root = None
+    targets = []
+
+    def get_target(self, path):
+        target = FileTarget(os.path.join(self.root, path))
+        self.targets.append(target)
+        return target
+
+
+class PreallocateTest(TempDirTest):
+    def setUp(self):
+        super(PreallocateTest, self).setUp()
+        FileWriteHandler.root = self.root
+        FileWriteHandler.targets = []
+        self.server = HandlerServer(write_handler=FileWriteHandler).start()
+
+    def tearDown(self):
+        self.server.stop()
+        super(PreallocateTest, self).tearDown()
+
+    def upload(self, size, tsize):
+        content = ''.join(chr(i % 251) for i in xrange(size))
+        wrq(self.server.address, 'file', content, {'tsize': tsize, 'blksize': 1024})
+        with open(os.path.join(self.root, 'file'), 'rb') as f:
+            self.assertEqual(f.read(), content)
+        return FileWriteHandler.targets[-1].calls
+
+    def test_preallocate(self):
+        path = self.create('file', 'abc')
+        with open(path, 'r+b') as f:
+            preallocate(f.fileno(), 10000)
+            # never shrinks
+            preallocate(f.fileno(), 10)
+        self.assertEqual(os.path.getsize(path), 10000)
+
+    def test_preallocate_disk_full(self):
+        path = self.create('file', '')
+        vfs = os.statvfs(self.root)
+        with open(path, 'r+b') as f:
+            with self.assertRaises(IOError) as cm:
+                preallocate(f.fileno(), vfs.f_bavail * vfs.f_frsize + 2 ** 30)
+        self.assertEqual(cm.exception.errno, errno.ENOSPC)
+
+    def test_tsize_exact(self):
+        self.assertEqual(self.upload(5000, 5000), [(u'allocate', 5000)])
+
+    def test_tsize_short(self):
+        self.assertEqual(self.upload(3000, 5000), [(u'allocate', 5000), (u'truncate', 3000)])
+
+    def test_tsize_short_block_aligned(self):
+        self.assertEqual(self.upload(2048, 5000), [(u'allocate', 5000), (u'truncate', 2048)])
+
+    def test_tsize_over(self):
+        with self.assertRaises(TftpError) as cm:
+            self.upload(6000, 5000)
+        self.assertEqual(cm.exception.code, 3)     # DISK_FULL
+        target = FileWriteHandler.targets[-1]
+        # block 5 goes past tsize, the blocks before it were not
+        # written yet (buffered): nothing of the announced size is left.
+        self.assertEqual(target.calls, [(u'allocate', 5000), (u'truncate', 0)])
+        self.assertEqual(os.path.getsize(os.path.join(self.root, 'file')), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+# -*- coding:utf-8 -*-
+
+import struct
+import unittest
+
+import gevent
+from gevent import socket
+
+from gtftp.handler import BaseWriteHandler, Target
+from gtftp.packet import Request
+
+from .client import request
+
+
+class MemoryTarget(Target):
+    def __init__(self):
+        self.writes = []
+        self.closed = False
+
+    def write(self, data):
+        self.writes.append(data)
+
+    def close(self):
+        self.closed = True
+
+
+class WriteHandler(BaseWriteHandler):
+    def __init__(self, *args):
+        super(WriteHandler, self).__init__(*args)
+        self.target = MemoryTarget()
+        self.samples = []
+
+    def get_target(self, path):
+        return self.target
+
+    def _init_timer(self):
+        super(WriteHandler, self)._init_timer()
+        sample = self._rtt.sample
+
+        def record(rtt):
+            self.samples.append(rtt)
+            sample(rtt)
+        self._rtt.sample = record
+
+
+class SmallChunkWriteHandler(WriteHandler):
+    WRITE_CHUNK_SIZE = 2048
+
+
+class WriteSessionTest(unittest.TestCase):
+    BLKSIZE = 512
+
+    def setUp(self):
+        self.content = ''.join(chr(i % 251) for i in xrange(self.BLKSIZE * 10 + 100))
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(2)
+        self.session = None
+
+    def tearDown(self):
+        if self.session is not None:
+            self.session.kill()
+        self.sock.close()
+
+    def start(self, handler_class, windowsize):
+        options = {'blksize': self.BLKSIZE, 'windowsize': windowsize}
+        req = Request.parse(request(2, 'file', 'octet', options))
+        self.handler = handler_class(req, ('127.0.0.1', 0), self.sock.getsockname(), 3, 1)
+        self.session = gevent.spawn(self.handler.run)
+        _, self.peer = self.sock.recvfrom(65536)    # OACK
+
+    def send(self, *blocks):
+        for block in blocks:
+            chunk = self.content[(block - 1) * self.BLKSIZE:block * self.BLKSIZE]
+            self.sock.sendto(struct.pack('!HH', 3, block) + chunk, self.peer)
+
+    def acks(self, count):
+        acks = []
+        for _ in xrange(count):
+            packet, _ = self.sock.recvfrom(65536)
+            opcode, block = struct.unpack('!HH', packet[:4])
+            self.assertEqual(opcode, 4)
+            acks.append(block)
+        return acks
+
+    def test_reordered_window_and_duplicate(self):
+        self.start(WriteHandler, 4)
+        # 2 late, 3 duplicated
+        self.send(1, 3, 2, 4, 3, 5, 6, 7, 8, 9, 10, 11)
+        self.assertEqual(self.acks(4), [1, 5, 9, 11])
+        self.session.join(timeout=2)
+
+        self.assertEqual(''.join(self.handler.target.writes), self.content)
+        # coalesced, written once at the end
+        self.assertEqual(len(self.handler.target.writes), 1)
+        self.assertTrue(self.handler.target.closed)
+
+    def test_write_chunks(self):
+        self.start(SmallChunkWriteHandler, 4)
+        self.send(*xrange(1, 12))
+        self.assertEqual(self.acks(3), [4, 8, 11])
+        self.session.join(timeout=2)
+
+        writes = self.handler.target.writes
+        self.assertEqual(''.join(writes), self.content)
+        self.assertEqual([len(w) for w in writes], [2048, 2048, 1124])
+
+    def test_karn_rule_after_gap(self):
+        self.start(WriteHandler, 4)
+        self.send(1, 2, 3, 4)
+        self.assertEqual(self.acks(1), [4])
+        # 5 lost: the gap ACK is answered by a retransmission of 5,
+        # it must not be timed.
+        self.send(6)
+        self.assertEqual(self.acks(1), [4])
+        gevent.sleep(0.1)
+        self.send(5, 7, 8, 9, 10, 11)
+        # the window restarts at the gap ACK
+        self.assertEqual(self.acks(2), [8, 11])
+        self.session.join(timeout=2)
+
+        self.assertEqual(''.join(self.handler.target.writes), self.content)
+        # no sample of the time from ACK 4 to the retransmitted 5
+        self.assertTrue(self.handler.samples)
+        self.assertLess(max(self.handler.samples), 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()